@@ -1,26 +1,212 @@
 #!/usr/bin/env python3
 
-import components.gamectrl
-import components.crsout
-import components.crsin
+import time
 
+# taken before the other imports, so the startup profile includes them
+_START_TIME = time.perf_counter()
+
+import argparse
 import curses
 import os
+import sys
+
+# input polling period, when the background work is done
+_BACKGROUND_POLL_MS = 10
+# shorter one lets the autoplay run at the engine speed
+_AUTOPLAY_POLL_MS = 1
+
+class _StartupProfile:
+    """
+    Startup time profile
+
+    Records the time of the startup milestones, measured from the
+    script start, and reports them after the game ends.
+    """
+
+    def __init__(self, start_time):
+        self._start_time = start_time
+        self._milestones = []
+
+    def mark(self, name):
+        self._milestones.append((name, time.perf_counter()))
+
+    def report(self, file):
+        print("startup profile:", file = file)
+
+        previous_time = self._start_time
+        for (name, milestone_time) in self._milestones:
+            print("  {:<20} {:8.2f} ms (+{:.2f} ms)".format(
+                    name,
+                    (milestone_time - self._start_time) * 1000,
+                    (milestone_time - previous_time) * 1000),
+                    file = file)
+            previous_time = milestone_time
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+            description = "2048 game copy for the terminal")
+    parser.add_argument("--startup-profile", action = "store_true",
+            help = "report the time-to-first-frame on exit")
+    parser.add_argument("--broadcast", metavar = "SOCKET",
+            help = "stream the game to the viewers on the Unix socket")
+    parser.add_argument("--spectate", metavar = "SOCKET",
+            help = "watch the game streamed on the Unix socket")
+    parser.add_argument("--autoplay", action = "store_true",
+            help = "let the AI play the game")
+    parser.add_argument("--autoplay-time", metavar = "SECONDS",
+            type = float, default = 0.1,
+            help = "AI thinking time per move (default: %(default)s)")
+    parser.add_argument("--autoplay-workers", metavar = "N", type = int,
+            help = "AI worker processes (default: number of CPUs)")
+    parser.add_argument("--autoplay-depth", metavar = "N", type = int,
+            help = "AI search depth limit (default: none)")
+    parser.add_argument("--autoplay-book", metavar = "FILE",
+            help = "AI opening book, created if missing, which keeps "
+            "the searched positions across the runs")
+    parser.add_argument("--metrics", metavar = "PORT|SOCKET",
+            help = "serve the metrics in the Prometheus text format on "
+            "the local TCP port, or the Unix socket")
+    parser.add_argument("--max-fps", metavar = "N", type = float,
+            help = "render at most N frames per second, 0 renders only "
+            "on keys, and at the game end (default: every move)")
+    parser.add_argument("--hints", action = "store_true",
+            help = "suggest the moves in the status line")
+    return parser.parse_args()
+
+def spectate(stdscr, socket_path):
+    import components.broadcast
+
+    curses.curs_set(0)
+
+    viewer = components.broadcast.BroadcastViewer(stdscr, socket_path)
+    viewer.run()
+
+def main(stdscr, args, profile):
+    profile.mark("curses init")
+
+    # components are imported only when the game really starts, and the
+    # heavy ones (AI, batch engines, tables) are imported on first use
+    import components.gamectrl
+    import components.crsout
+    import components.crsin
+
+    profile.mark("imports")
 
-def main(stdscr):
     curses.curs_set(0)
 
     gc = components.gamectrl.GameController()
     co = components.crsout.CursesOutput(stdscr, gc)
     ci = components.crsin.CursesInput(stdscr, gc, co)
 
+    # output draws the first frame while being constructed
+    profile.mark("first frame")
+
+    if args.autoplay or args.hints:
+        import components.ai
+
+        # one search, and its transposition table, is shared by the
+        # autoplay, and the hints; it is made before the other threads
+        # are started, so its workers are forked from the only thread
+        search = components.ai.ParallelSearch(
+                args.autoplay_workers if args.autoplay else 1,
+                spawn_distribution = gc.get_spawn_distribution())
+    else:
+        search = None
+
+    if args.metrics != None:
+        import components.metrics
+
+        registry = components.metrics.MetricsRegistry()
+        gc.attach_metrics(components.metrics.GameMetrics(registry))
+        curses_metrics = components.metrics.CursesMetrics(registry)
+        co.attach_metrics(curses_metrics)
+        ci.attach_metrics(curses_metrics)
+
+        metrics_address = ("127.0.0.1", int(args.metrics)) \
+                if args.metrics.isdigit() else args.metrics
+        metrics_server = components.metrics.MetricsServer(
+                registry, metrics_address)
+    else:
+        metrics_server = None
+
+    if args.broadcast != None:
+        import components.broadcast
+
+        publisher = components.broadcast.BroadcastPublisher(
+                gc, args.broadcast)
+    else:
+        publisher = None
+
+    # background workers are polled from the main loop, which is the
+    # only one using curses
+    background_workers = []
+
+    if args.autoplay and args.autoplay_book != None:
+        import components.book
+
+        opening_book = components.book.OpeningBook(args.autoplay_book,
+                spawn_distribution = gc.get_spawn_distribution())
+    else:
+        opening_book = None
+
+    if args.autoplay:
+        background_workers.append(components.ai.Autoplayer(gc, co,
+                time_limit = args.autoplay_time,
+                workers_cnt = args.autoplay_workers,
+                max_depth = args.autoplay_depth,
+                opening_book = opening_book,
+                search = search))
+
+    if args.hints:
+        background_workers.append(components.ai.HintAdvisor(gc, co,
+                search = search))
+
+    if args.autoplay:
+        ci.set_input_timeout(_AUTOPLAY_POLL_MS)
+    elif background_workers != []:
+        # input is polled, so the work is done while waiting for keys
+        ci.set_input_timeout(_BACKGROUND_POLL_MS)
+
+    if args.max_fps != None:
+        co.set_max_fps(args.max_fps)
+        # throttled frames are rendered from the main loop
+        if args.max_fps > 0 and background_workers == []:
+            ci.set_input_timeout(_BACKGROUND_POLL_MS)
+
     gc.resume_game()
 
     while(gc.is_active()):
         ci.get_input()
+        for background_worker in background_workers:
+            background_worker.poll()
+        co.render_pending()
+
+    for background_worker in background_workers:
+        background_worker.close()
+
+    if search != None:
+        search.close()
+
+    if opening_book != None:
+        opening_book.close()
+
+    if publisher != None:
+        publisher.close()
+
+    if metrics_server != None:
+        metrics_server.close()
 
 if __name__ == "__main__":
+    args = _parse_args()
+    profile = _StartupProfile(_START_TIME)
+
     # needed for the faster reaction of <ESC> key
     os.environ["ESCDELAY"] = "10"
 
-    curses.wrapper(main)
+    if args.spectate != None:
+        curses.wrapper(spectate, args.spectate)
+    else:
+        curses.wrapper(main, args, profile)
+
+    if args.startup_profile:
+        profile.report(sys.stderr)
@@ -0,0 +1,288 @@
+/*
+ * Move kernel for the 2048 game
+ *
+ * Compiled counterpart of the pure-Python board manipulation found in
+ * `gamectrl`. The board is a row-major array of `int32_t` tile values,
+ * with free tiles marked by the given free tile value.
+ *
+ * Additionally, has the evaluation of the 4x4 boards searched by the `ai`
+ * module, packed in the 64-bit integers.
+ *
+ * Build with:
+ *
+ *     python3 -m components.movekern build
+ */
+
+#include <stdint.h>
+
+/* direction codes, the same as `gamectrl.MovementDirections` values */
+#define MK_UP 1
+#define MK_DOWN 2
+#define MK_LEFT 3
+#define MK_RIGHT 4
+
+/*
+ * Move and merge the pieces on the direction line
+ *
+ * Direct port of `GameController._move_merge_pieces_dl`, the tiles on
+ * the line are addressed through the `line` index array.
+ */
+static int64_t move_merge_line(int32_t *tiles, const int *line,
+        int line_length, int32_t free_value, int *moved, int *merges)
+{
+    int cursor_index = 0;
+    int free_tile_index = -1;
+    int merging_piece_index = -1;
+
+    int64_t merging_score = 0;
+
+    while (cursor_index < line_length) {
+        int32_t piece_val = tiles[line[cursor_index]];
+
+        if (piece_val == free_value) {
+            /* the tile is free */
+
+            if (free_tile_index == -1)
+                free_tile_index = cursor_index;
+
+            cursor_index++;
+        } else if (merging_piece_index != -1 &&
+                tiles[line[merging_piece_index]] == piece_val) {
+            /* merge pieces */
+
+            tiles[line[cursor_index]] = free_value;
+            tiles[line[merging_piece_index]] = piece_val * 2;
+
+            merging_score += piece_val;
+            *moved = 1;
+            (*merges)++;
+
+            merging_piece_index = -1;
+        } else if (free_tile_index != -1) {
+            /* move the piece to the free tile */
+
+            tiles[line[free_tile_index]] = piece_val;
+            tiles[line[cursor_index]] = free_value;
+
+            merging_piece_index = free_tile_index;
+            *moved = 1;
+
+            free_tile_index++;
+            cursor_index++;
+        } else {
+            /* no merging, and no free tiles */
+
+            merging_piece_index = cursor_index;
+            cursor_index++;
+        }
+    }
+
+    return merging_score;
+}
+
+/*
+ * Piece movement, and merge, for the whole board
+ *
+ * Returns 1 if any piece was moved, 0 if not, and -1 for an unknown
+ * direction. The merging score, and the number of merges, are stored
+ * to the given locations.
+ */
+int mk_move(int32_t *tiles, int width, int height, int direction,
+        int32_t free_value, int64_t *score, int *merges)
+{
+    int outer_limit;
+    int line_length;
+    int moved = 0;
+
+    *score = 0;
+    *merges = 0;
+
+    switch (direction) {
+    case MK_UP:
+    case MK_DOWN:
+        outer_limit = width;
+        line_length = height;
+        break;
+    case MK_LEFT:
+    case MK_RIGHT:
+        outer_limit = height;
+        line_length = width;
+        break;
+    default:
+        return -1;
+    }
+
+    int line[line_length];
+
+    for (int sc_ind = 0; sc_ind < outer_limit; sc_ind++) {
+        for (int pr_ind = 0; pr_ind < line_length; pr_ind++) {
+            int row;
+            int col;
+
+            switch (direction) {
+            case MK_UP:
+                row = pr_ind;
+                col = sc_ind;
+                break;
+            case MK_DOWN:
+                row = height - pr_ind - 1;
+                col = sc_ind;
+                break;
+            case MK_LEFT:
+                row = sc_ind;
+                col = pr_ind;
+                break;
+            default:
+                row = sc_ind;
+                col = width - pr_ind - 1;
+                break;
+            }
+
+            line[pr_ind] = row * width + col;
+        }
+
+        *score += move_merge_line(tiles, line, line_length, free_value,
+                &moved, merges);
+    }
+
+    return moved;
+}
+
+/*
+ * Put the piece on the free tile with the given index
+ *
+ * Free tiles are counted in the row-major order. Returns the position
+ * of the new piece, or -1 if there is no such free tile.
+ */
+int mk_spawn(int32_t *tiles, int tiles_cnt, int32_t free_value,
+        int free_tile_index, int32_t value)
+{
+    int current_free_tile_index = 0;
+
+    for (int pos = 0; pos < tiles_cnt; pos++) {
+        if (tiles[pos] == free_value) {
+            if (current_free_tile_index == free_tile_index) {
+                tiles[pos] = value;
+                return pos;
+            }
+
+            current_free_tile_index++;
+        }
+    }
+
+    return -1;
+}
+
+/*
+ * Count the free tiles on the board
+ */
+int mk_free_tiles(const int32_t *tiles, int tiles_cnt, int32_t free_value)
+{
+    int free_tiles_cnt = 0;
+
+    for (int pos = 0; pos < tiles_cnt; pos++)
+        if (tiles[pos] == free_value)
+            free_tiles_cnt++;
+
+    return free_tiles_cnt;
+}
+
+/*
+ * Check if there are any valid moves available
+ */
+int mk_moves_available(const int32_t *tiles, int width, int height,
+        int32_t free_value)
+{
+    if (mk_free_tiles(tiles, width * height, free_value) > 0)
+        return 1;
+
+    for (int row = 0; row < height; row++)
+        for (int col = 0; col < width - 1; col++)
+            if (tiles[row * width + col] == tiles[row * width + col + 1])
+                return 1;
+
+    for (int col = 0; col < width; col++)
+        for (int row = 0; row < height - 1; row++)
+            if (tiles[row * width + col] ==
+                    tiles[(row + 1) * width + col])
+                return 1;
+
+    return 0;
+}
+
+/*
+ * Find the directions in which any piece can move
+ *
+ * Returns the bit mask, with the bit (direction code - 1) set for the
+ * direction in which any piece can move to the neighbouring free tile,
+ * or merge with the same neighbouring piece.
+ */
+int mk_legal_moves(const int32_t *tiles, int width, int height,
+        int32_t free_value)
+{
+    int mask = 0;
+
+    for (int row = 0; row < height; row++) {
+        for (int col = 0; col < width; col++) {
+            int32_t value = tiles[row * width + col];
+            int32_t other;
+
+            if (value == free_value)
+                continue;
+
+            if (row > 0) {
+                other = tiles[(row - 1) * width + col];
+                if (other == free_value || other == value)
+                    mask |= 1 << (MK_UP - 1);
+            }
+            if (row < height - 1) {
+                other = tiles[(row + 1) * width + col];
+                if (other == free_value || other == value)
+                    mask |= 1 << (MK_DOWN - 1);
+            }
+            if (col > 0) {
+                other = tiles[row * width + col - 1];
+                if (other == free_value || other == value)
+                    mask |= 1 << (MK_LEFT - 1);
+            }
+            if (col < width - 1) {
+                other = tiles[row * width + col + 1];
+                if (other == free_value || other == value)
+                    mask |= 1 << (MK_RIGHT - 1);
+            }
+        }
+    }
+
+    return mask;
+}
+
+/*
+ * Evaluate the 4x4 board, packed in the 64-bit integer
+ *
+ * Port of `ai._Searcher._heuristic`: the heuristic values of the rows,
+ * and of the columns, are looked up in the given table of the 2 ** 16
+ * values, and summed in the same order, so the result is the same as
+ * the pure-Python one, to the last bit.
+ */
+double mk_evaluate(uint64_t bits, const double *row_heuristic)
+{
+    uint64_t a;
+    uint64_t transposed;
+
+    /* same steps as `ai._transpose` */
+    a = (bits & 0xf0f00f0ff0f00f0fULL) |
+            ((bits & 0x0000f0f00000f0f0ULL) << 12) |
+            ((bits & 0x0f0f00000f0f0000ULL) >> 12);
+    transposed = (a & 0xff00ff0000ff00ffULL) |
+            ((a & 0x00ff00ff00000000ULL) >> 24) |
+            ((a & 0x00000000ff00ff00ULL) << 24);
+
+    return row_heuristic[bits & 0xffff] +
+            row_heuristic[(bits >> 16) & 0xffff] +
+            row_heuristic[(bits >> 32) & 0xffff] +
+            row_heuristic[(bits >> 48) & 0xffff] +
+            row_heuristic[transposed & 0xffff] +
+            row_heuristic[(transposed >> 16) & 0xffff] +
+            row_heuristic[(transposed >> 32) & 0xffff] +
+            row_heuristic[(transposed >> 48) & 0xffff];
+}
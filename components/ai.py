@@ -0,0 +1,1075 @@
+#!/usr/bin/env python3
+
+"""
+Game AI module
+
+Has the `ParallelSearch` class, the iterative-deepening expectimax
+search, split at the root between the worker processes, the
+`Autoplayer` class, which plays the game with it, and the `HintAdvisor`
+class, which suggests the moves to the player.
+
+Boards are searched as 64-bit integers, with the row `r`, and the column
+`c` tile in the bits `16 * r + 4 * c` to `16 * r + 4 * c + 3`, as the
+base-2 logarithm of the value (0 for the free tile). Moves are done
+with the row tables, built on the first use. Boards are evaluated by
+the compiled move kernel, if it is loaded.
+
+Running the module as a script reports the nodes per second, and the
+speedup over the single core.
+"""
+
+from . import gamectrl
+from . import movekern
+
+import random
+import struct
+import sys
+import threading
+import time
+
+# search directions, in the order they are tried
+DIRECTIONS = (
+        gamectrl.MovementDirections.up,
+        gamectrl.MovementDirections.down,
+        gamectrl.MovementDirections.left,
+        gamectrl.MovementDirections.right)
+
+# heuristic weights
+_LOST_PENALTY = 200000.0
+_MONOTONICITY_POWER = 4.0
+_MONOTONICITY_WEIGHT = 47.0
+_SUM_POWER = 3.5
+_SUM_WEIGHT = 11.0
+_MERGES_WEIGHT = 700.0
+_EMPTY_WEIGHT = 270.0
+
+# chance nodes less probable than this are evaluated heuristically
+_PROBABILITY_THRESHOLD = 0.0001
+
+# nodes searched between the deadline checks
+_DEADLINE_CHECK_NODES = 1024
+
+# period of the cancellation checks while waiting for the workers, in
+# seconds
+_CANCEL_CHECK_PERIOD = 0.01
+
+# shared buffer starts with the search generation word, followed by the
+# transposition table
+_GENERATION_SIZE = 8
+
+_ROW_MASK = 0xffff
+
+# the largest rank of the 4-bit tiles, which can't be merged
+_MAX_RANK = 0xf
+
+def get_heuristic_config():
+    """
+    Returns the heuristic weights, and the search pruning, as the tuple
+
+    Values stored from the searches are valid only for the same config.
+    """
+
+    return (_LOST_PENALTY, _MONOTONICITY_POWER, _MONOTONICITY_WEIGHT,
+            _SUM_POWER, _SUM_WEIGHT, _MERGES_WEIGHT, _EMPTY_WEIGHT,
+            _PROBABILITY_THRESHOLD)
+
+class _Tables:
+    """
+    Row tables
+
+    Tables are indexed by the row, with the first tile in the lowest
+    bits: `left` has the row moved towards the first tile, `right`
+    towards the last one, and `heuristic` the heuristic score of the
+    row.
+    """
+
+    def __init__(self):
+        self.left = [0] * (1 << 16)
+        self.right = [0] * (1 << 16)
+        self.heuristic = [0.0] * (1 << 16)
+        self._kernel_heuristic = None
+
+        for row in range(1 << 16):
+            tiles = [(row >> (4 * col)) & 0xf for col in range(4)]
+
+            self.heuristic[row] = _row_heuristic(tiles)
+
+            moved = _move_row_left(tiles)
+            moved_row = sum(tile << (4 * col)
+                    for (col, tile) in enumerate(moved))
+            self.left[row] = moved_row
+
+            # right move is the left move of the reversed row
+            reversed_row = _reverse_row(row)
+            self.right[reversed_row] = _reverse_row(moved_row)
+
+    def get_kernel_heuristic(self):
+        """
+        Returns the `heuristic` table as the array of the move kernel
+        """
+
+        if self._kernel_heuristic == None:
+            self._kernel_heuristic = movekern.new_heuristic_table(
+                    self.heuristic)
+
+        return self._kernel_heuristic
+
+_tables = None
+
+def _get_tables():
+    global _tables
+
+    if _tables == None:
+        _tables = _Tables()
+
+    return _tables
+
+def _reverse_row(row):
+    return ((row >> 12) & 0xf) | ((row >> 4) & 0xf0) | \
+            ((row << 4) & 0xf00) | ((row << 12) & 0xf000)
+
+def _move_row_left(tiles):
+    """
+    Move and merge the row towards the first tile
+
+    Same rules as `GameController._move_merge_pieces_dl`: every piece
+    merges at most once, the ones closer to the first tile first. The
+    pieces of the largest rank don't merge, as the merged piece has no
+    4-bit rank; boards with them are not searched (`is_board_supported`),
+    so only the deepest search nodes can have them.
+    """
+
+    pieces = [tile for tile in tiles if tile != 0]
+    moved = []
+
+    index = 0
+    while index < len(pieces):
+        if index + 1 < len(pieces) and \
+                pieces[index] == pieces[index + 1] and \
+                pieces[index] != _MAX_RANK:
+            moved.append(pieces[index] + 1)
+            index += 2
+        else:
+            moved.append(pieces[index])
+            index += 1
+
+    return moved + [0] * (len(tiles) - len(moved))
+
+def _row_heuristic(tiles):
+    empty = 0
+    merges = 0
+    rank_sum = 0.0
+
+    previous = 0
+    run = 0
+    for rank in tiles:
+        rank_sum += rank ** _SUM_POWER
+        if rank == 0:
+            empty += 1
+        else:
+            if previous == rank:
+                run += 1
+            elif run > 0:
+                merges += 1 + run
+                run = 0
+            previous = rank
+    if run > 0:
+        merges += 1 + run
+
+    monotonicity_left = 0.0
+    monotonicity_right = 0.0
+    for col in range(1, 4):
+        (first, second) = (tiles[col - 1], tiles[col])
+        first_power = first ** _MONOTONICITY_POWER
+        second_power = second ** _MONOTONICITY_POWER
+        if first > second:
+            monotonicity_left += first_power - second_power
+        else:
+            monotonicity_right += second_power - first_power
+
+    return _LOST_PENALTY + _EMPTY_WEIGHT * empty + \
+            _MERGES_WEIGHT * merges - \
+            _MONOTONICITY_WEIGHT * min(
+                    monotonicity_left, monotonicity_right) - \
+            _SUM_WEIGHT * rank_sum
+
+def _transpose(bits):
+    a1 = bits & 0xf0f00f0ff0f00f0f
+    a2 = bits & 0x0000f0f00000f0f0
+    a3 = bits & 0x0f0f00000f0f0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xff00ff0000ff00ff
+    b2 = a & 0x00ff00ff00000000
+    b3 = a & 0x00000000ff00ff00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+def _move_rows(bits, table):
+    return table[bits & _ROW_MASK] | \
+            (table[(bits >> 16) & _ROW_MASK] << 16) | \
+            (table[(bits >> 32) & _ROW_MASK] << 32) | \
+            (table[(bits >> 48) & _ROW_MASK] << 48)
+
+def move_board_bits(bits, movement_direction):
+    """
+    Returns the board moved in the given direction
+    """
+
+    tables = _get_tables()
+    mds = gamectrl.MovementDirections
+
+    if movement_direction == mds.left:
+        return _move_rows(bits, tables.left)
+    elif movement_direction == mds.right:
+        return _move_rows(bits, tables.right)
+    elif movement_direction == mds.up:
+        return _transpose(_move_rows(_transpose(bits), tables.left))
+    else:
+        return _transpose(_move_rows(_transpose(bits), tables.right))
+
+def is_board_supported(game_ctrl):
+    """
+    Returns true value if the board of the game controller can be
+    searched
+
+    Only the 4x4 boards, with the pieces below 2 ** 15, are searched, so
+    the merges of the searched boards have the 4-bit ranks.
+    """
+
+    if game_ctrl.get_board_dimensions() != (4, 4):
+        return False
+
+    ftv = game_ctrl.get_free_tile_value()
+
+    return all(value == ftv or value.bit_length() - 1 < _MAX_RANK
+            for board_row in game_ctrl.get_board_state()
+            for value in board_row)
+
+def board_to_bits(game_ctrl):
+    """
+    Returns the board of the game controller as the 64-bit integer
+
+    Only the 4x4 boards, with the pieces up to 2 ** 15, can be
+    converted.
+    """
+
+    if game_ctrl.get_board_dimensions() != (4, 4):
+        raise ValueError("only 4x4 boards can be searched")
+
+    ftv = game_ctrl.get_free_tile_value()
+    bits = 0
+
+    for (row, board_row) in enumerate(game_ctrl.get_board_state()):
+        for (col, value) in enumerate(board_row):
+            if value != ftv:
+                rank = value.bit_length() - 1
+                if rank > 0xf:
+                    raise ValueError("piece too large to be searched")
+                bits |= rank << (16 * row + 4 * col)
+
+    return bits
+
+class _TranspositionTable:
+    """
+    Transposition table
+
+    Open-addressing table of the chance node values, in the given
+    buffer, which can be shared between the processes. Entries are
+    written without locking, so every entry holds its key mixed with
+    the stored data, and the torn entries are not matched.
+    """
+
+    # entry: check word, value bits, depth
+    _ENTRY_WORDS = 3
+
+    def __init__(self, buffer):
+        self._words = memoryview(buffer).cast("Q")
+        self._entries_cnt = len(self._words) // \
+                _TranspositionTable._ENTRY_WORDS
+        self._pack_value = struct.Struct("d").pack
+        self._unpack_bits = struct.Struct("Q").unpack
+
+    @staticmethod
+    def get_buffer_size(entries_cnt):
+        return entries_cnt * _TranspositionTable._ENTRY_WORDS * 8
+
+    def _index(self, bits):
+        # Fibonacci hashing spreads the similar boards
+        return ((bits * 0x9e3779b97f4a7c15) & 0xffffffffffffffff) % \
+                self._entries_cnt * _TranspositionTable._ENTRY_WORDS
+
+    def lookup(self, bits, depth):
+        """
+        Returns the value stored for the board, searched at least to the
+        given depth, or `None`
+        """
+
+        index = self._index(bits)
+        words = self._words
+        (check, value_bits, stored_depth) = words[index:index + 3]
+
+        if check ^ value_bits ^ stored_depth == bits and \
+                stored_depth >= depth:
+            return struct.unpack("d", struct.pack("Q", value_bits))[0]
+
+        return None
+
+    def store(self, bits, depth, value):
+        index = self._index(bits)
+        value_bits = self._unpack_bits(self._pack_value(value))[0]
+
+        self._words[index:index + 3] = memoryview(struct.pack("3Q",
+                bits ^ value_bits ^ depth, value_bits, depth)).cast("Q")
+
+    def release(self):
+        self._words.release()
+
+class _SearchTimeout(Exception):
+    pass
+
+class _Searcher:
+    """
+    Expectimax searcher, running in one process
+    """
+
+    def __init__(self, table, spawn_outcomes, use_move_kernel = True):
+        self._tables = _get_tables()
+        self._table = table
+        # (rank, probability) pairs
+        self._spawn_outcomes = spawn_outcomes
+
+        if use_move_kernel and movekern.is_loaded():
+            evaluate = movekern.get_kernel().mk_evaluate
+            kernel_heuristic = self._tables.get_kernel_heuristic()
+            self._heuristic = lambda bits: evaluate(bits, kernel_heuristic)
+
+        self.nodes = 0
+        self._deadline = None
+        self._is_cancelled = None
+
+    def evaluate_max(self, bits, depth, probability, deadline,
+            is_cancelled = None):
+        """
+        Returns the value of the max node, and the searched nodes count
+
+        Search is stopped with `_SearchTimeout` after the deadline, or
+        when `is_cancelled` returns true value.
+        """
+
+        self.nodes = 0
+        self._deadline = deadline
+        self._is_cancelled = is_cancelled
+
+        return (self._max_value(bits, depth, probability), self.nodes)
+
+    def _heuristic(self, bits):
+        heuristic = self._tables.heuristic
+        transposed = _transpose(bits)
+
+        return heuristic[bits & _ROW_MASK] + \
+                heuristic[(bits >> 16) & _ROW_MASK] + \
+                heuristic[(bits >> 32) & _ROW_MASK] + \
+                heuristic[(bits >> 48) & _ROW_MASK] + \
+                heuristic[transposed & _ROW_MASK] + \
+                heuristic[(transposed >> 16) & _ROW_MASK] + \
+                heuristic[(transposed >> 32) & _ROW_MASK] + \
+                heuristic[(transposed >> 48) & _ROW_MASK]
+
+    def _max_value(self, bits, depth, probability):
+        self.nodes += 1
+        if self.nodes % _DEADLINE_CHECK_NODES == 0 and (
+                (self._deadline != None and
+                time.monotonic() > self._deadline) or
+                (self._is_cancelled != None and self._is_cancelled())):
+            raise _SearchTimeout()
+
+        tables = self._tables
+        transposed = _transpose(bits)
+        best = 0.0
+
+        for moved in (
+                _transpose(_move_rows(transposed, tables.left)),
+                _transpose(_move_rows(transposed, tables.right)),
+                _move_rows(bits, tables.left),
+                _move_rows(bits, tables.right)):
+            if moved != bits:
+                value = self._chance_value(moved, depth, probability)
+                if value > best:
+                    best = value
+
+        return best
+
+    def _chance_value(self, bits, depth, probability):
+        if depth == 0 or probability < _PROBABILITY_THRESHOLD:
+            return self._heuristic(bits)
+
+        stored = self._table.lookup(bits, depth)
+        if stored != None:
+            return stored
+
+        free_shifts = [shift for shift in range(0, 64, 4)
+                if (bits >> shift) & 0xf == 0]
+        tile_probability = probability / len(free_shifts)
+
+        total = 0.0
+        for shift in free_shifts:
+            for (rank, rank_probability) in self._spawn_outcomes:
+                total += rank_probability * self._max_value(
+                        bits | (rank << shift), depth - 1,
+                        tile_probability * rank_probability)
+
+        value = total / len(free_shifts)
+        self._table.store(bits, depth, value)
+
+        return value
+
+# worker process state
+_worker_searcher = None
+_worker_shm = None
+_worker_generation = None
+
+def _worker_init(shm_name, spawn_outcomes):
+    global _worker_searcher
+    global _worker_shm
+    global _worker_generation
+
+    from multiprocessing import shared_memory
+
+    _worker_shm = shared_memory.SharedMemory(name = shm_name)
+    _worker_generation = _worker_shm.buf[:_GENERATION_SIZE].cast("Q")
+    _worker_searcher = _Searcher(
+            _TranspositionTable(_worker_shm.buf[_GENERATION_SIZE:]),
+            spawn_outcomes)
+
+def _worker_started():
+    # no-op task, which makes the pool start the workers
+    pass
+
+def _worker_evaluate(bits, depth, probability, deadline, generation):
+    # the search is cancelled by advancing the generation
+    def is_cancelled():
+        return _worker_generation[0] != generation
+
+    try:
+        return _worker_searcher.evaluate_max(
+                bits, depth, probability, deadline, is_cancelled)
+    except _SearchTimeout:
+        return None
+
+class SearchResult:
+    """
+    Search result
+
+    Has the best direction (`None` if no move is possible), the depth
+    of the last completed search iteration, the number of the searched
+    nodes, the elapsed time, in seconds, and the expectimax value of the
+    best move (`None` if no depth is completed).
+    """
+
+    def __init__(self, direction, depth, nodes, elapsed, value = None):
+        self.direction = direction
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+        self.value = value
+
+    def get_nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+class ParallelSearch:
+    """
+    Parallel expectimax search class
+
+    The root of the search is split to the (move, new piece) subtrees,
+    which are evaluated by the process pool, sharing one transposition
+    table. The search is deepened iteratively until the deadline. With
+    no workers, the subtrees are evaluated in this process.
+    """
+
+    def __init__(self, workers_cnt = None, table_entries_cnt = 1 << 20,
+            spawn_distribution = gamectrl.UNIFORM_SPAWN_DISTRIBUTION):
+        """
+        Initialization method
+
+        Inputs are: number of the worker processes (the number of CPUs
+        by default, none on the single CPU, 0 for none), size of the
+        transposition table, and the distribution of the new pieces.
+        Workers are started here, so they are forked from the thread
+        creating the search, rather than from the search thread.
+        """
+
+        # tables are built before the workers are started, so the forked
+        # workers inherit them
+        _get_tables()
+
+        self._spawn_outcomes = tuple(
+                (value.bit_length() - 1, probability)
+                for (value, probability) in
+                spawn_distribution.get_outcomes())
+
+        buffer_size = _GENERATION_SIZE + \
+                _TranspositionTable.get_buffer_size(table_entries_cnt)
+
+        if workers_cnt == None:
+            import os
+            # the single CPU is not shared with the worker process
+            cpus_cnt = os.cpu_count() or 1
+            workers_cnt = cpus_cnt if cpus_cnt > 1 else 0
+
+        self._shm = None
+        self._pool = None
+
+        self._thread = None
+        self._result = None
+        self._owner = None
+
+        if workers_cnt == 0:
+            buffer = memoryview(bytearray(buffer_size))
+        else:
+            import concurrent.futures
+            import multiprocessing
+            from multiprocessing import shared_memory
+
+            # forked workers inherit the tables, and fork is not the
+            # default start method everywhere
+            if "fork" in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context("fork")
+            else:
+                mp_context = None
+
+            self._shm = shared_memory.SharedMemory(
+                    create = True, size = buffer_size)
+            buffer = self._shm.buf
+            self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers = workers_cnt,
+                    mp_context = mp_context,
+                    initializer = _worker_init,
+                    initargs = (self._shm.name, self._spawn_outcomes))
+
+            # forking pool starts all the workers with the first task
+            self._pool.submit(_worker_started).result()
+
+        self._generation = buffer[:_GENERATION_SIZE].cast("Q")
+        self._table = _TranspositionTable(buffer[_GENERATION_SIZE:])
+        if self._pool == None:
+            self._searcher = _Searcher(self._table, self._spawn_outcomes)
+
+    def search(self, bits, time_limit = None, max_depth = None,
+            progress = None):
+        """
+        Search for the best move
+
+        Deepens the search until the time limit (in seconds), or the
+        maximal depth, whichever comes first, and returns the
+        `SearchResult` of the last completed depth. `progress`, if given,
+        is called with the `SearchResult` of every completed depth.
+        """
+
+        return self._search(bits, time_limit, max_depth, progress,
+                self._generation[0])
+
+    def _search(self, bits, time_limit, max_depth, progress, generation):
+        """
+        Search for the best move, until the generation is advanced
+        """
+
+        start_time = time.monotonic()
+        deadline = start_time + time_limit if time_limit != None \
+                else None
+
+        moves = [(direction, move_board_bits(bits, direction))
+                for direction in DIRECTIONS]
+        moves = [(direction, moved) for (direction, moved) in moves
+                if moved != bits]
+
+        if moves == []:
+            return SearchResult(None, 0, 0, 0.0)
+
+        best_direction = moves[0][0]
+        best_value = None
+        completed_depth = 0
+        nodes = 0
+        depth = 1
+
+        while max_depth == None or depth <= max_depth:
+            values = self._search_depth(
+                    moves, depth, deadline, generation)
+
+            if values == None:
+                break
+
+            (depth_values, depth_nodes) = values
+            nodes += depth_nodes
+            best_index = max(range(len(moves)),
+                    key = depth_values.__getitem__)
+            best_direction = moves[best_index][0]
+            best_value = depth_values[best_index]
+            completed_depth = depth
+
+            if progress != None:
+                progress(SearchResult(best_direction, completed_depth,
+                        nodes, time.monotonic() - start_time, best_value))
+
+            depth += 1
+
+        return SearchResult(best_direction, completed_depth, nodes,
+                time.monotonic() - start_time, best_value)
+
+    def start_search(self, bits, time_limit, max_depth = None,
+            progress = None, owner = None):
+        """
+        Start the search in the background
+
+        The result is available through `poll_search`. `progress` is
+        called from the search thread. The cancelled search has to stop,
+        i.e. `is_searching` has to return false value, before the next
+        one is started. `owner` tells the users sharing the search whose
+        search it is, see `get_owner`.
+        """
+
+        # the search is cancelled from the moment the generation is
+        # advanced, also before the thread runs
+        generation = self._generation[0]
+        self._result = None
+        self._owner = owner
+
+        def run_search():
+            result = self._search(
+                    bits, time_limit, max_depth, progress, generation)
+            self._result = (generation, result)
+
+        self._thread = threading.Thread(
+                target = run_search, name = "ai search", daemon = True)
+        self._thread.start()
+
+    def is_searching(self):
+        """
+        Returns true value while the background search is running
+        """
+
+        return self._thread != None and self._thread.is_alive()
+
+    def get_owner(self):
+        """
+        Returns the owner of the background search, until its result is
+        polled, or it is cancelled, otherwise `None`
+        """
+
+        return self._owner
+
+    def poll_search(self):
+        """
+        Returns the result of the background search, or `None` while it
+        is running
+        """
+
+        if self._thread == None or self._thread.is_alive():
+            return None
+
+        self._thread = None
+        self._owner = None
+        (self._result, stored_result) = (None, self._result)
+
+        if stored_result == None:
+            return None
+
+        # the result of the cancelled search is dropped, even if it was
+        # stored after the cancel
+        (generation, result) = stored_result
+        if generation != self._generation[0]:
+            return None
+
+        return result
+
+    def cancel_search(self, wait = False):
+        """
+        Stop the background search, and drop its result
+
+        By default, the search only starts stopping, so the caller, e.g.
+        the main loop, doesn't wait for it; the next one can be started
+        when `is_searching` returns false value.
+        """
+
+        # running subtrees, in this process, and in the workers, see the
+        # new generation, and stop
+        self._generation[0] = (self._generation[0] + 1) & \
+                0xffffffffffffffff
+        if self._thread != None and wait:
+            self._thread.join()
+            self._thread = None
+        self._result = None
+        self._owner = None
+
+    def close(self):
+        self.cancel_search(wait = True)
+
+        if self._pool != None:
+            self._pool.shutdown(cancel_futures = True)
+            self._pool = None
+
+        self._table.release()
+        self._generation.release()
+
+        if self._shm != None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _search_depth(self, moves, depth, deadline, generation):
+        """
+        Evaluate the moves to the given depth
+
+        Returns the values of the moves, and the searched nodes count,
+        or `None` if the deadline passed, or the search is cancelled.
+        """
+
+        tasks = []
+        for (move_index, (direction, moved)) in enumerate(moves):
+            free_shifts = [shift for shift in range(0, 64, 4)
+                    if (moved >> shift) & 0xf == 0]
+            for shift in free_shifts:
+                for (rank, rank_probability) in self._spawn_outcomes:
+                    probability = rank_probability / len(free_shifts)
+                    tasks.append((move_index, probability,
+                            moved | (rank << shift)))
+
+        values = [0.0] * len(moves)
+        nodes = 0
+
+        def is_cancelled():
+            return self._generation[0] != generation
+
+        if self._pool == None:
+            for (move_index, probability, child) in tasks:
+                try:
+                    (value, child_nodes) = self._searcher.evaluate_max(
+                            child, depth - 1, probability, deadline,
+                            is_cancelled)
+                except _SearchTimeout:
+                    return None
+                values[move_index] += probability * value
+                nodes += child_nodes
+        else:
+            futures = [self._pool.submit(_worker_evaluate,
+                    child, depth - 1, probability, deadline, generation)
+                    for (move_index, probability, child) in tasks]
+
+            for (future, (move_index, probability, child)) in \
+                    zip(futures, tasks):
+                result = self._wait_result(future, is_cancelled)
+                if result == None:
+                    for other_future in futures:
+                        other_future.cancel()
+                    return None
+                (value, child_nodes) = result
+                values[move_index] += probability * value
+                nodes += child_nodes
+
+        return (values, nodes)
+
+    def _wait_result(self, future, is_cancelled):
+        """
+        Returns the worker result, or `None` if the worker timed out, or
+        the search is cancelled while waiting
+        """
+
+        import concurrent.futures
+
+        while not is_cancelled():
+            try:
+                return future.result(timeout = _CANCEL_CHECK_PERIOD)
+            except concurrent.futures.TimeoutError:
+                pass
+
+        return None
+
+class Autoplayer:
+    """
+    Autoplayer class
+
+    Plays the game with the parallel search, which runs in the
+    background, so the input, and the output stay responsive. `poll`
+    has to be called regularly from the main loop.
+
+    With the opening book, the moves of the known positions are played
+    without the search, and the search results are stored in the book.
+
+    The search can be shared with the `HintAdvisor`, and the autoplay
+    goes first: the hint search is cancelled when the autoplay needs
+    the search.
+    """
+
+    def __init__(self, game_ctrl, output, time_limit = 0.1,
+            workers_cnt = None, max_depth = None, opening_book = None,
+            search = None):
+        """
+        Initialization method
+
+        Inputs are: game controller, output, search time limit per move,
+        in seconds, number of the worker processes, the maximal search
+        depth, which makes the shallow searches faster than the time
+        limit, the `book.OpeningBook`, if any, and the shared
+        `ParallelSearch`, if any, which is then closed by its creator.
+        Only the book moves searched at least to the maximal depth are
+        played, or, without it, at least to the depth reached by the last
+        search in the time limit.
+        """
+
+        self._game_ctrl = game_ctrl
+        self._output = output
+        self._time_limit = time_limit
+        self._max_depth = max_depth
+        self._opening_book = opening_book
+
+        self._own_search = search == None
+        if self._own_search:
+            search = ParallelSearch(workers_cnt, spawn_distribution =
+                    game_ctrl.get_spawn_distribution())
+        self._search = search
+        self._searched_bits = None
+        self._unsupported_shown = False
+        # depth completed by the last search, `None` before the first one
+        self._reached_depth = None
+
+    def poll(self):
+        """
+        Make the move if the search is done, and start the next one
+
+        Autoplay stops while the board is not supported by the search,
+        e.g. after the reset of the game it continues.
+        """
+
+        # moves are paused while any message window is open
+        if not self._output.is_operational() or \
+                self._game_ctrl.is_suspended() or \
+                self._game_ctrl.is_endgame():
+            return
+
+        if not is_board_supported(self._game_ctrl):
+            if self._searched_bits != None:
+                self._search.cancel_search()
+                self._searched_bits = None
+            if not self._unsupported_shown:
+                self._output.set_status_line_text(
+                        "Autoplay: board not supported")
+                self._unsupported_shown = True
+            return
+
+        self._unsupported_shown = False
+        bits = board_to_bits(self._game_ctrl)
+
+        if self._searched_bits != bits:
+            if self._searched_bits != None:
+                # board has changed, e.g. by the player, or the reset
+                self._search.cancel_search()
+                self._searched_bits = None
+
+            if self._search.get_owner() != None:
+                # search of the other user, which is restarted later
+                self._search.cancel_search(wait = True)
+
+            # the old search stops at its next check
+            if self._search.is_searching():
+                return
+
+            min_depth = self._max_depth if self._max_depth != None \
+                    else self._reached_depth
+
+            if self._opening_book != None and min_depth != None:
+                book_move = self._opening_book.lookup(bits, min_depth)
+                if book_move != None:
+                    self._game_ctrl.move_pieces(book_move.direction)
+                    return
+
+            self._search.start_search(bits, self._time_limit,
+                    self._max_depth, owner = self)
+            self._searched_bits = bits
+            return
+
+        result = self._search.poll_search()
+
+        if result != None:
+            self._searched_bits = None
+            if result.depth > 0:
+                self._reached_depth = result.depth
+            if result.direction != None:
+                if self._opening_book != None and result.depth > 0:
+                    self._opening_book.store(bits, result.direction,
+                            result.depth, result.value)
+                self._game_ctrl.move_pieces(result.direction)
+
+                # the next search is started right away, so the shared
+                # search is not taken by the hints in between
+                self.poll()
+
+    def close(self):
+        if self._own_search:
+            self._search.close()
+        elif self._searched_bits != None:
+            self._search.cancel_search(wait = True)
+
+class HintAdvisor:
+    """
+    Hint advisor class
+
+    Searches for the best move in the background while the player
+    thinks, and shows it in the status line of the output, improving
+    the hint with every completed search depth. Search is restarted
+    when the board changes.
+
+    Only `poll`, called regularly from the main loop, touches the
+    output, so curses is used from the main thread only. It never waits
+    for the search, and with the shared search, it never cancels the
+    search of the other user, but waits until the search is free.
+    """
+
+    def __init__(self, game_ctrl, output, time_limit = 2.0,
+            workers_cnt = 1, search = None):
+        """
+        Initialization method
+
+        Inputs are: game controller, output, time limit of the search for
+        one board, in seconds, the number of the worker processes, and
+        the shared `ParallelSearch`, if any, which is then closed by its
+        creator. By default, one worker process does the search, so the
+        main thread does not compete with it for the interpreter.
+        """
+
+        self._game_ctrl = game_ctrl
+        self._output = output
+        self._time_limit = time_limit
+
+        self._own_search = search == None
+        if self._own_search:
+            search = ParallelSearch(workers_cnt, spawn_distribution =
+                    game_ctrl.get_spawn_distribution())
+        self._search = search
+
+        # board of the running hint search, and of the completed one
+        self._searched_bits = None
+        self._hinted_bits = None
+        # (board, result) of the last completed depth, set from the
+        # search thread
+        self._latest_hint = None
+        self._shown_text = None
+
+    def poll(self):
+        """
+        Restart the search if the board has changed, and show the latest
+        hint
+        """
+
+        if not self._game_ctrl.is_active() or \
+                self._game_ctrl.is_suspended():
+            return
+
+        if self._game_ctrl.is_endgame():
+            self._show_text("No moves left")
+            return
+
+        if not is_board_supported(self._game_ctrl):
+            if self._search.get_owner() is self:
+                self._search.cancel_search()
+            self._searched_bits = None
+            self._show_text("Hint: board not supported")
+            return
+
+        bits = board_to_bits(self._game_ctrl)
+
+        if self._searched_bits != None:
+            if self._search.get_owner() is not self:
+                # cancelled by the other user, e.g. the autoplay
+                self._searched_bits = None
+            elif self._searched_bits != bits:
+                self._search.cancel_search()
+                self._searched_bits = None
+            elif not self._search.is_searching():
+                # the hint stays until the board changes
+                self._search.poll_search()
+                self._hinted_bits = bits
+                self._searched_bits = None
+
+        if self._searched_bits == None and self._hinted_bits != bits:
+            self._show_text("Hint: thinking...")
+
+            # the old search stops at its next check, and the search of
+            # the other user is waited for
+            if self._search.is_searching() or \
+                    self._search.get_owner() != None:
+                return
+
+            def store_hint(result):
+                self._latest_hint = (bits, result)
+
+            self._search.start_search(bits, self._time_limit,
+                    progress = store_hint, owner = self)
+            self._searched_bits = bits
+            return
+
+        latest_hint = self._latest_hint
+        if latest_hint != None and latest_hint[0] == bits:
+            result = latest_hint[1]
+            self._show_text("Hint: {} (depth {})".format(
+                    result.direction.name, result.depth))
+
+    def _show_text(self, text):
+        if text != self._shown_text:
+            self._output.set_status_line_text(text)
+            self._shown_text = text
+
+    def close(self):
+        if self._own_search:
+            self._search.close()
+        elif self._search.get_owner() is self:
+            self._search.cancel_search(wait = True)
+
+def _benchmark(depth = 3, positions_cnt = 3):
+    """
+    Report the nodes per second, and the speedup over the single core,
+    for the fixed depth searches of the random positions
+    """
+
+    import os
+
+    positions_random = random.Random(0)
+    positions = []
+    for position_index in range(positions_cnt):
+        game_ctrl = gamectrl.GameController(
+                random_generator = positions_random)
+        headless = gamectrl.HeadlessController()
+        game_ctrl.attach_output(headless)
+        game_ctrl.attach_input(headless)
+        game_ctrl.resume_game()
+        for move_index in range(positions_random.randrange(20, 60)):
+            game_ctrl.move_pieces(positions_random.choice(DIRECTIONS))
+        positions.append(board_to_bits(game_ctrl))
+
+    # from the single core to all of them, doubling the worker processes
+    workers_cnts = [0]
+    while workers_cnts[-1] < (os.cpu_count() or 1):
+        workers_cnts.append(max(1, workers_cnts[-1] * 2))
+
+    base_elapsed = None
+
+    for workers_cnt in workers_cnts:
+        total_nodes = 0
+        total_elapsed = 0.0
+
+        for bits in positions:
+            # every search starts with the empty transposition table
+            search = ParallelSearch(workers_cnt)
+            result = search.search(bits, max_depth = depth)
+            search.close()
+
+            total_nodes += result.nodes
+            total_elapsed += result.elapsed
+
+        if base_elapsed == None:
+            base_elapsed = total_elapsed
+
+        print("{:2d} workers: {:8d} nodes, {:10.0f} nodes/s, "
+                "speedup {:.2f}".format(
+                workers_cnt, total_nodes, total_nodes / total_elapsed,
+                base_elapsed / total_elapsed))
+
+if __name__ == "__main__":
+    _benchmark(*(int(arg) for arg in sys.argv[1:3]))
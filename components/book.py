@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+"""
+Opening book module
+
+Has the `OpeningBook` class, the persistent cache of the searched
+positions, which maps the 4x4 boards to the best move, and its value, so
+the positions repeated across the games are not searched again.
+
+Boards are the 64-bit integers of the `ai` module. The eight rotations,
+and reflections of the board share one entry, stored for the smallest of
+them.
+
+Running the module as a script plays the games with the book, and
+reports the hit rate, and the search time of the first moves.
+"""
+
+from . import ai
+from . import gamectrl
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+
+# book file: magic, format version, config fingerprint, entries count,
+# next use stamp, and the used entries count, followed by the entries
+_BOOK_MAGIC = b"2048BOOK"
+_BOOK_VERSION = 1
+_BOOK_HEADER = struct.Struct("<8sQQQ")
+_BOOK_ENTRIES_OFFSET = 64
+# words of the header which change while the book is used
+_STAMP_WORD = 4
+_USED_WORD = 5
+
+# entry: check word, value bits, and the meta word, with the direction
+# index in the bits 0 to 1, the depth in the bits 2 to 7, and the use
+# stamp above them
+_ENTRY_WORDS = 3
+_DEPTH_SHIFT = 2
+_DEPTH_MASK = 0x3f
+_STAMP_SHIFT = 8
+
+# entries tried for every board, from its hashed index
+_PROBE_LENGTH = 4
+
+_MASK_64 = 0xffffffffffffffff
+
+def _flip_rows(bits):
+    # every row is reversed, which swaps left, and right
+    return ((bits & 0x000f000f000f000f) << 12) | \
+            ((bits & 0x00f000f000f000f0) << 4) | \
+            ((bits & 0x0f000f000f000f00) >> 4) | \
+            ((bits & 0xf000f000f000f000) >> 12)
+
+def _flip_columns(bits):
+    # row order is reversed, which swaps up, and down
+    return ((bits & 0xffff) << 48) | \
+            ((bits & 0xffff0000) << 16) | \
+            ((bits >> 16) & 0xffff0000) | \
+            (bits >> 48)
+
+# direction indices in `ai.DIRECTIONS`
+_UP = 0
+_DOWN = 1
+_LEFT = 2
+_RIGHT = 3
+
+# symmetries, as the (transposed, columns flipped, rows flipped) flags,
+# applied in that order
+_SYMMETRIES = tuple((transposed, columns_flipped, rows_flipped)
+        for transposed in (False, True)
+        for columns_flipped in (False, True)
+        for rows_flipped in (False, True))
+
+def _transform_board(bits, symmetry):
+    (transposed, columns_flipped, rows_flipped) = symmetry
+
+    if transposed:
+        bits = ai._transpose(bits)
+    if columns_flipped:
+        bits = _flip_columns(bits)
+    if rows_flipped:
+        bits = _flip_rows(bits)
+
+    return bits
+
+def _transform_direction(direction_index, symmetry):
+    (transposed, columns_flipped, rows_flipped) = symmetry
+
+    if transposed:
+        direction_index = (_LEFT, _RIGHT, _UP, _DOWN)[direction_index]
+    if columns_flipped:
+        direction_index = (_DOWN, _UP, _LEFT, _RIGHT)[direction_index]
+    if rows_flipped:
+        direction_index = (_UP, _DOWN, _RIGHT, _LEFT)[direction_index]
+
+    return direction_index
+
+def _untransform_direction(direction_index, symmetry):
+    # every step swaps two directions, so the inverse applies them in
+    # the reverse order
+    (transposed, columns_flipped, rows_flipped) = symmetry
+
+    for step_symmetry in ((False, False, rows_flipped),
+            (False, columns_flipped, False), (transposed, False, False)):
+        direction_index = _transform_direction(
+                direction_index, step_symmetry)
+
+    return direction_index
+
+def _canonicalize(bits):
+    """
+    Returns the smallest of the symmetric boards, and its symmetry
+    """
+
+    return min((_transform_board(bits, symmetry), symmetry)
+            for symmetry in _SYMMETRIES)
+
+def _get_config_fingerprint(spawn_distribution):
+    config = (ai.get_heuristic_config(),
+            spawn_distribution.get_outcomes())
+    return int.from_bytes(
+            hashlib.sha256(repr(config).encode()).digest()[:8], "little")
+
+class BookMove:
+    """
+    Book move
+
+    Has the best direction, the depth it was searched to, and its
+    expectimax value.
+    """
+
+    def __init__(self, direction, depth, value):
+        self.direction = direction
+        self.depth = depth
+        self.value = value
+
+class OpeningBook:
+    """
+    Opening book class
+
+    Open-addressing table of the searched positions in the memory-mapped
+    file. The file has a fixed number of entries; when all the entries
+    tried for the board are used, the least recently used one is
+    replaced. Entries are written without locking, as in the
+    transposition table, so the book can be shared by the processes.
+
+    The book made for the other heuristic config, spawn distribution, or
+    size is discarded when opened.
+    """
+
+    def __init__(self, path, entries_cnt = 1 << 20,
+            spawn_distribution = gamectrl.UNIFORM_SPAWN_DISTRIBUTION):
+        """
+        Initialization method
+
+        Inputs are: book file path, number of the entries, and the
+        distribution of the new pieces. Book file is created if it
+        doesn't exist.
+        """
+
+        header = _BOOK_HEADER.pack(_BOOK_MAGIC, _BOOK_VERSION,
+                _get_config_fingerprint(spawn_distribution), entries_cnt)
+        size = _BOOK_ENTRIES_OFFSET + entries_cnt * _ENTRY_WORDS * 8
+
+        with open(path, "a+b") as book_file:
+            book_file.seek(0)
+            stored_header = book_file.read(len(header))
+
+            if stored_header != header or \
+                    os.fstat(book_file.fileno()).st_size != size:
+                # the file is sparse, so only the used entries take the
+                # disk space
+                book_file.truncate(0)
+                book_file.write(header)
+                book_file.truncate(size)
+
+            self._mmap = mmap.mmap(book_file.fileno(), size)
+
+        self._header_words = memoryview(self._mmap)[
+                :_BOOK_ENTRIES_OFFSET].cast("Q")
+        self._words = memoryview(self._mmap)[
+                _BOOK_ENTRIES_OFFSET:].cast("Q")
+        self._entries_cnt = entries_cnt
+
+        self._pack_value = struct.Struct("d").pack
+        self._unpack_value = struct.Struct("d").unpack
+        self._pack_bits = struct.Struct("Q").pack
+        self._unpack_bits = struct.Struct("Q").unpack
+
+        # lookups of this instance, for the hit rate
+        self._lookups_cnt = 0
+        self._hits_cnt = 0
+
+    def _next_stamp(self):
+        stamp = self._header_words[_STAMP_WORD] + 1
+        self._header_words[_STAMP_WORD] = stamp
+        return stamp
+
+    def _probe_indices(self, canonical_bits):
+        # Fibonacci hashing spreads the similar boards
+        first_index = ((canonical_bits * 0x9e3779b97f4a7c15) & _MASK_64) % \
+                self._entries_cnt
+
+        return [(first_index + probe) % self._entries_cnt * _ENTRY_WORDS
+                for probe in range(_PROBE_LENGTH)]
+
+    def _write_entry(self, index, canonical_bits, value_bits, meta):
+        self._words[index:index + 3] = memoryview(struct.pack("3Q",
+                canonical_bits ^ value_bits ^ meta, value_bits,
+                meta)).cast("Q")
+
+    def lookup(self, bits, min_depth = 1):
+        """
+        Returns the `BookMove` of the board, searched at least to the
+        given depth, or `None`
+        """
+
+        self._lookups_cnt += 1
+
+        (canonical_bits, symmetry) = _canonicalize(bits)
+        words = self._words
+
+        for index in self._probe_indices(canonical_bits):
+            (check, value_bits, meta) = words[index:index + 3]
+
+            if meta != 0 and check ^ value_bits ^ meta == canonical_bits:
+                depth = (meta >> _DEPTH_SHIFT) & _DEPTH_MASK
+                if depth < min_depth:
+                    return None
+
+                self._hits_cnt += 1
+
+                # used entries are kept longer
+                self._write_entry(index, canonical_bits, value_bits,
+                        (meta & ((1 << _STAMP_SHIFT) - 1)) |
+                        (self._next_stamp() << _STAMP_SHIFT))
+
+                direction_index = _untransform_direction(
+                        meta & 0x3, symmetry)
+                return BookMove(ai.DIRECTIONS[direction_index], depth,
+                        self._unpack_value(self._pack_bits(value_bits))[0])
+
+        return None
+
+    def store(self, bits, direction, depth, value):
+        """
+        Store the best move of the board
+
+        The stored move searched to the greater depth is kept.
+        """
+
+        (canonical_bits, symmetry) = _canonicalize(bits)
+        words = self._words
+
+        value_bits = self._unpack_bits(self._pack_value(value))[0]
+        meta = _transform_direction(ai.DIRECTIONS.index(direction),
+                symmetry) | \
+                (min(depth, _DEPTH_MASK) << _DEPTH_SHIFT) | \
+                (self._next_stamp() << _STAMP_SHIFT)
+
+        free_index = None
+        oldest_index = None
+        oldest_stamp = None
+
+        for index in self._probe_indices(canonical_bits):
+            (check, stored_value_bits, stored_meta) = words[index:index + 3]
+
+            if stored_meta == 0:
+                if free_index == None:
+                    free_index = index
+                continue
+
+            if check ^ stored_value_bits ^ stored_meta == canonical_bits:
+                if (stored_meta >> _DEPTH_SHIFT) & _DEPTH_MASK <= depth:
+                    self._write_entry(index, canonical_bits, value_bits,
+                            meta)
+                return
+
+            stamp = stored_meta >> _STAMP_SHIFT
+            if oldest_stamp == None or stamp < oldest_stamp:
+                oldest_index = index
+                oldest_stamp = stamp
+
+        if free_index != None:
+            self._header_words[_USED_WORD] += 1
+            self._write_entry(free_index, canonical_bits, value_bits, meta)
+        else:
+            self._write_entry(oldest_index, canonical_bits, value_bits,
+                    meta)
+
+    def get_entries_cnt(self):
+        return self._entries_cnt
+
+    def get_used_entries_cnt(self):
+        return self._header_words[_USED_WORD]
+
+    def get_lookups_cnt(self):
+        return self._lookups_cnt
+
+    def get_hits_cnt(self):
+        return self._hits_cnt
+
+    def get_hit_rate(self):
+        return self._hits_cnt / self._lookups_cnt \
+                if self._lookups_cnt > 0 else 0.0
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self._header_words.release()
+        self._words.release()
+        self._mmap.close()
+
+def _play_games(opening_book, games_cnt, first_moves_cnt, depth, seed):
+    """
+    Play the games with the book, and the search to the given depth,
+    and returns the search time of the first moves, in seconds
+    """
+
+    import random
+
+    search = ai.ParallelSearch(0)
+    game_random = random.Random(seed)
+
+    game_ctrl = gamectrl.GameController(random_generator = game_random)
+    headless = gamectrl.HeadlessController()
+    game_ctrl.attach_output(headless)
+    game_ctrl.attach_input(headless)
+    game_ctrl.resume_game()
+
+    elapsed = 0.0
+
+    for game_index in range(games_cnt):
+        game_ctrl.reset_game()
+
+        for move_index in range(first_moves_cnt):
+            if game_ctrl.is_endgame():
+                break
+
+            bits = ai.board_to_bits(game_ctrl)
+            start_time = time.perf_counter()
+
+            book_move = opening_book.lookup(bits, depth)
+            if book_move != None:
+                direction = book_move.direction
+            else:
+                result = search.search(bits, max_depth = depth)
+                direction = result.direction
+                opening_book.store(bits, direction, result.depth,
+                        result.value)
+
+            elapsed += time.perf_counter() - start_time
+            game_ctrl.move_pieces(direction)
+
+    search.close()
+
+    return elapsed
+
+def _benchmark(path, games_cnt = 20, first_moves_cnt = 30, depth = 2):
+    """
+    Report the hit rate, and the search time of the first moves, for the
+    runs with the same book
+    """
+
+    for run_index in range(3):
+        opening_book = OpeningBook(path)
+        elapsed = _play_games(opening_book, games_cnt, first_moves_cnt,
+                depth, run_index)
+
+        print("run {}: hit rate {:.1%}, {:.2f} ms per move, "
+                "{} entries used".format(
+                run_index, opening_book.get_hit_rate(),
+                elapsed * 1000 / opening_book.get_lookups_cnt(),
+                opening_book.get_used_entries_cnt()))
+
+        opening_book.close()
+
+if __name__ == "__main__":
+    _benchmark(sys.argv[1], *(int(arg) for arg in sys.argv[2:5]))
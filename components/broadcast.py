@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+
+"""
+Game broadcast module
+
+Has the `BroadcastPublisher` class, which streams the game to the
+viewers over the Unix socket, and the `BroadcastViewer` class, which
+shows the streamed game with the curses output.
+
+The stream is made of the messages:
+
+* snapshot: `S`, board width, and height (byte each), score (32-bit,
+  big-endian), and the tiles in the row-major order, as the base-2
+  logarithms of the values (0 for the free tile);
+* move: `M`, movement direction value, position of the new piece in the
+  row-major order, and the base-2 logarithm of its value (byte each).
+
+Viewers get a snapshot when they attach, and then follow the moves. A
+viewer which lags behind more than the publisher keeps gets a new
+snapshot instead of the missed moves. Snapshots are made by the sending
+thread, from the last checkpoint, and the moves logged since it, so the
+game only encodes the checkpoint once in a while.
+"""
+
+from . import gamectrl
+
+import collections
+import curses
+import itertools
+import os
+import random
+import select
+import selectors
+import socket
+import struct
+import threading
+
+_SNAPSHOT_TAG = b"S"
+_MOVE_TAG = b"M"
+
+_SNAPSHOT_HEADER = struct.Struct(">cBBI")
+_MOVE_MESSAGE = struct.Struct(">cBBB")
+
+# number of the last messages kept for the viewers
+_LOG_LENGTH = 4096
+
+# messages between the checkpoints; it is shorter than the log, so the
+# moves since the last checkpoint are always in the log
+_CHECKPOINT_PERIOD = 1024
+
+# viewers accepted at once, so the closed ones are removed in between,
+# even when the new ones keep coming
+_LISTEN_BACKLOG = 128
+
+def _encode_tile(value, free_tile_value):
+    if value == free_tile_value:
+        return 0
+    return value.bit_length() - 1
+
+def _decode_tile(log_value, free_tile_value):
+    if log_value == 0:
+        return free_tile_value
+    return 1 << log_value
+
+def _decode_board(bw, bh, tiles, free_tile_value):
+    return [[_decode_tile(tiles[row * bw + col], free_tile_value)
+            for col in range(bw)] for row in range(bh)]
+
+def _decode_snapshot(snapshot):
+    (tag, bw, bh, score) = _SNAPSHOT_HEADER.unpack_from(snapshot)
+    tiles = snapshot[_SNAPSHOT_HEADER.size:_SNAPSHOT_HEADER.size + bw * bh]
+    return (bw, bh, score, tiles)
+
+def _encode_snapshot(game_ctrl):
+    (bw, bh) = game_ctrl.get_board_dimensions()
+    ftv = game_ctrl.get_free_tile_value()
+
+    return _SNAPSHOT_HEADER.pack(
+            _SNAPSHOT_TAG, bw, bh, game_ctrl.get_current_score()) + \
+            bytes(_encode_tile(value, ftv)
+                    for board_row in game_ctrl.get_board_state()
+                    for value in board_row)
+
+class _Viewer:
+    """
+    Publisher side of the attached viewer
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        # sequence number of the next message to send
+        self.next_seq = None
+        # data taken from the log, but not yet sent
+        self.pending = b""
+
+class BroadcastPublisher:
+    """
+    Broadcast publisher class
+
+    Observes the game controller, and streams its changes to the viewers
+    attached to the Unix socket. Sending is done by the separate thread,
+    so the game only appends the messages to the log.
+    """
+
+    def __init__(self, game_ctrl, socket_path):
+        self._game_ctrl = game_ctrl
+        self._socket_path = socket_path
+
+        self._lock = threading.Lock()
+        self._log = collections.deque(maxlen = _LOG_LENGTH)
+        self._next_seq = 0
+        # snapshot of the game, and the sequence number of the next
+        # message at the time it was taken
+        self._checkpoint = (0, _encode_snapshot(game_ctrl))
+        self._wakeup_pending = False
+
+        # latest snapshot made by the sending thread, as the checkpoint
+        self._snapshot = self._checkpoint
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(socket_path)
+        self._listener.listen(_LISTEN_BACKLOG)
+        self._listener.setblocking(False)
+
+        (self._wakeup_recv, self._wakeup_send) = socket.socketpair()
+        self._wakeup_recv.setblocking(False)
+        # the game never waits for the sending thread
+        self._wakeup_send.setblocking(False)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._listener, selectors.EVENT_READ)
+        self._selector.register(self._wakeup_recv, selectors.EVENT_READ)
+        self._viewers = {}
+
+        self._running = True
+        self._thread = threading.Thread(
+                target = self._serve, name = "broadcast", daemon = True)
+        self._thread.start()
+
+        self._game_ctrl.attach_observer(self)
+
+    def close(self):
+        """
+        Stop the broadcast, and detach the viewers
+        """
+
+        self._game_ctrl.detach_observer(self)
+
+        self._running = False
+        self._wake_up()
+        self._thread.join()
+
+        for viewer in self._viewers.values():
+            viewer.connection.close()
+        self._selector.close()
+        self._listener.close()
+        self._wakeup_recv.close()
+        self._wakeup_send.close()
+
+        os.unlink(self._socket_path)
+
+    def get_viewers_cnt(self):
+        """
+        Returns the number of the attached viewers
+        """
+
+        return len(self._viewers)
+
+    # game observer
+    #
+
+    def game_moved(self, movement_direction, spawned_piece):
+        (row, col, value) = spawned_piece
+        (bw, bh) = self._game_ctrl.get_board_dimensions()
+        ftv = self._game_ctrl.get_free_tile_value()
+
+        self._publish(_MOVE_MESSAGE.pack(
+                _MOVE_TAG, movement_direction.value, row * bw + col,
+                _encode_tile(value, ftv)))
+
+    def game_reset(self):
+        self._publish(_encode_snapshot(self._game_ctrl))
+
+    # auxiliary operations
+    #
+
+    def _publish(self, message):
+        """
+        Append the message to the log, and wake up the sending thread
+        """
+
+        # checkpoint is taken by the game thread, so it is always
+        # consistent with the log; the snapshot message is one itself
+        if message[0:1] == _SNAPSHOT_TAG:
+            checkpoint_snapshot = message
+        elif self._next_seq + 1 - self._checkpoint[0] >= \
+                _CHECKPOINT_PERIOD:
+            checkpoint_snapshot = _encode_snapshot(self._game_ctrl)
+        else:
+            checkpoint_snapshot = None
+
+        with self._lock:
+            self._log.append(message)
+            self._next_seq += 1
+
+            if checkpoint_snapshot != None:
+                self._checkpoint = (self._next_seq, checkpoint_snapshot)
+
+            wakeup = not self._wakeup_pending
+            self._wakeup_pending = True
+
+        if wakeup:
+            self._wake_up()
+
+    def _wake_up(self):
+        try:
+            self._wakeup_send.send(b"\0")
+        except BlockingIOError:
+            # the sending thread has the wakeups to read already
+            pass
+
+    def _serve(self):
+        """
+        Sending thread main loop
+        """
+
+        while self._running:
+            for (key, events) in self._selector.select():
+                if key.fileobj is self._listener:
+                    self._accept_viewers()
+                elif key.fileobj is self._wakeup_recv:
+                    self._drain_wakeups()
+                else:
+                    viewer = key.data
+
+                    # viewer may have been removed by the earlier event
+                    # of the same batch
+                    if events & selectors.EVENT_READ and \
+                            viewer.connection in self._viewers:
+                        self._check_viewer_closed(viewer)
+                    if events & selectors.EVENT_WRITE and \
+                            viewer.connection in self._viewers:
+                        self._send_to_viewer(viewer)
+
+    def _accept_viewers(self):
+        for accept_index in range(_LISTEN_BACKLOG):
+            try:
+                (connection, address) = self._listener.accept()
+            except BlockingIOError:
+                return
+            except OSError:
+                # e.g. out of the file descriptors; the viewer is
+                # accepted later
+                return
+
+            connection.setblocking(False)
+            viewer = _Viewer(connection)
+            self._viewers[connection] = viewer
+            self._selector.register(
+                    connection, selectors.EVENT_READ, viewer)
+            self._send_to_viewer(viewer)
+
+    def _drain_wakeups(self):
+        try:
+            while self._wakeup_recv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        with self._lock:
+            self._wakeup_pending = False
+
+        for viewer in list(self._viewers.values()):
+            self._send_to_viewer(viewer)
+
+    def _check_viewer_closed(self, viewer):
+        try:
+            data = viewer.connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+
+        # viewers are read-only, so anything else is ignored
+        if data == b"":
+            self._remove_viewer(viewer)
+
+    def _remove_viewer(self, viewer):
+        # viewer can fail both on reading, and on sending, so it may be
+        # removed already
+        if self._viewers.pop(viewer.connection, None) == None:
+            return
+
+        self._selector.unregister(viewer.connection)
+        viewer.connection.close()
+
+    def _get_snapshot(self):
+        """
+        Returns the current snapshot, and the sequence number of the
+        next message
+
+        Snapshot is made from the last checkpoint, by replaying the
+        moves logged since it, and kept for the other viewers.
+        """
+
+        with self._lock:
+            (checkpoint_seq, checkpoint_snapshot) = self._checkpoint
+            next_seq = self._next_seq
+            first_log_seq = next_seq - len(self._log)
+            moves = list(itertools.islice(self._log,
+                    checkpoint_seq - first_log_seq, None))
+
+        if self._snapshot[0] == next_seq:
+            return self._snapshot
+
+        (bw, bh, score, tiles) = _decode_snapshot(checkpoint_snapshot)
+
+        if moves != []:
+            # own generator, so the pieces of its reset don't change the
+            # pieces of the published game, drawn from the shared one
+            game_ctrl = gamectrl.GameController(bw, bh,
+                    random_generator = random.Random())
+            headless = gamectrl.HeadlessController()
+            game_ctrl.attach_output(headless)
+            game_ctrl.attach_input(headless)
+            game_ctrl.resume_game()
+            ftv = game_ctrl.get_free_tile_value()
+
+            game_ctrl.load_game_state(
+                    _decode_board(bw, bh, tiles, ftv), score)
+
+            for message in moves:
+                (tag, direction, position, log_value) = \
+                        _MOVE_MESSAGE.unpack(message)
+                (row, col) = divmod(position, bw)
+                game_ctrl.replay_move(gamectrl.MovementDirections(direction),
+                        (row, col, _decode_tile(log_value, ftv)))
+
+            checkpoint_snapshot = _encode_snapshot(game_ctrl)
+
+        self._snapshot = (next_seq, checkpoint_snapshot)
+        return self._snapshot
+
+    def _fill_pending(self, viewer):
+        """
+        Take the messages the viewer has not received from the log
+
+        A viewer which is new, or which lags behind the log, gets the
+        snapshot instead.
+        """
+
+        with self._lock:
+            first_log_seq = self._next_seq - len(self._log)
+
+            if viewer.next_seq != None and viewer.next_seq >= first_log_seq:
+                viewer.pending = b"".join(itertools.islice(self._log,
+                        viewer.next_seq - first_log_seq, None))
+                viewer.next_seq = self._next_seq
+                return
+
+        (viewer.next_seq, viewer.pending) = self._get_snapshot()
+
+    def _send_to_viewer(self, viewer):
+        if viewer.pending == b"":
+            self._fill_pending(viewer)
+
+        try:
+            while viewer.pending != b"":
+                sent = viewer.connection.send(viewer.pending)
+                viewer.pending = viewer.pending[sent:]
+
+                if viewer.pending == b"":
+                    self._fill_pending(viewer)
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._remove_viewer(viewer)
+            return
+
+        # waits for the socket to become writable only while there is
+        # something left to send
+        if viewer.pending != b"":
+            events = selectors.EVENT_READ | selectors.EVENT_WRITE
+        else:
+            events = selectors.EVENT_READ
+        if self._selector.get_key(viewer.connection).events != events:
+            self._selector.modify(viewer.connection, events, viewer)
+
+class BroadcastViewer:
+    """
+    Broadcast viewer class
+
+    Attaches to the broadcast publisher, and follows the streamed game
+    with its own game controller, shown by the curses output. Only the
+    <ESC> key, which exits, and the resizing are handled.
+    """
+
+    def __init__(self, window, socket_path):
+        self._window = window
+
+        self._connection = socket.socket(
+                socket.AF_UNIX, socket.SOCK_STREAM)
+        self._connection.connect(socket_path)
+        self._received = b""
+
+        # the board dimensions are known only from the first snapshot
+        (bw, bh, score, tiles) = self._read_first_snapshot()
+
+        # imported here, as only the viewer needs the output
+        from . import crsout
+
+        # pieces come from the publisher, its own generator only puts
+        # the pieces of the reset, replaced by the first snapshot
+        self._game_ctrl = gamectrl.GameController(bw, bh,
+                random_generator = random.Random())
+        self._game_ctrl.attach_input(self)
+        self._output = crsout.CursesOutput(window, self._game_ctrl)
+        self._output.set_status_line_text(
+                "Spectating, press <ESC> to exit")
+        self._output.close_intro_window()
+        self._game_ctrl.resume_game()
+        self._game_ctrl.load_game_state(
+                _decode_board(bw, bh, tiles,
+                        self._game_ctrl.get_free_tile_value()),
+                score)
+
+    def is_operational(self):
+        """
+        Get the operational state of the component
+
+        Returns the information if this component is able to function
+        properly.
+        """
+
+        return True
+
+    def run(self):
+        """
+        Follow the game until <ESC> is pressed, or the stream ends
+        """
+
+        self._window.nodelay(True)
+
+        while self._game_ctrl.is_active():
+            # timeout is needed for the resize events, which do not
+            # make the input readable
+            (readable, _, _) = select.select(
+                    [self._connection, 0], [], [], 0.1)
+
+            if self._connection in readable:
+                data = self._connection.recv(65536)
+                if data == b"":
+                    break
+                self._received += data
+                self._process_messages()
+
+            self._process_keys()
+
+        self._connection.close()
+
+    # auxiliary operations
+    #
+
+    def _read_first_snapshot(self):
+        while True:
+            message = self._next_message()
+            if message != None and message[0] == _SNAPSHOT_TAG:
+                return message[1:]
+
+            data = self._connection.recv(65536)
+            if data == b"":
+                raise ConnectionError("broadcast ended")
+            self._received += data
+
+    def _next_message(self):
+        """
+        Decode the next complete message from the received data
+
+        Returns `None` if the message is not complete.
+        """
+
+        if len(self._received) == 0:
+            return None
+
+        tag = self._received[0:1]
+
+        if tag == _MOVE_TAG:
+            if len(self._received) < _MOVE_MESSAGE.size:
+                return None
+
+            (tag, direction, position, log_value) = \
+                    _MOVE_MESSAGE.unpack_from(self._received)
+            self._received = self._received[_MOVE_MESSAGE.size:]
+
+            return (tag, direction, position, log_value)
+        elif tag == _SNAPSHOT_TAG:
+            if len(self._received) < _SNAPSHOT_HEADER.size:
+                return None
+
+            (tag, bw, bh, score) = \
+                    _SNAPSHOT_HEADER.unpack_from(self._received)
+            message_size = _SNAPSHOT_HEADER.size + bw * bh
+            if len(self._received) < message_size:
+                return None
+
+            tiles = self._received[_SNAPSHOT_HEADER.size:message_size]
+            self._received = self._received[message_size:]
+
+            return (tag, bw, bh, score, tiles)
+        else:
+            raise ValueError("unknown broadcast message {!r}".format(tag))
+
+    def _process_messages(self):
+        gc = self._game_ctrl
+        ftv = gc.get_free_tile_value()
+        (bw, bh) = gc.get_board_dimensions()
+
+        while True:
+            message = self._next_message()
+
+            if message == None:
+                return
+            elif message[0] == _MOVE_TAG:
+                (tag, direction, position, log_value) = message
+                (row, col) = divmod(position, bw)
+                gc.replay_move(gamectrl.MovementDirections(direction),
+                        (row, col, _decode_tile(log_value, ftv)))
+            else:
+                (tag, bw, bh, score, tiles) = message
+                gc.load_game_state(
+                        _decode_board(bw, bh, tiles, ftv), score)
+
+    def _process_keys(self):
+        while True:
+            pressed_key = self._window.getch()
+
+            if pressed_key == curses.ERR:
+                return
+            elif pressed_key == curses.KEY_RESIZE:
+                self._output.update_size()
+            elif pressed_key == 0x1b:
+                self._game_ctrl.close_game()
+                return
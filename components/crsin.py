@@ -29,6 +29,9 @@ class CursesInput:
             curses.KEY_RIGHT: gamectrl.MovementDirections.right
             }
 
+    # quiet period after the last resize event, before the relayout
+    _RESIZE_QUIET_PERIOD_MS = 100
+
     def __init__(self, window, game_ctrl, output):
         """
         Initialization method
@@ -47,6 +50,35 @@ class CursesInput:
 
         self._state = _CursesInputStates.cis_init
 
+        self._resize_pending = False
+        # blocking read by default
+        self._input_timeout_ms = -1
+
+        self._metrics = None
+
+    def set_input_timeout(self, timeout_ms):
+        """
+        Set the time to wait for the keystroke, in milliseconds
+
+        With the non-negative timeout, `get_input` returns without any
+        action if there is no keystroke, so the caller can do the
+        background work, e.g. the autoplay moves. Negative timeout waits
+        indefinitely.
+        """
+
+        self._input_timeout_ms = timeout_ms
+        if not self._resize_pending:
+            self._window.timeout(timeout_ms)
+
+    def attach_metrics(self, metrics):
+        """
+        Attach the curses metrics, which record the resize events
+
+        `None` detaches them.
+        """
+
+        self._metrics = metrics
+
     def get_input(self):
         """
         Reads, and interprets a keyboard input
@@ -57,13 +89,34 @@ class CursesInput:
 
         pressed_key = self._window.getch()
 
-        # always checked keypresses
+        # resize events come in bursts, so the relayout is done once,
+        # after the quiet period, or before the next key is interpreted
         #
 
         if pressed_key == curses.KEY_RESIZE:
+            if self._metrics != None:
+                self._metrics.record_resize()
+
+            self._resize_pending = True
+            self._window.timeout(CursesInput._RESIZE_QUIET_PERIOD_MS)
+            return
+        elif self._resize_pending:
+            self._resize_pending = False
+            self._window.timeout(self._input_timeout_ms)
             self._output.update_size()
+
+        if pressed_key == curses.ERR:
+            # quiet period, or the input timeout, passed
             return
-        elif pressed_key == 0x1b:
+
+        # frames deferred by the render scheduling are shown before the
+        # key takes effect
+        self._output.flush_frame()
+
+        # always checked keypresses
+        #
+
+        if pressed_key == 0x1b:
             self._game_ctrl.close_game()
             return
         elif pressed_key == ord('?'):
@@ -2,12 +2,18 @@
 
 """
 Curses output module
+
+Output draws either to the curses window, or to the `GridScreen`, which
+has the same drawing methods, but keeps the characters in the memory,
+so the frames can be rendered as the text, or ANSI, without the
+terminal.
 """
 
 import curses
+import functools
 import textwrap
+import time
 import enum
-from . import helpdocs
 
 class _DrawCharacters:
     """
@@ -22,6 +28,219 @@ class _DrawCharacters:
     piece_vl_char = "|"
     piece_inner_char = " "
 
+class _GridWindow:
+    """
+    In-memory window
+
+    Provides the subset of the curses window methods used by the
+    output. Characters are kept in the rows of the window, and copied to
+    the screen frame on `refresh`, only for the rows changed since the
+    last one, as curses does.
+    """
+
+    # characters used by `border`
+    _VERTICAL_CHAR = "|"
+    _HORIZONTAL_CHAR = "-"
+    _CORNER_CHAR = "+"
+
+    def __init__(self, screen, height, width, y, x):
+        self._screen = screen
+        self._xy = (x, y)
+        self._wh = (width, height)
+        self._rows = [[" "] * width for row in range(height)]
+        self._touched_rows = set(range(height))
+        self._cursor_xy = (0, 0)
+
+    def getmaxyx(self):
+        return (self._wh[1], self._wh[0])
+
+    def resize(self, new_height, new_width):
+        for row in self._rows:
+            if new_width > len(row):
+                row.extend(" " * (new_width - len(row)))
+            else:
+                del row[new_width:]
+
+        if new_height > len(self._rows):
+            self._rows.extend([" "] * new_width
+                    for row in range(new_height - len(self._rows)))
+        else:
+            del self._rows[new_height:]
+
+        self._wh = (new_width, new_height)
+        self._touched_rows = set(range(new_height))
+
+    def mvwin(self, new_y, new_x):
+        self._xy = (new_x, new_y)
+        self._touched_rows = set(range(self._wh[1]))
+
+    def erase(self):
+        blank_row = [" "] * self._wh[0]
+        self._rows = [blank_row[:] for row in self._rows]
+        self._touched_rows = set(range(self._wh[1]))
+
+    def border(self):
+        (width, height) = self._wh
+
+        horizontal_line = self._CORNER_CHAR + \
+                self._HORIZONTAL_CHAR * (width - 2) + self._CORNER_CHAR
+        self._rows[0][:] = horizontal_line
+        self._rows[-1][:] = horizontal_line
+
+        for row in self._rows[1:-1]:
+            row[0] = row[-1] = self._VERTICAL_CHAR
+
+        self._touched_rows = set(range(height))
+
+    def addstr(self, y, x, text):
+        # text out of the window is clipped, instead of raising the
+        # error
+        (width, height) = self._wh
+
+        if not 0 <= y < height or not 0 <= x < width:
+            return
+
+        text = text[:max(0, width - x)]
+        self._rows[y][x:x + len(text)] = text
+        self._touched_rows.add(y)
+
+    def insstr(self, y, x, text):
+        (width, height) = self._wh
+
+        if not 0 <= y < height or not 0 <= x < width:
+            return
+
+        row = self._rows[y]
+        row[x:] = (text + "".join(row[x:]))[:max(0, width - x)]
+        self._touched_rows.add(y)
+
+    def move(self, new_y, new_x):
+        self._cursor_xy = (new_x, new_y)
+
+    def clrtoeol(self):
+        (x, y) = self._cursor_xy
+        self._rows[y][x:] = " " * (self._wh[0] - x)
+        self._touched_rows.add(y)
+
+    def refresh(self):
+        self._screen._copy_rows(self, self._touched_rows)
+        self._touched_rows = set()
+
+class GridScreen(_GridWindow):
+    """
+    In-memory screen
+
+    Stands for the curses screen window given to the `CursesOutput`,
+    and creates its sub-windows. Frame is the screen content after the
+    last refresh of every window, and is read with `get_lines`,
+    `get_text`, or `get_ansi_frame`.
+    """
+
+    def __init__(self, width, height):
+        super().__init__(self, height, width, 0, 0)
+        self._frame = [[" "] * width for row in range(height)]
+
+    def newwin(self, height, width, y, x):
+        return _GridWindow(self, height, width, y, x)
+
+    def resize(self, new_height, new_width):
+        """
+        Resize the screen, as the terminal resize does
+
+        `CursesOutput.update_size` needs to be called after it.
+        """
+
+        super().resize(new_height, new_width)
+        self._frame = [[" "] * new_width for row in range(new_height)]
+
+    def _copy_rows(self, window, rows):
+        (screen_width, screen_height) = self._wh
+        (x, y) = window._xy
+
+        # window parts out of the screen are clipped
+        start_x = max(0, -x)
+        end_x = min(window._wh[0], screen_width - x)
+
+        if start_x >= end_x:
+            return
+
+        for row in rows:
+            if 0 <= y + row < screen_height:
+                self._frame[y + row][x + start_x:x + end_x] = \
+                        window._rows[row][start_x:end_x]
+
+    def get_lines(self):
+        """
+        Returns the frame, as the list of lines
+        """
+
+        return ["".join(row) for row in self._frame]
+
+    def get_text(self):
+        """
+        Returns the frame, as the text with the trailing spaces removed
+        """
+
+        return "".join("".join(row).rstrip() + "\n" for row in self._frame)
+
+    def get_ansi_frame(self):
+        """
+        Returns the frame, as the ANSI sequence
+
+        Cursor is moved to the top-left corner, and every line is
+        written over, so the sequence redraws the terminal of the screen
+        size.
+        """
+
+        return "\x1b[H" + "\r\n".join(self.get_lines())
+
+class AsciicastWriter:
+    """
+    Asciicast writer class
+
+    Writes the frames of the `GridScreen` to the file, as the asciinema
+    recording (asciicast version 2).
+    """
+
+    def __init__(self, output_file, screen):
+        # imported here, as only the recordings need it
+        import json
+
+        self._file = output_file
+        self._screen = screen
+        self._json_dump = json.dump
+
+        (height, width) = screen.getmaxyx()
+        json.dump({"version": 2, "width": width, "height": height},
+                output_file)
+        output_file.write("\n")
+
+        # first frame clears the terminal
+        self._clear = True
+
+    def write_frame(self, timestamp):
+        """
+        Write the current frame, shown at the time from the recording
+        start, in seconds
+        """
+
+        frame = self._screen.get_ansi_frame()
+
+        if self._clear:
+            frame = "\x1b[2J" + frame
+            self._clear = False
+
+        self._json_dump([round(timestamp, 6), "o", frame], self._file)
+        self._file.write("\n")
+
+def _new_window(parent_window, height, width, y, x):
+    # grid screens hold their own windows, while the curses ones are
+    # global
+    if isinstance(parent_window, GridScreen):
+        return parent_window.newwin(height, width, y, x)
+
+    return curses.newwin(height, width, y, x)
+
 class _SubWindow:
     """
     Game sub-window
@@ -41,8 +260,8 @@ class _SubWindow:
                 new_width - 2 * _SubWindow._BORDER_WIDTH,
                 new_height - 2 * _SubWindow._BORDER_WIDTH)
 
-    def __init__(self, x, y, width, height):
-        self._window = curses.newwin(height, width, y, x)
+    def __init__(self, parent_window, x, y, width, height):
+        self._window = _new_window(parent_window, height, width, y, x)
         self._update_draw_area_size_pos(width, height)
 
     def get_window_size(self):
@@ -76,6 +295,67 @@ class _SubWindow:
         self._actual_draw()
         self._window.refresh()
 
+class _ReflowedMessage:
+    """
+    Message reflowed to the given width
+
+    Paragraphs are wrapped on demand, so only the lines up to the last
+    requested one are computed.
+    """
+
+    def __init__(self, message, width):
+        self._paragraphs = iter(message.splitlines())
+        self._width = width
+
+        self._lines = []
+        self._complete = False
+
+    def _reflow_until(self, lines_cnt):
+        while not self._complete and len(self._lines) < lines_cnt:
+            paragraph = next(self._paragraphs, None)
+
+            if paragraph == None:
+                self._complete = True
+            elif paragraph != "":
+                self._lines.extend(textwrap.wrap(
+                        paragraph,
+                        width = self._width))
+            else:
+                # empty paragraph is kept as the blank line
+                self._lines.append("")
+
+    def get_lines(self, start_line, line_cnt):
+        self._reflow_until(start_line + line_cnt)
+        return self._lines[start_line:start_line + line_cnt]
+
+    def has_line(self, line_index):
+        """
+        Returns true value if the message has the line with the index
+
+        Only the paragraphs up to that line are reflowed.
+        """
+
+        self._reflow_until(line_index + 1)
+        return len(self._lines) > line_index
+
+    def is_complete(self):
+        """
+        Returns true value if the whole message is reflowed
+        """
+
+        return self._complete
+
+    def get_lines_cnt(self):
+        while not self._complete:
+            self._reflow_until(len(self._lines) + 1)
+        return len(self._lines)
+
+# resizing the window in steps goes through the same widths over and
+# over, so the reflowed messages are kept for reuse
+@functools.lru_cache(maxsize = 64)
+def _reflow_message(message, width):
+    return _ReflowedMessage(message, width)
+
 class _MessageWindow(_SubWindow):
     """
     Message window helper class
@@ -86,8 +366,9 @@ class _MessageWindow(_SubWindow):
     drawing.
     """
 
-    def __init__(self, title, message, x, y, width, height):
-        super().__init__(x, y, width, height)
+    def __init__(self, parent_window, title, message, x, y, width,
+            height):
+        super().__init__(parent_window, x, y, width, height)
 
         self._title = title
         self._message = message
@@ -95,22 +376,9 @@ class _MessageWindow(_SubWindow):
         self._reflow_message()
 
     def _reflow_message(self):
-        self._message_lines = []
-
-        for paragraph in self._message.splitlines():
-            if paragraph != "":
-                wrapped_paragraph = textwrap.wrap(
-                        paragraph,
-                        width = self._draw_area_wh[0])
-                self._message_lines.extend(wrapped_paragraph)
-            else:
-                # [TODO] quick fix to avoid the skipping of newlines
-                self._message_lines.append("")
-
-        # sign change is done in order to get the ceiling while rounding
-        # the real value
-        self._num_pages = -(
-                -len(self._message_lines) // self._draw_area_wh[1])
+        # actual reflowing is deferred until the lines are drawn
+        self._reflowed_message = _reflow_message(
+                self._message, self._draw_area_wh[0])
 
         self._page_index = 0
 
@@ -121,10 +389,23 @@ class _MessageWindow(_SubWindow):
     def _actual_draw(self):
         TITLE_INDENT = 2
 
-        if self._num_pages > 1:
-            # add the curr. page index in the title
-            title_pages = self._title + " (page {} of {})".format(
-                    self._page_index + 1, self._num_pages)
+        page_height = self._draw_area_wh[1]
+        page_lines = self._reflowed_message.get_lines(
+                self._page_index * page_height, page_height)
+        has_next_page = self.has_next_page()
+
+        # the number of pages is shown only once the message is reflowed
+        # to its end
+        if self._reflowed_message.is_complete():
+            num_pages = self.get_num_pages()
+            if num_pages > 1:
+                title_pages = self._title + " (page {} of {})".format(
+                        self._page_index + 1, num_pages)
+            else:
+                title_pages = self._title
+        elif self._page_index > 0 or has_next_page:
+            title_pages = self._title + " (page {})".format(
+                    self._page_index + 1)
         else:
             title_pages = self._title
 
@@ -135,19 +416,28 @@ class _MessageWindow(_SubWindow):
 
         self._window.addstr(0, TITLE_INDENT, prepared_title)
 
-        start_line = self._page_index * self._draw_area_wh[1]
-        line_cnt = self._draw_area_wh[1]
-        if start_line + line_cnt > len(self._message_lines):
-            line_cnt = len(self._message_lines) - start_line
-
-        for msg_line in range(0, line_cnt):
+        for (msg_line, line_text) in enumerate(page_lines):
             self._window.addstr(
                     self._draw_area_xy[1] + msg_line,
                     self._draw_area_xy[0],
-                    self._message_lines[start_line + msg_line])
+                    line_text)
 
     def get_num_pages(self):
-        return self._num_pages
+        """
+        Returns the number of pages
+
+        Whole message is reflowed, so it is used only when the last page
+        is needed.
+        """
+
+        # sign change is done in order to get the ceiling while rounding
+        # the real value
+        return -(-self._reflowed_message.get_lines_cnt() //
+                self._draw_area_wh[1])
+
+    def has_next_page(self):
+        return self._reflowed_message.has_line(
+                (self._page_index + 1) * self._draw_area_wh[1])
 
     def get_page_index(self):
         return self._page_index
@@ -162,23 +452,30 @@ class _BoardWindow(_SubWindow):
     This window is used to represent the game board.
     """
 
-    def __init__(self, x, y, width, height, board_wh_tiles, 
-            free_tile_value):
-        super().__init__(x, y, width, height)
+    def __init__(self, parent_window, x, y, width, height,
+            board_wh_tiles, free_tile_value):
+        super().__init__(parent_window, x, y, width, height)
 
         self._board_wh_tiles = board_wh_tiles
         self._free_tile_value = free_tile_value
 
         self._fit_window_to_board()
 
+    def _calc_tile_size(self, draw_area_wh):
+        """
+        Calculate the size of tiles, in characters, for the draw area
+        """
+
+        return tuple(win_dim // cnt
+                for (win_dim, cnt) in
+                zip(draw_area_wh, self._board_wh_tiles))
+
     def _calc_tile_board_size(self):
         """
         Calculate the size of tiles, and board, in characters
         """
 
-        self._tile_wh = tuple(win_dim // cnt
-                for (win_dim, cnt) in
-                zip(self._draw_area_wh, self._board_wh_tiles))
+        self._tile_wh = self._calc_tile_size(self._draw_area_wh)
         self._inside_tile_wh = tuple(
                 tile_dim - 2 for tile_dim in self._tile_wh)
         return tuple(tile_dim * board_dim
@@ -190,8 +487,15 @@ class _BoardWindow(_SubWindow):
         super().resize_draw_area(board_width, board_height)
 
     def resize_window(self, new_width, new_height):
-        super().resize_window(new_width, new_height)
-        self._fit_window_to_board()
+        new_tile_wh = self._calc_tile_size((
+                new_width - 2 * _SubWindow._BORDER_WIDTH,
+                new_height - 2 * _SubWindow._BORDER_WIDTH))
+
+        # the window is fit to the board, so it stays the same if the
+        # tiles do
+        if new_tile_wh != self._tile_wh:
+            super().resize_window(new_width, new_height)
+            self._fit_window_to_board()
 
         return self.get_window_size()
     
@@ -278,7 +582,7 @@ class CursesOutput:
     Curses output class
 
     Encapsulate all the necessary data to provide the visual output of 
-    the game to the specified curses window.
+    the game to the specified curses window, or the `GridScreen`.
     """
 
     # number of lines used by the main window
@@ -305,7 +609,22 @@ class CursesOutput:
 
         self._status_line_text = "Game status line"
 
+        self._win_wh = None
+
+        self._metrics = None
+
+        # render scheduling: minimal time between the frames, in seconds
+        # (`None` renders every update, and 0 only the flushed frames)
+        self._frame_period = None
+        self._frame_pending = False
+        self._last_frame_time = None
+
+        # the board window, and the intro are built here, rather than on
+        # the first render, as `update_game_state` below renders the first
+        # frame, which shows both; the intro is reflowed only up to the
+        # page shown
         self._board = _BoardWindow(
+                self._window,
                 0, 2,
                 2, 2, # filler values
                 self._game_ctrl.get_board_dimensions(),
@@ -326,16 +645,31 @@ class CursesOutput:
                 board_win_width, board_win_height)
         # because the board will fit to the size of the board, the main
         # window now needs to accomodate to it
-        self._win_wh = (
+        new_win_wh = (
                 board_win_wh[0],
                 board_win_wh[1] + CursesOutput._MAIN_WINDOW_LINES)
 
-        self._update_message_window_sizes()
+        # message windows are sized by the main window only
+        if new_win_wh != self._win_wh:
+            self._win_wh = new_win_wh
+            self._update_message_window_sizes()
 
         if redraw:
             self.redraw()
 
+    def attach_metrics(self, metrics):
+        """
+        Attach the curses metrics, which record the redraws
+
+        `None` detaches them.
+        """
+
+        self._metrics = metrics
+
     def redraw(self):
+        if self._metrics != None:
+            redraw_start_time = time.perf_counter()
+
         self._window.erase()
         self._draw_outer_elements()
         self._window.refresh()
@@ -346,6 +680,10 @@ class CursesOutput:
             if msg_window != None:
                 msg_window.redraw()
 
+        if self._metrics != None:
+            self._metrics.record_redraw(
+                    time.perf_counter() - redraw_start_time)
+
     def _draw_outer_elements(self):
         dc = _DrawCharacters
 
@@ -360,17 +698,98 @@ class CursesOutput:
         # top info
         draw_line("2048 copy")
         draw_line("Score: {}".format(self._score))
-        # status line
-        draw_y = self._win_wh[1] - 1
-        draw_line(self._status_line_text)
+
+        self._draw_status_line()
+
+    def _draw_status_line(self):
+        status_y = self._win_wh[1] - 1
+
+        # while the relayout after the terminal resize is pending, the
+        # line can be below the shrunk window; the relayout draws it
+        if status_y >= self._window.getmaxyx()[0]:
+            return
+
+        self._window.move(status_y, 0)
+        self._window.clrtoeol()
+        # `insstr` needed because of the bottom line
+        self._window.insstr(status_y, 0, self._status_line_text)
+
+    def set_status_line_text(self, text):
+        """
+        Set the status line text
+
+        Only the status line is redrawn, so the text can be updated
+        often, e.g. by the hints.
+        """
+
+        self._status_line_text = text
+        self._draw_status_line()
+        self._window.refresh()
+
+    def set_max_fps(self, max_fps):
+        """
+        Set the render scheduling
+
+        With `None`, every game state update is rendered. With the
+        positive value, at most that many frames per second are rendered
+        by `render_pending`, always with the latest state. With 0, the
+        frames are rendered only when flushed, on the keypress, or at the
+        game end.
+        """
+
+        if max_fps == None:
+            self._frame_period = None
+            self.flush_frame()
+        elif max_fps == 0:
+            self._frame_period = 0
+        else:
+            self._frame_period = 1.0 / max_fps
 
     def update_game_state(self):
+        self._frame_pending = True
+
+        if self._frame_period == None:
+            self.flush_frame()
+        else:
+            self.render_pending()
+
+    def render_pending(self):
+        """
+        Render the pending frame, if the frame period has passed
+
+        Needs to be called regularly when the frames are throttled.
+        """
+
+        if not self._frame_pending or self._frame_period == 0:
+            return
+
+        now = time.monotonic()
+
+        if self._frame_period != None and \
+                self._last_frame_time != None and \
+                now - self._last_frame_time < self._frame_period:
+            return
+
+        self.flush_frame()
+
+    def flush_frame(self):
+        """
+        Render the pending frame immediately
+        """
+
+        if not self._frame_pending:
+            return
+
+        self._frame_pending = False
+        self._last_frame_time = time.monotonic()
+
         self._board.set_board_pieces(self._game_ctrl.get_board_state())
         self._score = self._game_ctrl.get_current_score()
         self.redraw()
 
     def _create_message_window(self, index, title, message):
         self._message_windows[index] = _MessageWindow(
+                self._window,
                 title, message,
                 1, 1,
                 self._win_wh[0] - 2, self._win_wh[1] - 2)
@@ -386,6 +805,9 @@ class CursesOutput:
                         self._win_wh[1] - 2)
 
     def open_help(self):
+        # help documents are loaded, and reflowed, only when needed
+        from . import helpdocs
+
         self._create_message_window(
                 CursesOutput._MessageWindowIndices.mwi_help,
                 "2048 game help",
@@ -398,6 +820,9 @@ class CursesOutput:
         self.redraw()
 
     def open_endgame_message(self):
+        # final state is always shown
+        self.flush_frame()
+
         endgame_message = "".join([
                 "Sorry, no more moves available =(.",
                 " Current score is {}.".format(self._score)])
@@ -449,10 +874,10 @@ class CursesOutput:
 
         if curr_win != None:
             current_page_index = curr_win.get_page_index()
-            if current_page_index == curr_win.get_num_pages() - 1:
-                curr_win.set_page_index(0)
-            else:
+            if curr_win.has_next_page():
                 curr_win.set_page_index(current_page_index + 1)
+            else:
+                curr_win.set_page_index(0)
             self.redraw()
 
     def current_win_previous_page(self):
@@ -461,6 +886,7 @@ class CursesOutput:
         if curr_win != None:
             current_page_index = curr_win.get_page_index()
             if current_page_index == 0:
+                # only the wrap to the last page reflows the whole message
                 curr_win.set_page_index(curr_win.get_num_pages() - 1)
             else:
                 curr_win.set_page_index(current_page_index - 1)
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+
+"""
+Differential test module
+
+Generates the corpus of the seeded games played by the pure-Python game
+controller, which is the oracle, and replays them through the engine
+backends (`BACKENDS`), checking the board, the score, and the endgame
+state after every move.
+
+Corpus is stored compressed: every move is the direction, the new piece,
+and the checksum of the expected state, so the corpus of the thousands
+of games takes a few megabytes.
+
+Running the module as a script generates the corpus (`generate`), or
+checks the backends against it (`check`), in the worker processes, and
+reports their throughput.
+"""
+
+from . import ai
+from . import gamectrl
+from . import movekern
+from . import rng
+
+import struct
+import sys
+import time
+import zlib
+
+# corpus file: magic, format version, master seed, and the games count,
+# followed by the compressed games
+_CORPUS_MAGIC = b"2048DIFF"
+_CORPUS_VERSION = 1
+_CORPUS_HEADER = struct.Struct("<8sHQI")
+
+# game: board width, height, and the moves count, followed by the
+# initial tiles, and the moves
+_GAME_HEADER = struct.Struct("<BBH")
+# move: direction value, new piece tile index, and its base-2 logarithm,
+# and the checksum of the state after the move
+_MOVE_RECORD = struct.Struct("<BBBI")
+# tile index of the move which put no new piece
+_NO_SPAWN = 0xff
+
+# boards of the corpus games, the 4x4 ones being the most common
+_BOARD_DIMENSIONS = ((4, 4), (4, 4), (4, 4), (3, 3), (2, 2), (5, 3),
+        (3, 5))
+# one in this many moves is in the random direction, which may not move
+# the pieces
+_ILLEGAL_MOVE_ODDS = 8
+_MAX_MOVES = 5000
+
+# random streams of one game
+_BOARD_STREAM = 0
+_MOVES_STREAM = 1
+
+def _state_checksum(tiles, score, endgame):
+    """
+    Returns the checksum of the state, given as the base-2 logarithms of
+    the tiles, in the row-major order, the score, and the endgame flag
+    """
+
+    return zlib.crc32(bytes(tiles) + struct.pack("<QB", score, endgame))
+
+def _get_controller_tiles(game_ctrl):
+    ftv = game_ctrl.get_free_tile_value()
+    return [value.bit_length() - 1 if value != ftv else 0
+            for board_row in game_ctrl.get_board_state()
+            for value in board_row]
+
+class _SpawnRecorder:
+    """
+    Game observer which keeps the last new piece
+    """
+
+    def __init__(self):
+        self.spawned_piece = None
+
+    def game_moved(self, movement_direction, spawned_piece):
+        self.spawned_piece = spawned_piece
+
+    def game_reset(self):
+        pass
+
+def _generate_games(master_seed, first_game_index, games_cnt):
+    """
+    Play the games with the oracle, and returns them encoded
+
+    Every game is seeded from the master seed, and its index, so the
+    corpus doesn't depend on the chunks, and the workers.
+    """
+
+    board_random = rng.BlockRandom()
+    moves_random = rng.BlockRandom()
+    recorder = _SpawnRecorder()
+    directions = tuple(gamectrl.MovementDirections)
+
+    blob = bytearray()
+
+    for game_index in range(first_game_index,
+            first_game_index + games_cnt):
+        board_random.seed(rng.derive_seed(master_seed, game_index,
+                _BOARD_STREAM))
+        moves_random.seed(rng.derive_seed(master_seed, game_index,
+                _MOVES_STREAM))
+
+        (bw, bh) = moves_random.choice(_BOARD_DIMENSIONS)
+        game_ctrl = gamectrl.GameController(bw, bh,
+                use_move_kernel = False, random_generator = board_random)
+        headless = gamectrl.HeadlessController()
+        game_ctrl.attach_output(headless)
+        game_ctrl.attach_input(headless)
+        game_ctrl.attach_observer(recorder)
+        game_ctrl.resume_game()
+
+        initial_tiles = _get_controller_tiles(game_ctrl)
+        moves = bytearray()
+        moves_cnt = 0
+
+        while not game_ctrl.is_endgame() and moves_cnt < _MAX_MOVES:
+            if moves_random.randint(1, _ILLEGAL_MOVE_ODDS) == 1:
+                direction = moves_random.choice(directions)
+            else:
+                legal_moves = game_ctrl.legal_moves()
+                # in the fixed order, so the games are reproducible
+                direction = moves_random.choice(
+                        [direction for direction in directions
+                        if direction in legal_moves])
+
+            recorder.spawned_piece = None
+            game_ctrl.move_pieces(direction)
+
+            if recorder.spawned_piece != None:
+                (row, col, value) = recorder.spawned_piece
+                (spawn_index, spawn_rank) = \
+                        (row * bw + col, value.bit_length() - 1)
+            else:
+                (spawn_index, spawn_rank) = (_NO_SPAWN, 0)
+
+            moves.extend(_MOVE_RECORD.pack(direction.value, spawn_index,
+                    spawn_rank, _state_checksum(
+                    _get_controller_tiles(game_ctrl),
+                    game_ctrl.get_current_score(),
+                    game_ctrl.is_endgame())))
+            moves_cnt += 1
+
+        blob.extend(_GAME_HEADER.pack(bw, bh, moves_cnt))
+        blob.extend(initial_tiles)
+        blob.extend(moves)
+
+    return bytes(blob)
+
+def _generate_games_chunk(chunk):
+    return _generate_games(*chunk)
+
+def generate_corpus(path, games_cnt, master_seed = 0, workers_cnt = None,
+        chunk_games_cnt = 100):
+    """
+    Generate the corpus of the games, played in the worker processes,
+    and store it to the file
+    """
+
+    import multiprocessing
+
+    chunks = [(master_seed, first_game_index,
+            min(chunk_games_cnt, games_cnt - first_game_index))
+            for first_game_index in range(0, games_cnt, chunk_games_cnt)]
+
+    compressor = zlib.compressobj(9)
+
+    with open(path, "wb") as corpus_file:
+        corpus_file.write(_CORPUS_HEADER.pack(_CORPUS_MAGIC,
+                _CORPUS_VERSION, master_seed, games_cnt))
+
+        with multiprocessing.Pool(workers_cnt) as pool:
+            # written in the order, so the corpus is the same for any
+            # number of the workers
+            for blob in pool.imap(_generate_games_chunk, chunks):
+                corpus_file.write(compressor.compress(blob))
+
+        corpus_file.write(compressor.flush())
+
+def load_corpus(path):
+    """
+    Returns the games of the corpus, as the list of the encoded games
+    """
+
+    with open(path, "rb") as corpus_file:
+        data = corpus_file.read()
+
+    (magic, version, master_seed, games_cnt) = \
+            _CORPUS_HEADER.unpack_from(data)
+    if magic != _CORPUS_MAGIC or version != _CORPUS_VERSION:
+        raise ValueError("{!r} is not the corpus file".format(path))
+
+    blob = zlib.decompress(data[_CORPUS_HEADER.size:])
+    games = []
+    offset = 0
+
+    for game_index in range(games_cnt):
+        (bw, bh, moves_cnt) = _GAME_HEADER.unpack_from(blob, offset)
+        game_size = _GAME_HEADER.size + bw * bh + \
+                moves_cnt * _MOVE_RECORD.size
+        games.append(blob[offset:offset + game_size])
+        offset += game_size
+
+    return games
+
+class _ControllerBackend:
+    """
+    Game controller backend
+
+    Replays the moves with `GameController.replay_move`, with the
+    compiled move kernel, or without it.
+    """
+
+    def __init__(self, use_move_kernel):
+        self._use_move_kernel = use_move_kernel
+        # controllers are reused for the games with the same board
+        self._game_ctrls = {}
+
+    def is_available(self):
+        return not self._use_move_kernel or movekern.is_loaded()
+
+    def supports(self, board_width, board_height):
+        return True
+
+    def start(self, board_width, board_height, tiles):
+        game_ctrl = self._game_ctrls.get((board_width, board_height))
+
+        if game_ctrl == None:
+            game_ctrl = gamectrl.GameController(board_width, board_height,
+                    use_move_kernel = self._use_move_kernel)
+            headless = gamectrl.HeadlessController()
+            game_ctrl.attach_output(headless)
+            game_ctrl.attach_input(headless)
+            game_ctrl.resume_game()
+            self._game_ctrls[(board_width, board_height)] = game_ctrl
+
+        game_ctrl.load_game_state(
+                [[1 << rank if rank != 0 else 0
+                for rank in tiles[row * board_width:
+                        (row + 1) * board_width]]
+                for row in range(board_height)], 0)
+
+        self._game_ctrl = game_ctrl
+        self._board_width = board_width
+
+    def move(self, direction, spawn_index, spawn_rank):
+        """
+        Returns the tiles, the score, and the endgame flag after the move
+        """
+
+        game_ctrl = self._game_ctrl
+
+        if spawn_index != _NO_SPAWN:
+            spawned_piece = (spawn_index // self._board_width,
+                    spawn_index % self._board_width, 1 << spawn_rank)
+        else:
+            spawned_piece = None
+
+        game_ctrl.replay_move(direction, spawned_piece)
+
+        return (_get_controller_tiles(game_ctrl),
+                game_ctrl.get_current_score(), game_ctrl.is_endgame())
+
+# score gained by the merges is the half of the increase of the sum of
+# `value * log2(value)` over the tiles, built on the first use
+_row_potentials = None
+
+def _get_row_potentials():
+    global _row_potentials
+
+    if _row_potentials == None:
+        _row_potentials = [
+                sum((1 << rank) * rank
+                for rank in ((row >> shift) & 0xf
+                for shift in range(0, 16, 4))
+                if rank != 0)
+                for row in range(1 << 16)]
+
+    return _row_potentials
+
+class _BitboardBackend:
+    """
+    Bitboard backend
+
+    Replays the 4x4 games with the 64-bit boards of the `ai` module.
+    """
+
+    def is_available(self):
+        return True
+
+    def supports(self, board_width, board_height):
+        return (board_width, board_height) == (4, 4)
+
+    def start(self, board_width, board_height, tiles):
+        self._bits = sum(rank << (4 * index)
+                for (index, rank) in enumerate(tiles))
+        self._score = 0
+        self._potentials = _get_row_potentials()
+
+    def _get_potential(self, bits):
+        potentials = self._potentials
+        return potentials[bits & 0xffff] + \
+                potentials[(bits >> 16) & 0xffff] + \
+                potentials[(bits >> 32) & 0xffff] + \
+                potentials[bits >> 48]
+
+    def move(self, direction, spawn_index, spawn_rank):
+        bits = self._bits
+        moved = ai.move_board_bits(bits, direction)
+
+        if moved != bits:
+            self._score += (self._get_potential(moved) -
+                    self._get_potential(bits)) // 2
+            if spawn_index != _NO_SPAWN:
+                moved |= spawn_rank << (4 * spawn_index)
+            self._bits = moved
+
+        endgame = all(ai.move_board_bits(moved, other_direction) == moved
+                for other_direction in ai.DIRECTIONS)
+
+        return ([(moved >> shift) & 0xf for shift in range(0, 64, 4)],
+                self._score, endgame)
+
+# backends, by the name
+BACKENDS = {
+        "python": lambda: _ControllerBackend(use_move_kernel = False),
+        "kernel": lambda: _ControllerBackend(use_move_kernel = True),
+        "bitboard": _BitboardBackend}
+
+def _check_games(backend_name, first_game_index, games):
+    """
+    Replay the games through the backend
+
+    Returns the number of the checked moves, the time spent, the
+    mismatches, as the (game index, move index) pairs, and the number of
+    the games the backend doesn't support.
+    """
+
+    backend = BACKENDS[backend_name]()
+
+    moves_cnt = 0
+    mismatches = []
+    skipped_cnt = 0
+
+    start_time = time.perf_counter()
+
+    for (game_index, game) in enumerate(games, first_game_index):
+        (bw, bh, game_moves_cnt) = _GAME_HEADER.unpack_from(game)
+
+        if not backend.supports(bw, bh):
+            skipped_cnt += 1
+            continue
+
+        moves_offset = _GAME_HEADER.size + bw * bh
+        backend.start(bw, bh, game[_GAME_HEADER.size:moves_offset])
+
+        for (move_index, (direction_value, spawn_index, spawn_rank,
+                checksum)) in enumerate(
+                _MOVE_RECORD.iter_unpack(game[moves_offset:])):
+            moves_cnt += 1
+
+            try:
+                (tiles, score, endgame) = backend.move(
+                        gamectrl.MovementDirections(direction_value),
+                        spawn_index, spawn_rank)
+                matched = _state_checksum(tiles, score, endgame) == \
+                        checksum
+            except Exception:
+                # failing backend, or the state which can't even be
+                # packed, is the mismatch as well
+                matched = False
+
+            if not matched:
+                # the rest of the game is off
+                mismatches.append((game_index, move_index))
+                break
+
+    return (moves_cnt, time.perf_counter() - start_time, mismatches,
+            skipped_cnt)
+
+def _check_games_chunk(chunk):
+    return _check_games(*chunk)
+
+def check_backend(backend_name, games, workers_cnt = None,
+        chunk_games_cnt = 50):
+    """
+    Replay the corpus games through the backend, in the worker processes
+
+    Returns the number of the checked moves, the elapsed time, the
+    mismatches, as the (game index, move index) pairs, and the number of
+    the skipped games.
+    """
+
+    import multiprocessing
+
+    chunks = [(backend_name, first_game_index,
+            games[first_game_index:first_game_index + chunk_games_cnt])
+            for first_game_index in
+            range(0, len(games), chunk_games_cnt)]
+
+    moves_cnt = 0
+    mismatches = []
+    skipped_cnt = 0
+
+    start_time = time.perf_counter()
+
+    with multiprocessing.Pool(workers_cnt) as pool:
+        for (chunk_moves_cnt, chunk_elapsed, chunk_mismatches,
+                chunk_skipped_cnt) in pool.imap(_check_games_chunk, chunks):
+            moves_cnt += chunk_moves_cnt
+            mismatches.extend(chunk_mismatches)
+            skipped_cnt += chunk_skipped_cnt
+
+    return (moves_cnt, time.perf_counter() - start_time, mismatches,
+            skipped_cnt)
+
+def _main(args):
+    command = args[0] if args else None
+
+    if command == "generate" and len(args) >= 2:
+        games_cnt = int(args[2]) if len(args) > 2 else 1000
+        master_seed = int(args[3]) if len(args) > 3 else 0
+
+        start_time = time.perf_counter()
+        generate_corpus(args[1], games_cnt, master_seed)
+        print("{} games generated in {:.1f} s".format(
+                games_cnt, time.perf_counter() - start_time))
+        return 0
+    elif command == "check" and len(args) >= 2:
+        games = load_corpus(args[1])
+        backend_names = args[2:] or list(BACKENDS)
+        failed = False
+
+        for backend_name in backend_names:
+            if not BACKENDS[backend_name]().is_available():
+                print("{}: not available".format(backend_name))
+                continue
+
+            (moves_cnt, elapsed, mismatches, skipped_cnt) = \
+                    check_backend(backend_name, games)
+
+            print("{}: {} moves, {:.0f} moves/s, {} mismatches, "
+                    "{} games skipped".format(
+                    backend_name, moves_cnt, moves_cnt / elapsed,
+                    len(mismatches), skipped_cnt))
+            for (game_index, move_index) in mismatches[:10]:
+                print("  game {} move {}".format(game_index, move_index))
+
+            failed = failed or mismatches != []
+
+        print("differential test {}".format("failed" if failed else "ok"))
+        return 1 if failed else 0
+    else:
+        print("usage: python3 -m components.difftest "
+                "generate CORPUS [GAMES [SEED]] | check CORPUS [BACKEND...]")
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+
+"""
+Game environment module
+
+Has the `GameEnv` class, the Gym-style environment around the game
+controller, and `VectorGameEnv`, which steps many environments at
+once, in this process, or in the worker processes.
+
+Actions are the indices in `ACTIONS`. Observations are the tiles in the
+row-major order, as the base-2 logarithms of the values (0 for the free
+tile), and rewards are the score increases.
+
+Running the module as a script reports the steps per second.
+"""
+
+from . import gamectrl
+from . import rng
+
+import multiprocessing
+import random
+import struct
+import sys
+import time
+
+ACTIONS = (
+        gamectrl.MovementDirections.up,
+        gamectrl.MovementDirections.down,
+        gamectrl.MovementDirections.left,
+        gamectrl.MovementDirections.right)
+
+class GameEnv:
+    """
+    Game environment class
+
+    Gym-style environment, with `reset`, and `step` methods, over the
+    headless game controller with its own random generator.
+    """
+
+    def __init__(self, **game_kwargs):
+        """
+        Initialization method
+
+        Keyword arguments are passed to the game controller.
+        """
+
+        self._random = rng.BlockRandom()
+        self._headless = gamectrl.HeadlessController()
+
+        self._game_ctrl = gamectrl.GameController(
+                random_generator = self._random, **game_kwargs)
+        self._game_ctrl.attach_output(self._headless)
+        self._game_ctrl.attach_input(self._headless)
+        self._game_ctrl.attach_observer(self)
+        self._game_ctrl.resume_game()
+
+        self._ftv = self._game_ctrl.get_free_tile_value()
+        self._moved = False
+
+    def get_observation_size(self):
+        """
+        Returns the number of values in the observation
+        """
+
+        (bw, bh) = self._game_ctrl.get_board_dimensions()
+        return bw * bh
+
+    def get_game_controller(self):
+        """
+        Returns the underlying game controller
+        """
+
+        return self._game_ctrl
+
+    def reset(self, seed = None):
+        """
+        Start the new game
+
+        Returns the observation. The game is reproducible when the seed
+        is given.
+        """
+
+        self._random.seed(seed)
+        self._game_ctrl.reset_game()
+
+        return self.get_observation()
+
+    def step(self, action):
+        """
+        Move the pieces in the direction of the action
+
+        Returns the (observation, reward, done, info) tuple. The info
+        has the `score`, the `moved` flag (false for the illegal
+        action), and the `legal_mask` of the next actions.
+        """
+
+        gc = self._game_ctrl
+
+        old_score = gc.get_current_score()
+        self._moved = False
+        gc.move_pieces(ACTIONS[action])
+        score = gc.get_current_score()
+
+        info = {
+                "score": score,
+                "moved": self._moved,
+                "legal_mask": self.get_legal_mask()}
+
+        return (self.get_observation(), score - old_score,
+                gc.is_endgame(), info)
+
+    def get_observation(self):
+        """
+        Returns the current observation
+        """
+
+        ftv = self._ftv
+
+        return [0 if value == ftv else value.bit_length() - 1
+                for board_row in self._game_ctrl.get_board_state()
+                for value in board_row]
+
+    def get_legal_mask(self):
+        """
+        Returns the tuple with the legal flag for every action
+        """
+
+        legal_moves = self._game_ctrl.legal_moves()
+
+        return tuple(direction in legal_moves for direction in ACTIONS)
+
+    # game observer
+    #
+
+    def game_moved(self, movement_direction, spawned_piece):
+        self._moved = True
+
+    def game_reset(self):
+        pass
+
+class _VectorBuffers:
+    """
+    Vector environment buffers
+
+    Lays out the actions, rewards, scores, done flags, observations,
+    and legal masks of all the environments in one buffer, so it can be
+    shared with the worker processes.
+    """
+
+    def __init__(self, buffer, envs_cnt, observation_size):
+        memory = memoryview(buffer)
+        offset = 0
+
+        def take(size):
+            nonlocal offset
+            region = memory[offset:offset + size]
+            # next region is aligned for the 64-bit values
+            offset += -(-size // 8) * 8
+            return region
+
+        self.rewards = take(8 * envs_cnt).cast("q")
+        self.scores = take(8 * envs_cnt).cast("q")
+        self.actions = take(envs_cnt)
+        self.dones = take(envs_cnt)
+        self.flat_observations = take(envs_cnt * observation_size)
+        self.flat_legal_masks = take(envs_cnt * len(ACTIONS))
+
+        self.observations = self.flat_observations.cast(
+                "B", (envs_cnt, observation_size))
+        self.legal_masks = self.flat_legal_masks.cast(
+                "B", (envs_cnt, len(ACTIONS)))
+
+        self._views = (memory, self.rewards, self.scores, self.actions,
+                self.dones, self.flat_observations,
+                self.flat_legal_masks, self.observations,
+                self.legal_masks)
+
+    @staticmethod
+    def get_size(envs_cnt, observation_size):
+        sizes = (8 * envs_cnt, 8 * envs_cnt, envs_cnt, envs_cnt,
+                envs_cnt * observation_size, envs_cnt * len(ACTIONS))
+        return sum(-(-size // 8) * 8 for size in sizes)
+
+    def release(self):
+        # views need to be released before the shared memory is closed
+        for view in reversed(self._views):
+            view.release()
+
+class _EnvGroup:
+    """
+    Group of environments, stepped through the vector buffers
+
+    Finished environments are reset automatically, while stepping.
+    """
+
+    def __init__(self, buffers, first_index, envs_cnt, game_kwargs):
+        self._buffers = buffers
+        self._first_index = first_index
+        self._envs = [GameEnv(**game_kwargs) for i in range(envs_cnt)]
+
+        self._observation_size = self._envs[0].get_observation_size()
+
+    def reset(self, seeds):
+        for (env_index, env) in enumerate(self._envs):
+            observation = env.reset(seeds[env_index])
+            self._store(self._first_index + env_index, observation,
+                    env.get_legal_mask(), 0, 0, False)
+
+    def step(self):
+        for (env_index, env) in enumerate(self._envs):
+            index = self._first_index + env_index
+
+            (observation, reward, done, info) = \
+                    env.step(self._buffers.actions[index])
+            legal_mask = info["legal_mask"]
+            score = info["score"]
+
+            if done:
+                # reset game continues with the same generator, so the
+                # runs stay reproducible
+                observation = env.reset(env._random.getrandbits(64))
+                legal_mask = env.get_legal_mask()
+                score = 0
+
+            self._store(index, observation, legal_mask, score, reward,
+                    done)
+
+    def _store(self, index, observation, legal_mask, score, reward,
+            done):
+        bufs = self._buffers
+        obs_size = self._observation_size
+        actions_cnt = len(ACTIONS)
+
+        bufs.flat_observations[index * obs_size:(index + 1) * obs_size] = \
+                bytes(observation)
+        bufs.flat_legal_masks[
+                index * actions_cnt:(index + 1) * actions_cnt] = \
+                bytes(legal_mask)
+
+        bufs.rewards[index] = reward
+        bufs.scores[index] = score
+        bufs.dones[index] = done
+
+# commands sent to the workers
+_CMD_RESET = b"r"
+_CMD_STEP = b"s"
+_CMD_CLOSE = b"c"
+
+def _worker_main(connection, shm_name, envs_cnt, observation_size,
+        first_index, group_envs_cnt, game_kwargs):
+    """
+    Worker process main loop
+
+    Commands, and seeds, are exchanged as raw bytes, while everything
+    else goes through the shared memory, so nothing is pickled while
+    stepping.
+    """
+
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name = shm_name)
+    buffers = _VectorBuffers(shm.buf, envs_cnt, observation_size)
+    group = _EnvGroup(buffers, first_index, group_envs_cnt, game_kwargs)
+
+    try:
+        while True:
+            command = connection.recv_bytes()
+
+            if command[:1] == _CMD_STEP:
+                group.step()
+            elif command[:1] == _CMD_RESET:
+                group.reset(_unpack_seeds(command[1:]))
+            else:
+                break
+
+            connection.send_bytes(b"")
+    finally:
+        buffers.release()
+        shm.close()
+
+def _pack_seeds(seeds):
+    return struct.pack(">{}Q".format(len(seeds)), *seeds)
+
+def _unpack_seeds(data):
+    return struct.unpack(">{}Q".format(len(data) // 8), data)
+
+class VectorGameEnv:
+    """
+    Vector game environment class
+
+    Steps many game environments at once, in this process, or split
+    between the worker processes. Results are returned as the views of
+    the shared buffers (observations, and legal masks are two
+    dimensional), valid until the next call. Finished environments are
+    reset automatically, in the same step which reports them done.
+    """
+
+    def __init__(self, envs_cnt, workers_cnt = 0, **game_kwargs):
+        """
+        Initialization method
+
+        Inputs are: number of the environments, and of the worker
+        processes (0 for stepping in this process), and the keyword
+        arguments for the game controllers.
+        """
+
+        self._envs_cnt = envs_cnt
+        self._observation_size = \
+                GameEnv(**game_kwargs).get_observation_size()
+        buffer_size = _VectorBuffers.get_size(
+                envs_cnt, self._observation_size)
+
+        self._shm = None
+        self._workers = []
+
+        if workers_cnt == 0:
+            self._buffers = _VectorBuffers(
+                    bytearray(buffer_size), envs_cnt,
+                    self._observation_size)
+            self._group = _EnvGroup(
+                    self._buffers, 0, envs_cnt, game_kwargs)
+            return
+
+        from multiprocessing import shared_memory
+
+        self._shm = shared_memory.SharedMemory(
+                create = True, size = buffer_size)
+        self._buffers = _VectorBuffers(
+                self._shm.buf, envs_cnt, self._observation_size)
+
+        first_index = 0
+        for worker_index in range(workers_cnt):
+            # environments are split as evenly as possible
+            group_envs_cnt = envs_cnt // workers_cnt + \
+                    (worker_index < envs_cnt % workers_cnt)
+            (parent_conn, child_conn) = multiprocessing.Pipe()
+
+            process = multiprocessing.Process(
+                    target = _worker_main,
+                    args = (child_conn, self._shm.name, envs_cnt,
+                            self._observation_size, first_index,
+                            group_envs_cnt, game_kwargs),
+                    daemon = True)
+            process.start()
+            child_conn.close()
+
+            self._workers.append((process, parent_conn, first_index,
+                    group_envs_cnt))
+            first_index += group_envs_cnt
+
+    def get_envs_cnt(self):
+        return self._envs_cnt
+
+    def reset(self, seed = None):
+        """
+        Start the new games in all the environments
+
+        Environment seeds are derived from the given one, and the
+        environment index, so they don't depend on the number of the
+        workers. Returns the observations.
+        """
+
+        if seed == None:
+            seed = random.getrandbits(64)
+
+        seeds = [rng.derive_seed(seed, env_index)
+                for env_index in range(self._envs_cnt)]
+
+        if self._workers == []:
+            self._group.reset(seeds)
+        else:
+            for (process, conn, first_index, group_envs_cnt) in \
+                    self._workers:
+                conn.send_bytes(_CMD_RESET + _pack_seeds(
+                        seeds[first_index:first_index + group_envs_cnt]))
+            self._wait_workers()
+
+        return self._buffers.observations
+
+    def step(self, actions):
+        """
+        Step all the environments with the given actions
+
+        Returns the (observations, rewards, dones, legal masks) tuple.
+        """
+
+        self._buffers.actions[:] = bytes(actions)
+
+        if self._workers == []:
+            self._group.step()
+        else:
+            for (process, conn, first_index, group_envs_cnt) in \
+                    self._workers:
+                conn.send_bytes(_CMD_STEP)
+            self._wait_workers()
+
+        bufs = self._buffers
+        return (bufs.observations, bufs.rewards, bufs.dones,
+                bufs.legal_masks)
+
+    def get_scores(self):
+        """
+        Returns the current scores of all the environments
+        """
+
+        return self._buffers.scores
+
+    def close(self):
+        """
+        Stop the workers, and release the shared memory
+        """
+
+        for (process, conn, first_index, group_envs_cnt) in self._workers:
+            conn.send_bytes(_CMD_CLOSE)
+        for (process, conn, first_index, group_envs_cnt) in self._workers:
+            process.join()
+            conn.close()
+        self._workers = []
+
+        self._buffers.release()
+
+        if self._shm != None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def _wait_workers(self):
+        for (process, conn, first_index, group_envs_cnt) in self._workers:
+            conn.recv_bytes()
+
+def _benchmark(steps_cnt = 20000):
+    """
+    Report the steps per second, for the single, and vector
+    environments
+    """
+
+    actions_random = random.Random(0)
+
+    env = GameEnv()
+    env.reset(0)
+    start_time = time.perf_counter()
+    for step_index in range(steps_cnt):
+        (observation, reward, done, info) = \
+                env.step(actions_random.randrange(len(ACTIONS)))
+        if done:
+            env.reset()
+    elapsed = time.perf_counter() - start_time
+    print("single env:          {:10.0f} steps/s".format(
+            steps_cnt / elapsed))
+
+    workers_cnts = (0, 2, multiprocessing.cpu_count())
+    envs_cnt = 64
+
+    for workers_cnt in workers_cnts:
+        vec_env = VectorGameEnv(envs_cnt, workers_cnt)
+        vec_env.reset(0)
+
+        iterations_cnt = max(1, steps_cnt // envs_cnt)
+        start_time = time.perf_counter()
+        for iteration in range(iterations_cnt):
+            vec_env.step([actions_random.randrange(len(ACTIONS))
+                    for i in range(envs_cnt)])
+        elapsed = time.perf_counter() - start_time
+        vec_env.close()
+
+        print("vector env, {:2d} workers: {:10.0f} steps/s".format(
+                workers_cnt, iterations_cnt * envs_cnt / elapsed))
+
+if __name__ == "__main__":
+    _benchmark(*(int(arg) for arg in sys.argv[1:2]))
@@ -3,11 +3,14 @@
 """
 Game controller module
 
-Has `MovementDirections` enum, and the `GameController` class.
+Has `MovementDirections` enum, the `GameController` class, and its
+thread-safe variant, `ConcurrentGameController`.
 """
 
+import bisect
 import enum
 import random
+import time
 
 class MovementDirections(enum.Enum):
     """
@@ -33,6 +36,141 @@ class _GameStates(enum.Enum):
     gs_endgame = 3
     gs_suspended = 4
 
+class SpawnDistribution:
+    """
+    New piece values distribution
+
+    Specifies the values the new pieces can have, and their
+    probabilities, given as the (value, weight) pairs.
+    """
+
+    def __init__(self, values_weights):
+        total_weight = sum(weight for (value, weight) in values_weights)
+
+        self._values = tuple(value for (value, weight) in values_weights)
+        self._probabilities = tuple(weight / total_weight
+                for (value, weight) in values_weights)
+
+        # cumulative weights make the drawing a single bisection
+        self._cum_weights = []
+        cum_weight = 0
+        for (value, weight) in values_weights:
+            cum_weight += weight
+            self._cum_weights.append(cum_weight)
+
+        self._total_weight = cum_weight
+        # integer weights summing up to the power of two are drawn with
+        # one integer, which needs no rejections, as the original version
+        # drew the value exponent; others with one float
+        self._integer_draw = all(isinstance(weight, int)
+                for (value, weight) in values_weights) and \
+                cum_weight & (cum_weight - 1) == 0
+
+    def get_outcomes(self):
+        """
+        Returns the (value, probability) pairs
+        """
+
+        return tuple(zip(self._values, self._probabilities))
+
+    def draw_value(self, random_generator = random):
+        """
+        Returns the value drawn with the given random generator
+
+        Uniform distribution draws the same numbers as the original
+        `2 ** randint(1, 2)`, as `randrange(2)` does the same draw.
+        """
+
+        if self._integer_draw:
+            point = random_generator.randrange(self._total_weight)
+        else:
+            point = random_generator.random() * self._total_weight
+
+        # the last value is the upper bound, also for the rounded floats
+        return self._values[bisect.bisect(self._cum_weights, point, 0,
+                len(self._values) - 1)]
+
+# 2, and 4 are equally probable, as in the original version of this game
+UNIFORM_SPAWN_DISTRIBUTION = SpawnDistribution(((2, 1), (4, 1)))
+# 2 has the 90% probability, as in the original 2048
+CLASSIC_SPAWN_DISTRIBUTION = SpawnDistribution(((2, 9), (4, 1)))
+
+# serialized game format, see `GameController.to_bytes`
+_SAVE_MAGIC = b"2048"
+_SAVE_VERSION = 2
+# versions which can be loaded
+_SAVE_LOADED_VERSIONS = (1, 2)
+# `struct` formats, the module is imported once the game is saved, or loaded
+_SAVE_HEADER = ">4sBBBBBiQ"
+_SAVE_RNG_STATE = ">625I?d"
+_SAVE_RNG_BLOCK_INDEX = ">H"
+_SAVE_RNG_SEED_DRAWS = ">QQ"
+
+# random generator kinds in the serialized game
+_SAVE_RNG_SHARED = 0
+_SAVE_RNG_MT = 1
+# `rng.BlockRandom`, saved as its source state, and the block index
+_SAVE_RNG_BLOCK = 2
+# `rng.BlockRandom`, saved as its seed, and the numbers drawn
+_SAVE_RNG_SEEDED = 3
+
+# legal moves are given as the bit masks, with the bit
+# (direction value - 1) set for the legal direction
+_LEGAL_MOVES_SETS = tuple(
+        frozenset(md for md in MovementDirections
+                if mask & (1 << (md.value - 1)))
+        for mask in range(1 << len(MovementDirections)))
+
+# 4-bit packed piece values, as used by the line moves table
+_PACKED_TILE_VALUES = {2 ** exp: exp for exp in range(1, 16)}
+
+# translates the line moves table entries, for rows (bits 0, and 1),
+# and columns (bits 2, and 3), to the legal moves mask
+_LINES_TO_LEGAL_MOVES_MASK = tuple(
+        ((lines_mask & 1) and 1 << (MovementDirections.left.value - 1)) |
+        ((lines_mask & 2) and 1 << (MovementDirections.right.value - 1)) |
+        ((lines_mask & 4) and 1 << (MovementDirections.up.value - 1)) |
+        ((lines_mask & 8) and 1 << (MovementDirections.down.value - 1))
+        for lines_mask in range(16))
+
+# line moves table, built on the first use
+_line_moves_table = None
+
+def _get_line_moves_table():
+    """
+    Returns the line moves table
+
+    Table is indexed by the line of four tiles, packed as the 4-bit
+    base-2 logarithms of the values (0 for the free tile), with the
+    first tile in the highest bits. Entry has the bit 0 set if any piece
+    can move towards the first tile, and the bit 1 set if any piece can
+    move towards the last tile.
+    """
+
+    global _line_moves_table
+
+    if _line_moves_table == None:
+        table = bytearray(1 << 16)
+
+        for line in range(1 << 16):
+            tiles = (line >> 12, (line >> 8) & 0xf, (line >> 4) & 0xf,
+                    line & 0xf)
+            entry = 0
+
+            for index in range(3):
+                (first, second) = tiles[index:index + 2]
+                # piece moves towards the free tile, or the same piece
+                if second != 0 and first in (0, second):
+                    entry |= 1
+                if first != 0 and second in (0, first):
+                    entry |= 2
+
+            table[line] = entry
+
+        _line_moves_table = table
+
+    return _line_moves_table
+
 class _Board:
     """
     Game board class
@@ -40,7 +178,9 @@ class _Board:
     Encapsulates the all manipulations with the game board.
     """
 
-    def __init__(self, board_width, board_height, free_tile_value):
+    def __init__(self, board_width, board_height, free_tile_value,
+            spawn_distribution = UNIFORM_SPAWN_DISTRIBUTION,
+            random_generator = random):
         """
         Creates an empty board with the given dimensions
         """
@@ -48,6 +188,11 @@ class _Board:
         self._board_width = board_width
         self._board_height = board_height
         self._free_tile_value = free_tile_value
+        self._spawn_distribution = spawn_distribution
+        self._random = random_generator
+
+        self._packed_tile_values = dict(_PACKED_TILE_VALUES)
+        self._packed_tile_values[free_tile_value] = 0
 
         self.reset_board()
 
@@ -109,35 +254,319 @@ class _Board:
 
         return self._free_tiles_cnt
 
+    def get_random_generator(self):
+        """
+        Returns the random generator used for the new pieces
+        """
+
+        return self._random
+
+    def get_spawn_distribution(self):
+        """
+        Returns the distribution of the new piece values
+        """
+
+        return self._spawn_distribution
+
     def generate_piece(self):
         """
         Generate new piece on the randomly selected free tile
+
+        Returns the row, column, and the value of the new piece.
         """
 
-        new_free_tile_index = random.randint(
-                0, self._free_tiles_cnt - 1)
-        new_piece_value = 2 ** random.randint(1, 2)
-        #new_piece_value = 2 ** random.randint(1, 12)
+        new_free_tile_index = self._random.randrange(
+                self._free_tiles_cnt)
+        new_piece_value = self._spawn_distribution.draw_value(
+                self._random)
 
-        new_piece_inserted = False
-        current_free_tile_index = 0
+        ftv = self._free_tile_value
 
-        for row in range(0, self._board_width):
-            for col in range(0, self._board_height):
-                if self._board[row][col] == self._free_tile_value:
-                    if current_free_tile_index == new_free_tile_index:
-                        self._board[row][col] = new_piece_value
-                        self._free_tiles_cnt -= 1
-                        return
-                    else:
-                        current_free_tile_index += 1
+        # rows with fewer free tiles are skipped as a whole
+        for (row, board_row) in enumerate(self._board):
+            row_free_tiles_cnt = board_row.count(ftv)
+
+            if new_free_tile_index < row_free_tiles_cnt:
+                col = -1
+                for free_tile_index in range(new_free_tile_index + 1):
+                    col = board_row.index(ftv, col + 1)
+
+                board_row[col] = new_piece_value
+                self._free_tiles_cnt -= 1
+                return (row, col, new_piece_value)
+
+            new_free_tile_index -= row_free_tiles_cnt
+
+    def get_legal_moves_mask(self):
+        """
+        Returns the mask of the directions in which any piece can move
+
+        4x4 board is checked with the line moves table, while other
+        boards are checked tile by tile.
+        """
+
+        if self._board_width == 4 and self._board_height == 4:
+            pv = self._packed_tile_values
+
+            # tile values are packed to the table index as the 4-bit
+            # logarithms, so the larger ones need the general check
+            try:
+                ((a0, a1, a2, a3), (b0, b1, b2, b3),
+                        (c0, c1, c2, c3), (d0, d1, d2, d3)) = \
+                        [[pv[value] for value in board_row]
+                        for board_row in self._board]
+            except KeyError:
+                return self._get_legal_moves_mask_general()
+
+            table = _get_line_moves_table()
+
+            rows_mask = \
+                    table[(a0 << 12) | (a1 << 8) | (a2 << 4) | a3] | \
+                    table[(b0 << 12) | (b1 << 8) | (b2 << 4) | b3] | \
+                    table[(c0 << 12) | (c1 << 8) | (c2 << 4) | c3] | \
+                    table[(d0 << 12) | (d1 << 8) | (d2 << 4) | d3]
+            cols_mask = \
+                    table[(a0 << 12) | (b0 << 8) | (c0 << 4) | d0] | \
+                    table[(a1 << 12) | (b1 << 8) | (c1 << 4) | d1] | \
+                    table[(a2 << 12) | (b2 << 8) | (c2 << 4) | d2] | \
+                    table[(a3 << 12) | (b3 << 8) | (c3 << 4) | d3]
+
+            return _LINES_TO_LEGAL_MOVES_MASK[rows_mask | (cols_mask << 2)]
+
+        return self._get_legal_moves_mask_general()
+
+    def _get_legal_moves_mask_general(self):
+        ftv = self._free_tile_value
+        board = self._board
+        bw = self._board_width
+        bh = self._board_height
+
+        (up, down, left, right) = (False, False, False, False)
+
+        for row in range(bh):
+            for col in range(bw):
+                value = board[row][col]
+                if value == ftv:
+                    continue
+
+                if row > 0 and not up:
+                    up = board[row - 1][col] in (ftv, value)
+                if row < bh - 1 and not down:
+                    down = board[row + 1][col] in (ftv, value)
+                if col > 0 and not left:
+                    left = board[row][col - 1] in (ftv, value)
+                if col < bw - 1 and not right:
+                    right = board[row][col + 1] in (ftv, value)
+
+        mds = MovementDirections
+
+        return \
+                (up << (mds.up.value - 1)) | \
+                (down << (mds.down.value - 1)) | \
+                (left << (mds.left.value - 1)) | \
+                (right << (mds.right.value - 1))
+
+    def get_spawn_outcomes(self):
+        """
+        Returns all the possible new pieces
+
+        Every outcome is given as the (row, column, value, probability)
+        tuple.
+        """
+
+        return list(self._iterate_spawn_outcomes())
+
+    def iterate_spawns(self):
+        """
+        Put every possible new piece on the board, one by one
+
+        For every outcome, the piece is put on the board while the
+        (row, column, value, probability) tuple is yielded, and removed
+        after that, so the board can be examined in place, without
+        copying it. The board must not be changed by the caller during
+        the iteration.
+        """
+
+        ftv = self._free_tile_value
+
+        for (row, col, value, probability) in \
+                self._iterate_spawn_outcomes():
+            self.set_tile(row, col, value)
+            try:
+                yield (row, col, value, probability)
+            finally:
+                self.set_tile(row, col, ftv)
+
+    def _iterate_spawn_outcomes(self):
+        if self._free_tiles_cnt == 0:
+            return
+
+        ftv = self._free_tile_value
+        tile_probability = 1 / self._free_tiles_cnt
+        value_outcomes = self._spawn_distribution.get_outcomes()
+
+        for row in range(self._board_height):
+            for col in range(self._board_width):
+                if self.get_tile(row, col) == ftv:
+                    for (value, probability) in value_outcomes:
+                        yield (row, col, value,
+                                tile_probability * probability)
 
     def get_whole_board(self):
         """
         Returns the whole board
+
+        The board is copied, so it doesn't change with the game.
         """
 
-        return self._board
+        return [board_row[:] for board_row in self._board]
+
+class _KernelBoard(_Board):
+    """
+    Game board class backed by the compiled move kernel
+
+    Has the same interface as the `_Board`, with the tiles kept in the
+    kernel array. Additionally, provides the whole board movement, and
+    the moves availability check.
+    """
+
+    def __init__(self, board_width, board_height, free_tile_value,
+            spawn_distribution = UNIFORM_SPAWN_DISTRIBUTION,
+            random_generator = random):
+        # imported here, as the kernel is loaded on the first move
+        from . import movekern
+
+        self._kernel = movekern.get_kernel()
+        self._tiles = movekern.new_tiles(board_width * board_height)
+        self._score = movekern.ctypes.c_int64()
+        self._merges = movekern.ctypes.c_int()
+
+        super().__init__(board_width, board_height, free_tile_value,
+                spawn_distribution, random_generator)
+
+    def reset_board(self):
+        """
+        Resets board to the empty state
+        """
+
+        for pos in range(len(self._tiles)):
+            self._tiles[pos] = self._free_tile_value
+
+        self._free_tiles_cnt = len(self._tiles)
+
+    def get_tile(self, row, col):
+        """
+        Returns the value of a tile on the given position
+        """
+
+        return self._tiles[row * self._board_width + col]
+
+    def set_tile(self, row, col, value):
+        """
+        Sets the value of a tile on the given position
+        """
+
+        pos = row * self._board_width + col
+
+        new_tile_empty = value == self._free_tile_value
+        old_tile_empty = self._tiles[pos] == self._free_tile_value
+
+        if new_tile_empty and not old_tile_empty:
+            self._free_tiles_cnt += 1
+        elif not new_tile_empty and old_tile_empty:
+            self._free_tiles_cnt -= 1
+
+        self._tiles[pos] = value
+
+    def generate_piece(self):
+        """
+        Generate new piece on the randomly selected free tile
+
+        Returns the row, column, and the value of the new piece.
+        """
+
+        # random values are drawn in the same order as in the `_Board`,
+        # so both boards generate the same pieces for the same seed
+        new_free_tile_index = self._random.randrange(
+                self._free_tiles_cnt)
+        new_piece_value = self._spawn_distribution.draw_value(
+                self._random)
+
+        pos = self._kernel.mk_spawn(self._tiles, len(self._tiles),
+                self._free_tile_value, new_free_tile_index,
+                new_piece_value)
+        self._free_tiles_cnt -= 1
+
+        return divmod(pos, self._board_width) + (new_piece_value,)
+
+    def get_whole_board(self):
+        """
+        Returns the whole board
+
+        The board is built from the kernel array on every call, so it is
+        the copy, as the one of the `_Board`.
+        """
+
+        bw = self._board_width
+        tiles = self._tiles[:]
+
+        return [tiles[row * bw:(row + 1) * bw]
+                for row in range(self._board_height)]
+
+    def move_pieces(self, movement_direction):
+        """
+        Piece movement, and merge, for the whole board
+
+        Returns the cumulative score of the mergings, as well as the
+        information if any piece was moved.
+        """
+
+        movement_done = self._kernel.mk_move(self._tiles,
+                self._board_width, self._board_height,
+                movement_direction.value, self._free_tile_value,
+                self._score, self._merges)
+        self._free_tiles_cnt += self._merges.value
+
+        return (self._score.value, movement_done == 1)
+
+    def get_legal_moves_mask(self):
+        """
+        Returns the mask of the directions in which any piece can move
+        """
+
+        return self._kernel.mk_legal_moves(self._tiles,
+                self._board_width, self._board_height,
+                self._free_tile_value)
+
+    def moves_available(self):
+        """
+        Check if there are any valid moves available
+        """
+
+        return self._kernel.mk_moves_available(self._tiles,
+                self._board_width, self._board_height,
+                self._free_tile_value) == 1
+
+class HeadlessController:
+    """
+    Headless input, and output controller
+
+    Does nothing, so it can be attached as both the input, and the
+    output of the game controller which is not shown, e.g. in the
+    simulations.
+    """
+
+    def update_game_state(self):
+        pass
+
+    def open_endgame_message(self):
+        pass
+
+    def close_endgame_message(self):
+        pass
+
+    def is_operational(self):
+        return True
 
 class GameController:
     """
@@ -149,18 +578,38 @@ class GameController:
 
     def __init__(self,
             board_width = 4, board_height = 4,
-            free_tile_value = 0):
+            free_tile_value = 0, use_move_kernel = True,
+            spawn_distribution = UNIFORM_SPAWN_DISTRIBUTION,
+            random_generator = random, initial_pieces = True):
         """
         Create the board in the initial state, ready to play
+
+        The compiled move kernel is used if it is loaded, and not
+        disabled with `use_move_kernel`. It is loaded on the first move,
+        so it doesn't delay the first frame. New pieces are generated
+        according to the `spawn_distribution`, with the given random
+        generator (`random.Random`, or `rng.BlockRandom` instance, or the
+        `random` module itself). Without `initial_pieces`, the board is
+        left empty, and nothing is drawn from the generator, e.g. for the
+        game state to be loaded.
         """
 
-        self._board = _Board(board_width, board_height, free_tile_value)
+        self._board = _Board(
+                board_width, board_height, free_tile_value,
+                spawn_distribution, random_generator)
+        # the board is switched to the kernel on the first move
+        self._use_move_kernel = use_move_kernel
         self._state = _GameStates.gs_suspended
 
         self._output_ctrl = None
         self._input_ctrl = None
+        self._observers = []
+        self._metrics = None
 
-        self._reset_game_state()
+        if initial_pieces:
+            self._reset_game_state()
+        else:
+            self._current_score = 0
 
     # controller info
     #
@@ -196,6 +645,175 @@ class GameController:
 
         return self._current_score
 
+    def get_spawn_outcomes(self):
+        """
+        Returns all the possible new pieces for the current board
+
+        Every outcome is given as the (row, column, value, probability)
+        tuple, and the probabilities sum up to one.
+        """
+
+        return self._board.get_spawn_outcomes()
+
+    def get_spawn_distribution(self):
+        """
+        Returns the distribution of the new piece values
+        """
+
+        return self._board.get_spawn_distribution()
+
+    def legal_moves(self):
+        """
+        Returns the set of the directions which would change the board
+
+        Board is examined in place, without trying the moves.
+        """
+
+        return _LEGAL_MOVES_SETS[self._board.get_legal_moves_mask()]
+
+    def is_suspended(self):
+        """
+        Returns true value if the game is suspended
+        """
+
+        return self._state == _GameStates.gs_suspended
+
+    def is_endgame(self):
+        """
+        Returns true value if there are no more moves available
+        """
+
+        return self._state == _GameStates.gs_endgame
+
+    def to_bytes(self):
+        """
+        Serialize the game
+
+        The game is packed to the versioned binary blob with the board
+        pieces, as base-2 logarithms, the score, the state, and the
+        state of the random generator, if it is not shared. State of the
+        seeded `rng.BlockRandom` is saved compactly, as the seed, and the
+        number of the numbers drawn. Terminated game can not be
+        serialized.
+        """
+
+        if self._state == _GameStates.gs_terminated:
+            raise ValueError("terminated game can not be serialized")
+
+        # imported here, as only the saved games need them
+        from . import rng
+        import struct
+
+        (bw, bh) = self._board.get_board_dimensions()
+        ftv = self._board.get_free_tile_value()
+        random_generator = self._board.get_random_generator()
+
+        if isinstance(random_generator, random.Random):
+            rng_kind = _SAVE_RNG_MT
+        elif isinstance(random_generator, rng.BlockRandom):
+            seed_draws = random_generator.get_seed_draws()
+            if seed_draws != None and isinstance(seed_draws[0], int) and \
+                    0 <= seed_draws[0] < 1 << 64:
+                rng_kind = _SAVE_RNG_SEEDED
+            else:
+                rng_kind = _SAVE_RNG_BLOCK
+        else:
+            rng_kind = _SAVE_RNG_SHARED
+
+        blob = bytearray(struct.pack(_SAVE_HEADER,
+                _SAVE_MAGIC, _SAVE_VERSION, bw, bh, self._state.value,
+                rng_kind, ftv, self._current_score))
+
+        blob.extend(0 if value == ftv else value.bit_length() - 1
+                for board_row in self._board.get_whole_board()
+                for value in board_row)
+
+        if rng_kind == _SAVE_RNG_MT:
+            mt_state = random_generator.getstate()
+        elif rng_kind == _SAVE_RNG_BLOCK:
+            (mt_state, block_index) = random_generator.getstate()
+
+        if rng_kind == _SAVE_RNG_SEEDED:
+            blob.extend(struct.pack(_SAVE_RNG_SEED_DRAWS, *seed_draws))
+        elif rng_kind != _SAVE_RNG_SHARED:
+            (version, internal_state, gauss_next) = mt_state
+            blob.extend(struct.pack(_SAVE_RNG_STATE,
+                    *internal_state,
+                    gauss_next != None,
+                    gauss_next if gauss_next != None else 0.0))
+
+        if rng_kind == _SAVE_RNG_BLOCK:
+            blob.extend(struct.pack(_SAVE_RNG_BLOCK_INDEX, block_index))
+
+        return bytes(blob)
+
+    @classmethod
+    def from_bytes(cls, data, **kwargs):
+        """
+        Deserialize the game
+
+        Creates the game controller from the blob made by `to_bytes`.
+        Other controller parameters can be given as keyword arguments.
+        Active game is restored as suspended, so it can be resumed once
+        the other controllers are attached, while the game in the
+        endgame stays there.
+        """
+
+        # imported here, as only the saved games need them
+        from . import rng
+        import struct
+
+        (magic, version, bw, bh, state_value, rng_kind, ftv, score) = \
+                struct.unpack_from(_SAVE_HEADER, data)
+
+        if magic != _SAVE_MAGIC or version not in _SAVE_LOADED_VERSIONS:
+            raise ValueError("unsupported game format")
+
+        offset = struct.calcsize(_SAVE_HEADER)
+        tiles = data[offset:offset + bw * bh]
+        offset += bw * bh
+
+        if rng_kind in (_SAVE_RNG_MT, _SAVE_RNG_BLOCK):
+            rng_state = struct.unpack_from(_SAVE_RNG_STATE, data, offset)
+            offset += struct.calcsize(_SAVE_RNG_STATE)
+            mt_state = (3, rng_state[:625],
+                    rng_state[626] if rng_state[625] else None)
+
+        if rng_kind == _SAVE_RNG_MT:
+            random_generator = random.Random()
+            random_generator.setstate(mt_state)
+            kwargs["random_generator"] = random_generator
+        elif rng_kind == _SAVE_RNG_BLOCK:
+            (block_index,) = struct.unpack_from(
+                    _SAVE_RNG_BLOCK_INDEX, data, offset)
+            random_generator = rng.BlockRandom()
+            random_generator.setstate((mt_state, block_index))
+            kwargs["random_generator"] = random_generator
+        elif rng_kind == _SAVE_RNG_SEEDED:
+            random_generator = rng.BlockRandom()
+            random_generator.set_seed_draws(
+                    *struct.unpack_from(_SAVE_RNG_SEED_DRAWS, data, offset))
+            kwargs["random_generator"] = random_generator
+
+        # the pieces are loaded, so nothing is drawn from the generator
+        game_ctrl = cls(bw, bh, ftv, initial_pieces = False, **kwargs)
+
+        board = [[ftv if tiles[row * bw + col] == 0 else
+                1 << tiles[row * bw + col]
+                for col in range(bw)] for row in range(bh)]
+        game_ctrl.load_game_state(board, score)
+
+        # method state-changing operation:
+        #
+        # from state    to state        condition
+        # ------------- --------------- --------------------------------
+        # gs_suspended  gs_endgame      game was saved in the endgame
+
+        if _GameStates(state_value) == _GameStates.gs_endgame:
+            game_ctrl._state = _GameStates.gs_endgame
+
+        return game_ctrl
+
     # controller actions
     #
 
@@ -213,6 +831,35 @@ class GameController:
 
         self._input_ctrl = input_ctrl
 
+    def attach_observer(self, observer):
+        """
+        Attach the game observer
+
+        Observers are notified of the game changes through the
+        `game_moved(movement_direction, spawned_piece)`, and
+        `game_reset()` methods.
+        """
+
+        self._observers.append(observer)
+
+    def detach_observer(self, observer):
+        """
+        Detach the game observer
+        """
+
+        self._observers.remove(observer)
+
+    def attach_metrics(self, metrics):
+        """
+        Attach the game metrics
+
+        Metrics record the moves, merges, new pieces, resets, and the
+        endgames, through the `metrics.GameMetrics` methods. `None`
+        detaches them.
+        """
+
+        self._metrics = metrics
+
     def reset_game(self):
         """
         Resets the game
@@ -237,8 +884,14 @@ class GameController:
 
         if perform_reset:
             self._reset_game_state()
-            self._output_ctrl.update_game_state()
-            self._output_ctrl.close_endgame_message()
+            self._notify(self._output_ctrl.update_game_state)
+            self._notify(self._output_ctrl.close_endgame_message)
+
+            if self._metrics != None:
+                self._metrics.record_reset()
+
+            for observer in self._observers:
+                self._notify(observer.game_reset)
 
         # method state-changing operation:
         #
@@ -270,73 +923,65 @@ class GameController:
         moves.
         """
 
+        self._move_pieces(movement_direction, None)
+
+    def replay_move(self, movement_direction, spawned_piece):
+        """
+        Piece movement, and merge, with the given new piece
+
+        Same as `move_pieces`, except that the new piece is not
+        generated randomly, but put as given by the (row, column, value)
+        tuple. Used to follow the moves of another game.
+        """
+
+        self._move_pieces(movement_direction, spawned_piece)
+
+    def load_game_state(self, board, score):
+        """
+        Load the pieces, and the score
+
+        Puts the given board pieces, and the score, in place of the
+        current ones. Used to restore, or to follow another game.
+        """
+
         # method state-dependent operation:
         #
         # state         operation
         # ------------- ------------------------------------------------
-        # gs_active     move, and merge pieces
+        # gs_active     loads the state
         # gs_terminated does nothing
-        # gs_endgame    does nothing
-        # gs_suspended  does nothing
+        # gs_endgame    loads the state
+        # gs_suspended  loads the state
 
-        if self._state == _GameStates.gs_active:
-            md = movement_direction
-            mds = MovementDirections
-            (bw, bh) = self._board.get_board_dimensions()
-
-            movement_done = False
-
-            transl_map = {
-                    mds.up:     lambda pr_ind, sc_ind: \
-                            (pr_ind, sc_ind),
-                    mds.down:   lambda pr_ind, sc_ind: \
-                            (bh - pr_ind - 1, sc_ind),
-                    mds.left:   lambda pr_ind, sc_ind: \
-                            (sc_ind, pr_ind),
-                    mds.right:  lambda pr_ind, sc_ind: \
-                            (sc_ind, bw - pr_ind - 1)}
-
-            iter_limit_map = {
-                    mds.up:     (bw, bh),
-                    mds.down:   (bw, bh),
-                    mds.left:   (bh, bw),
-                    mds.right:  (bh, bw)}
-
-            (outer_iter_limit, dir_line_length) = iter_limit_map[md]
-            coord_transl_f = transl_map[md]
-
-            for sc_ind in range(outer_iter_limit):
-                def getter(index):
-                    return self._board.get_tile(
-                            *coord_transl_f(index, sc_ind))
-                def setter(index, value):
-                    (row, col) = coord_transl_f(index, sc_ind)
-                    self._board.set_tile(row, col, value)
-
-                (ret_score, ret_movement_done) = \
-                        self._move_merge_pieces_dl(
-                        dir_line_length, getter, setter)
-
-                self._current_score += ret_score
-                movement_done = movement_done or ret_movement_done
+        if self._state == _GameStates.gs_terminated:
+            return
 
-            if (movement_done):
-                self._board.generate_piece()
-                self._output_ctrl.update_game_state()
+        (bw, bh) = self._board.get_board_dimensions()
+
+        for row in range(bh):
+            for col in range(bw):
+                self._board.set_tile(row, col, board[row][col])
+
+        self._current_score = score
+
+        if self._output_ctrl != None:
+            self._notify(self._output_ctrl.update_game_state)
 
         # method state-changing operation:
         #
         # from state    to state        condition
         # ------------- --------------- --------------------------------
         # gs_active     gs_endgame      no moves available
+        # gs_endgame    gs_active       moves available
 
-        go_to_endgame = \
-                self._state == _GameStates.gs_active and \
-                not self._moves_available()
-        
-        if go_to_endgame:
+        moves_available = self._moves_available()
+
+        if self._state == _GameStates.gs_active and not moves_available:
             self._state = _GameStates.gs_endgame
-            self._output_ctrl.open_endgame_message()
+            self._notify(self._output_ctrl.open_endgame_message)
+        elif self._state == _GameStates.gs_endgame and moves_available:
+            self._state = _GameStates.gs_active
+            self._notify(self._output_ctrl.close_endgame_message)
 
     def suspend_game(self):
         """
@@ -374,6 +1019,176 @@ class GameController:
     # auxiliary operations
     #
 
+    def _move_pieces(self, movement_direction, spawned_piece):
+        """
+        Piece movement, and merge, for the whole board
+
+        The new piece is put as given by `spawned_piece`, or generated
+        randomly if it is `None`.
+        """
+
+        # method state-dependent operation:
+        #
+        # state         operation
+        # ------------- ------------------------------------------------
+        # gs_active     move, and merge pieces
+        # gs_terminated does nothing
+        # gs_endgame    does nothing
+        # gs_suspended  does nothing
+
+        metrics = self._metrics
+
+        if metrics != None:
+            move_start_time = time.perf_counter()
+            free_tiles_cnt = self._board.get_free_tiles_cnt()
+            merges_cnt = 0
+
+        movement_done = False
+
+        if self._state == _GameStates.gs_active:
+            (ret_score, movement_done) = \
+                    self._move_board_pieces(movement_direction)
+
+            self._current_score += ret_score
+
+            if (movement_done):
+                if metrics != None:
+                    # every merge frees one tile
+                    merges_cnt = self._board.get_free_tiles_cnt() - \
+                            free_tiles_cnt
+
+                if spawned_piece == None:
+                    spawned_piece = self._board.generate_piece()
+                else:
+                    self._board.set_tile(*spawned_piece)
+
+                self._notify(self._output_ctrl.update_game_state)
+
+                for observer in self._observers:
+                    self._notify(observer.game_moved,
+                            movement_direction, spawned_piece)
+
+        # method state-changing operation:
+        #
+        # from state    to state        condition
+        # ------------- --------------- --------------------------------
+        # gs_active     gs_endgame      no moves available
+
+        go_to_endgame = \
+                self._state == _GameStates.gs_active and \
+                not self._moves_available()
+        
+        if go_to_endgame:
+            self._state = _GameStates.gs_endgame
+            self._notify(self._output_ctrl.open_endgame_message)
+
+            if metrics != None:
+                metrics.record_endgame()
+
+        # moves which didn't change the board, e.g. in the other states,
+        # are not recorded
+        if metrics != None and movement_done:
+            metrics.record_move(merges_cnt,
+                    time.perf_counter() - move_start_time)
+
+    def _notify(self, callback, *args):
+        """
+        Notify the output, or the observer, of the change
+
+        Callback is called right away, while `ConcurrentGameController`
+        calls it once the change is done.
+        """
+
+        callback(*args)
+
+    def _move_board_pieces(self, movement_direction):
+        """
+        Move and merge the pieces on the whole board
+
+        Uses the board kernel if there is one, loaded on the first call,
+        otherwise moves every direction line with `_move_merge_pieces_dl`.
+        Returns the cumulative score of the mergings, as well as the
+        information if any piece was moved.
+        """
+
+        if self._use_move_kernel:
+            self._load_move_kernel()
+
+        if isinstance(self._board, _KernelBoard):
+            return self._board.move_pieces(movement_direction)
+
+        md = movement_direction
+        mds = MovementDirections
+        (bw, bh) = self._board.get_board_dimensions()
+
+        score = 0
+        movement_done = False
+
+        transl_map = {
+                mds.up:     lambda pr_ind, sc_ind: \
+                        (pr_ind, sc_ind),
+                mds.down:   lambda pr_ind, sc_ind: \
+                        (bh - pr_ind - 1, sc_ind),
+                mds.left:   lambda pr_ind, sc_ind: \
+                        (sc_ind, pr_ind),
+                mds.right:  lambda pr_ind, sc_ind: \
+                        (sc_ind, bw - pr_ind - 1)}
+
+        iter_limit_map = {
+                mds.up:     (bw, bh),
+                mds.down:   (bw, bh),
+                mds.left:   (bh, bw),
+                mds.right:  (bh, bw)}
+
+        (outer_iter_limit, dir_line_length) = iter_limit_map[md]
+        coord_transl_f = transl_map[md]
+
+        for sc_ind in range(outer_iter_limit):
+            def getter(index):
+                return self._board.get_tile(
+                        *coord_transl_f(index, sc_ind))
+            def setter(index, value):
+                (row, col) = coord_transl_f(index, sc_ind)
+                self._board.set_tile(row, col, value)
+
+            (ret_score, ret_movement_done) = \
+                    self._move_merge_pieces_dl(
+                    dir_line_length, getter, setter)
+
+            score += ret_score
+            movement_done = movement_done or ret_movement_done
+
+        return (score, movement_done)
+
+    def _load_move_kernel(self):
+        """
+        Switch the board to the move kernel, if it is loaded
+
+        The kernel board gets the pieces, and the random generator of
+        the current board.
+        """
+
+        self._use_move_kernel = False
+
+        # imported here, as the kernel is loaded on the first move
+        from . import movekern
+
+        if not movekern.is_loaded():
+            return
+
+        board = self._board
+        (bw, bh) = board.get_board_dimensions()
+
+        kernel_board = _KernelBoard(bw, bh, board.get_free_tile_value(),
+                board.get_spawn_distribution(),
+                board.get_random_generator())
+
+        for (row, board_row) in enumerate(board.get_whole_board()):
+            for (col, value) in enumerate(board_row):
+                kernel_board.set_tile(row, col, value)
+
+        self._board = kernel_board
+
     def _move_merge_pieces_dl(self, dl_length, get_piece, set_piece):
         """
         Move and merge the pieces on the direction line
@@ -473,6 +1288,9 @@ class GameController:
         Check if there are any valid moves available
         """
 
+        if isinstance(self._board, _KernelBoard):
+            return self._board.moves_available()
+
         # first check - are there free tiles?
         #
 
@@ -516,3 +1334,209 @@ class GameController:
             self._board.generate_piece()
 
         self._current_score = 0
+
+class GameSnapshot:
+    """
+    Game snapshot class
+
+    Immutable, consistent state of the game at one version: the board,
+    as the tuple of the row tuples, the score, and the game state.
+    """
+
+    def __init__(self, version, board, score, state):
+        self._version = version
+        self._board = board
+        self._score = score
+        self._state = state
+
+    def get_version(self):
+        return self._version
+
+    def get_board_state(self):
+        return self._board
+
+    def get_current_score(self):
+        return self._score
+
+    def is_active(self):
+        return self._state != _GameStates.gs_terminated
+
+    def is_suspended(self):
+        return self._state == _GameStates.gs_suspended
+
+    def is_endgame(self):
+        return self._state == _GameStates.gs_endgame
+
+    def is_same_game(self, other):
+        """
+        Returns true value if the other snapshot has the same board, the
+        score, and the state, regardless of the version
+        """
+
+        return self._board == other._board and \
+                self._score == other._score and \
+                self._state == other._state
+
+class ConcurrentGameController(GameController):
+    """
+    Thread-safe game controller class
+
+    Same as the `GameController`, except that the game can be used from
+    many threads. Every game has its own lock, which serializes the
+    changes, so the games don't wait for each other.
+
+    Readers get the `GameSnapshot`, which is made once per version, and
+    shared by all the readers until the next change, so the reads don't
+    copy the board, nor wait for the lock, unless the game is being
+    changed. Board state is returned from the snapshot, as the tuples.
+    Version is advanced only by the changes of the board, the score, or
+    the state.
+
+    Outputs, and observers, are notified after the change, without the
+    lock, and read the snapshot published by it, or a newer one. Metrics
+    are called with the lock held.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # imported here, as only the shared games need it
+        import threading
+
+        # recursive, as the callbacks called with the lock held, e.g.
+        # `is_operational` of the outputs, can read the game
+        self._lock = threading.RLock()
+        self._version = 0
+        self._snapshot = None
+        # (callback, arguments) of the change being done, `None` between
+        # the changes
+        self._notifications = None
+
+        super().__init__(*args, **kwargs)
+
+    def _notify(self, callback, *args):
+        if self._notifications != None:
+            self._notifications.append((callback, args))
+        else:
+            callback(*args)
+
+    def _change(self, method, *args):
+        """
+        Call the changing method with the lock held, and notify of the
+        change after it
+
+        Snapshot is dropped before the change, so the other readers wait
+        for it to finish, and the one of the changed game is published
+        before the lock is released.
+        """
+
+        with self._lock:
+            if self._notifications != None:
+                # change made by the callback is the part of the outer one
+                return method(self, *args)
+
+            old_snapshot = self._get_locked_snapshot()
+            self._snapshot = None
+            self._notifications = []
+
+            try:
+                result = method(self, *args)
+            finally:
+                (notifications, self._notifications) = \
+                        (self._notifications, None)
+
+                snapshot = self._make_snapshot(self._version + 1)
+                if snapshot.is_same_game(old_snapshot):
+                    self._snapshot = old_snapshot
+                else:
+                    self._version += 1
+                    self._snapshot = snapshot
+
+        for (callback, args) in notifications:
+            callback(*args)
+
+        return result
+
+    def _make_snapshot(self, version):
+        return GameSnapshot(version,
+                tuple(tuple(board_row) for board_row in
+                self._board.get_whole_board()),
+                self._current_score, self._state)
+
+    def _get_locked_snapshot(self):
+        # the lock has to be held; snapshots made during the change are
+        # not published
+        snapshot = self._snapshot
+
+        if snapshot == None:
+            snapshot = self._make_snapshot(self._version)
+            if self._notifications == None:
+                self._snapshot = snapshot
+
+        return snapshot
+
+    def get_snapshot(self):
+        """
+        Returns the `GameSnapshot` of the current version
+        """
+
+        snapshot = self._snapshot
+
+        if snapshot == None:
+            with self._lock:
+                snapshot = self._get_locked_snapshot()
+
+        return snapshot
+
+    # controller info
+    #
+
+    def is_active(self):
+        return self.get_snapshot().is_active()
+
+    def get_board_state(self):
+        return self.get_snapshot().get_board_state()
+
+    def get_current_score(self):
+        return self.get_snapshot().get_current_score()
+
+    def is_suspended(self):
+        return self.get_snapshot().is_suspended()
+
+    def is_endgame(self):
+        return self.get_snapshot().is_endgame()
+
+    def get_spawn_outcomes(self):
+        with self._lock:
+            return super().get_spawn_outcomes()
+
+    def legal_moves(self):
+        with self._lock:
+            return super().legal_moves()
+
+    def to_bytes(self):
+        with self._lock:
+            return super().to_bytes()
+
+    # controller actions
+    #
+
+    def reset_game(self):
+        self._change(GameController.reset_game)
+
+    def close_game(self):
+        self._change(GameController.close_game)
+
+    def move_pieces(self, movement_direction):
+        self._change(GameController.move_pieces, movement_direction)
+
+    def replay_move(self, movement_direction, spawned_piece):
+        self._change(GameController.replay_move, movement_direction,
+                spawned_piece)
+
+    def load_game_state(self, board, score):
+        self._change(GameController.load_game_state, board, score)
+
+    def suspend_game(self):
+        self._change(GameController.suspend_game)
+
+    def resume_game(self):
+        self._change(GameController.resume_game)
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""
+Metrics module
+
+Has the `MetricsRegistry` class, with the counters, and the latency
+histograms, the `GameMetrics`, and `CursesMetrics` classes, which are
+attached to the game controller, and to the curses components, and the
+`MetricsServer` class, which exposes the registry in the Prometheus text
+format, over the local HTTP, or the Unix socket.
+
+Recording takes no locks: every thread counts in its own cells, which
+are summed up only when the metrics are read.
+"""
+
+import bisect
+import collections
+import os
+import threading
+import weakref
+
+# latency histogram bounds, in seconds
+DEFAULT_LATENCY_BUCKETS = (
+        0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+        0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+class _ThreadCells:
+    """
+    Per-thread cells
+
+    Every thread gets its own cell, so the recording needs no locks.
+    The lock is taken only when the thread creates its cell, and when
+    the cells are read. Cells of the ended threads are added to the base
+    cell, so the short-lived threads don't leave their cells behind.
+    """
+
+    def __init__(self, cell_size):
+        self._cell_size = cell_size
+        self._local = threading.local()
+        # cells of the running threads, by the id, and the sum of the
+        # cells of the ended ones
+        self._cells = {}
+        self._base_cell = [0] * cell_size
+        # cells of the ended threads, not yet added to the base cell;
+        # appended by the thread finalizers, which can run in any
+        # thread, even with the lock taken, so they don't take it
+        self._ended_cells = collections.deque()
+        self._lock = threading.Lock()
+
+    def get_cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = [0] * self._cell_size
+            with self._lock:
+                self._fold_ended_cells()
+                self._cells[id(cell)] = cell
+            self._local.cell = cell
+            # thread object is released when the thread has ended, so
+            # the cell is no longer changed
+            weakref.finalize(threading.current_thread(),
+                    self._ended_cells.append, cell)
+            return cell
+
+    def _fold_ended_cells(self):
+        # called with the lock taken
+        while self._ended_cells:
+            cell = self._ended_cells.popleft()
+            del self._cells[id(cell)]
+            for (index, value) in enumerate(cell):
+                self._base_cell[index] += value
+
+    def get_totals(self):
+        """
+        Returns the sum of all the cells
+        """
+
+        with self._lock:
+            self._fold_ended_cells()
+            cells = [list(self._base_cell)] + list(self._cells.values())
+
+        return [sum(values) for values in zip(*cells)]
+
+class Counter:
+    """
+    Counter metric
+    """
+
+    def __init__(self, name, help_text):
+        self._name = name
+        self._help_text = help_text
+        self._cells = _ThreadCells(1)
+
+    def inc(self, amount = 1):
+        self._cells.get_cell()[0] += amount
+
+    def get_cell(self):
+        """
+        Returns the cell of the current thread
+
+        Cell's only item is incremented to count, without looking up the
+        cell every time.
+        """
+
+        return self._cells.get_cell()
+
+    def get_value(self):
+        return self._cells.get_totals()[0]
+
+    def render(self):
+        return "# HELP {0} {1}\n# TYPE {0} counter\n{0} {2}\n".format(
+                self._name, self._help_text, self.get_value())
+
+class Histogram:
+    """
+    Histogram metric
+
+    Counts the observed values in the buckets with the given upper
+    bounds, and the overflow bucket, and keeps their sum.
+    """
+
+    def __init__(self, name, help_text, bounds = DEFAULT_LATENCY_BUCKETS):
+        self._name = name
+        self._help_text = help_text
+        self._bounds = tuple(bounds)
+        # bucket counts, then the sum
+        self._cells = _ThreadCells(len(self._bounds) + 2)
+
+    def observe(self, value):
+        self.observe_in_cell(self._cells.get_cell(), value)
+
+    def get_cell(self):
+        """
+        Returns the cell of the current thread, for `observe_in_cell`
+        """
+
+        return self._cells.get_cell()
+
+    def observe_in_cell(self, cell, value):
+        cell[bisect.bisect_left(self._bounds, value)] += 1
+        cell[-1] += value
+
+    def get_counts(self):
+        """
+        Returns the non-cumulative bucket counts, the last one for the
+        values over all the bounds
+        """
+
+        return self._cells.get_totals()[:-1]
+
+    def get_sum(self):
+        return self._cells.get_totals()[-1]
+
+    def render(self):
+        totals = self._cells.get_totals()
+        lines = ["# HELP {} {}".format(self._name, self._help_text),
+                "# TYPE {} histogram".format(self._name)]
+
+        cumulative_count = 0
+        for (bound, count) in zip(self._bounds + ("+Inf",), totals[:-1]):
+            cumulative_count += count
+            lines.append("{}_bucket{{le=\"{}\"}} {}".format(
+                    self._name, bound, cumulative_count))
+
+        lines.append("{}_sum {}".format(self._name, totals[-1]))
+        lines.append("{}_count {}".format(self._name, cumulative_count))
+
+        return "\n".join(lines) + "\n"
+
+class MetricsRegistry:
+    """
+    Metrics registry class
+
+    Holds the metrics by the name, and renders them all.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        """
+        Returns the counter with the name, created if needed
+        """
+
+        return self._get_metric(Counter, name, help_text)
+
+    def histogram(self, name, help_text,
+            bounds = DEFAULT_LATENCY_BUCKETS):
+        """
+        Returns the histogram with the name, created if needed
+        """
+
+        return self._get_metric(Histogram, name, help_text, bounds)
+
+    def render(self):
+        """
+        Returns all the metrics, in the Prometheus text format
+        """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return "".join(metric.render() for metric in metrics)
+
+    def _get_metric(self, metric_class, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+
+            if metric == None:
+                metric = metric_class(name, *args)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(
+                        "metric {!r} has the other type".format(name))
+
+        return metric
+
+class GameMetrics:
+    """
+    Game metrics class
+
+    Records the game controller events, when attached to it with
+    `GameController.attach_metrics`.
+    """
+
+    def __init__(self, registry):
+        self._moves = registry.counter("game_moves_total",
+                "Moves which changed the board.")
+        self._merges = registry.counter("game_merges_total",
+                "Merged piece pairs.")
+        self._spawns = registry.counter("game_spawns_total",
+                "New pieces put on the board.")
+        self._resets = registry.counter("game_resets_total",
+                "Game resets.")
+        self._endgames = registry.counter("game_endgames_total",
+                "Games ended with no moves available.")
+        self._move_seconds = registry.histogram("game_move_seconds",
+                "Handling time of the moves which changed the board, "
+                "including the output update.")
+
+        # cells of the current thread, looked up once per move
+        self._local = threading.local()
+
+    def _get_cells(self):
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = (self._moves.get_cell(), self._merges.get_cell(),
+                    self._spawns.get_cell(), self._move_seconds.get_cell())
+            self._local.cells = cells
+            return cells
+
+    def record_move(self, merges_cnt, seconds):
+        """
+        Record the handling of the move which changed the board, and put
+        the new piece
+
+        Inputs are: the number of the merges, and the handling time.
+        """
+
+        (moves_cell, merges_cell, spawns_cell, seconds_cell) = \
+                self._get_cells()
+
+        moves_cell[0] += 1
+        spawns_cell[0] += 1
+        merges_cell[0] += merges_cnt
+
+        self._move_seconds.observe_in_cell(seconds_cell, seconds)
+
+    def record_reset(self):
+        # new game starts with two pieces
+        self._resets.inc()
+        self._spawns.inc(2)
+
+    def record_endgame(self):
+        self._endgames.inc()
+
+class CursesMetrics:
+    """
+    Curses metrics class
+
+    Records the output redraws, and the input resize events, when
+    attached to the curses components with `attach_metrics`.
+    """
+
+    def __init__(self, registry):
+        self._redraws = registry.counter("curses_redraws_total",
+                "Full screen redraws.")
+        self._redraw_seconds = registry.histogram("curses_redraw_seconds",
+                "Full screen redraw time.")
+        self._resizes = registry.counter("curses_resize_events_total",
+                "Terminal resize events.")
+
+    def record_redraw(self, seconds):
+        self._redraws.inc()
+        self._redraw_seconds.observe(seconds)
+
+    def record_resize(self):
+        self._resizes.inc()
+
+class MetricsServer:
+    """
+    Metrics server class
+
+    Serves the registry in the Prometheus text format, to every HTTP GET
+    request, from the background thread. Address is the (host, port)
+    pair for the TCP, or the path for the Unix socket.
+    """
+
+    def __init__(self, registry, address):
+        # imported here, so the metrics can be recorded without serving
+        import http.server
+        import socketserver
+
+        class RequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode()
+
+                self.send_response(200)
+                self.send_header("Content-Type",
+                        "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # the game owns the terminal
+                pass
+
+        if isinstance(address, str):
+            class Server(socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer):
+                daemon_threads = True
+
+            # socket left by the server which wasn't closed
+            if os.path.exists(address):
+                os.unlink(address)
+
+            self._socket_path = address
+        else:
+            class Server(http.server.ThreadingHTTPServer):
+                daemon_threads = True
+
+            self._socket_path = None
+
+        self._server = Server(address, RequestHandler)
+        self._thread = threading.Thread(target = self._server.serve_forever,
+                name = "metrics server", daemon = True)
+        self._thread.start()
+
+    def get_address(self):
+        return self._server.server_address
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+        if self._socket_path != None:
+            os.unlink(self._socket_path)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Move kernel module
+
+Loads the optional compiled move kernel (`_movekern.c`) through
+`ctypes`. When the kernel is not compiled, `is_loaded` returns a false
+value, and the game controller falls back to the pure-Python board,
+and the AI search to the pure-Python board evaluation.
+
+Running the module as a script builds the kernel (`build`), or checks
+its parity with the pure-Python game logic (`check`).
+"""
+
+import ctypes
+import os
+import random
+import sys
+
+_KERNEL_DIR = os.path.dirname(os.path.abspath(__file__))
+_KERNEL_SOURCE = os.path.join(_KERNEL_DIR, "_movekern.c")
+_KERNEL_LIBRARY = os.path.join(_KERNEL_DIR, "_movekern.so")
+
+# environment variable which disables the kernel loading when set
+_DISABLE_ENV_VAR = "GAME2048_NO_MOVE_KERNEL"
+
+def _load_kernel():
+    """
+    Load the compiled kernel, and declare its function prototypes
+
+    Returns `None` if the kernel is not available.
+    """
+
+    if os.environ.get(_DISABLE_ENV_VAR):
+        return None
+
+    try:
+        lib = ctypes.CDLL(_KERNEL_LIBRARY)
+    except OSError:
+        return None
+
+    # kernel built from the older source is not used
+    if not hasattr(lib, "mk_evaluate"):
+        return None
+
+    tiles_p = ctypes.POINTER(ctypes.c_int32)
+    c_int = ctypes.c_int
+    c_int32 = ctypes.c_int32
+
+    lib.mk_move.argtypes = (
+            tiles_p, c_int, c_int, c_int, c_int32,
+            ctypes.POINTER(ctypes.c_int64), ctypes.POINTER(c_int))
+    lib.mk_move.restype = c_int
+    lib.mk_spawn.argtypes = (tiles_p, c_int, c_int32, c_int, c_int32)
+    lib.mk_spawn.restype = c_int
+    lib.mk_free_tiles.argtypes = (tiles_p, c_int, c_int32)
+    lib.mk_free_tiles.restype = c_int
+    lib.mk_moves_available.argtypes = (tiles_p, c_int, c_int, c_int32)
+    lib.mk_moves_available.restype = c_int
+    lib.mk_legal_moves.argtypes = (tiles_p, c_int, c_int, c_int32)
+    lib.mk_legal_moves.restype = c_int
+    lib.mk_evaluate.argtypes = (
+            ctypes.c_uint64, ctypes.POINTER(ctypes.c_double))
+    lib.mk_evaluate.restype = ctypes.c_double
+
+    return lib
+
+# the kernel is loaded on the first use, so importing this module stays
+# cheap
+_kernel = None
+_kernel_load_attempted = False
+
+def get_kernel():
+    """
+    Returns the loaded kernel library, or `None`
+    """
+
+    global _kernel
+    global _kernel_load_attempted
+
+    if not _kernel_load_attempted:
+        _kernel = _load_kernel()
+        _kernel_load_attempted = True
+
+    return _kernel
+
+def is_loaded():
+    """
+    Returns true value if the compiled kernel is loaded
+    """
+
+    return get_kernel() != None
+
+def new_tiles(tiles_cnt):
+    """
+    Returns a new, zeroed, tiles array usable by the kernel
+    """
+
+    return (ctypes.c_int32 * tiles_cnt)()
+
+def new_heuristic_table(values):
+    """
+    Returns the row heuristic table usable by the kernel evaluation
+    """
+
+    return (ctypes.c_double * len(values))(*values)
+
+def build(compiler = None):
+    """
+    Compile the kernel from the source next to this module
+
+    Returns the compiler exit status.
+    """
+
+    # imported here, as it is needed only for building
+    import subprocess
+
+    if compiler == None:
+        compiler = os.environ.get("CC", "cc")
+
+    return subprocess.call([
+            compiler, "-O2", "-std=c99", "-shared", "-fPIC",
+            "-o", _KERNEL_LIBRARY, _KERNEL_SOURCE])
+
+def check_parity(boards_cnt = 10000, seed = 2048):
+    """
+    Check the kernel against the pure-Python game logic
+
+    Random boards are moved in all the directions by both the
+    `GameController._move_merge_pieces_dl` path, and the kernel, and
+    the resulting boards, scores, and movement flags are compared, as
+    well as the endgame checks, legal moves, and piece generation.
+    Evaluation of the random 4x4 boards by the AI searcher is compared
+    too.
+    Returns the list of mismatch descriptions, empty if the
+    implementations agree.
+    """
+
+    # imported here to avoid the circular import
+    from . import ai
+    from . import gamectrl
+
+    if not is_loaded():
+        return ["move kernel is not loaded"]
+
+    rng = random.Random(seed)
+    mismatches = []
+
+    # piece generation uses the module-level generator
+    saved_random_state = random.getstate()
+
+    for board_index in range(boards_cnt):
+        (bw, bh) = rng.choice(((4, 4), (4, 4), (3, 3), (2, 2), (5, 3)))
+        values = [0] * 4 + [2 ** exp for exp in range(1, 12)]
+        board = [[rng.choice(values) for col in range(bw)]
+                for row in range(bh)]
+
+        for md in gamectrl.MovementDirections:
+            py_gc = gamectrl.GameController(bw, bh,
+                    use_move_kernel = False)
+            kern_gc = gamectrl.GameController(bw, bh)
+
+            for gc in (py_gc, kern_gc):
+                gc._board.reset_board()
+                for row in range(bh):
+                    for col in range(bw):
+                        gc._board.set_tile(row, col, board[row][col])
+
+            py_result = py_gc._move_board_pieces(md)
+            kern_result = kern_gc._move_board_pieces(md)
+
+            py_state = (py_result,
+                    py_gc.get_board_state(),
+                    py_gc._board.get_free_tiles_cnt(),
+                    py_gc._moves_available(),
+                    py_gc.legal_moves())
+            kern_state = (kern_result,
+                    kern_gc.get_board_state(),
+                    kern_gc._board.get_free_tiles_cnt(),
+                    kern_gc._moves_available(),
+                    kern_gc.legal_moves())
+
+            if py_state != kern_state:
+                mismatches.append("board {} {}: {} != {}".format(
+                        board_index, md.name, py_state, kern_state))
+                continue
+
+            if py_gc._board.get_free_tiles_cnt() > 0:
+                spawn_seed = rng.getrandbits(32)
+                for gc in (py_gc, kern_gc):
+                    random.seed(spawn_seed)
+                    gc._board.generate_piece()
+
+                if py_gc.get_board_state() != kern_gc.get_board_state():
+                    mismatches.append("board {} {} spawn".format(
+                            board_index, md.name))
+
+    random.setstate(saved_random_state)
+
+    py_searcher = ai._Searcher(None, (), use_move_kernel = False)
+    kern_searcher = ai._Searcher(None, ())
+
+    for board_index in range(boards_cnt):
+        # ranks up to 15, and the free tiles
+        bits = 0
+        for shift in range(0, 64, 4):
+            bits |= rng.choice((0, 0, rng.randint(1, 15))) << shift
+
+        py_value = py_searcher._heuristic(bits)
+        kern_value = kern_searcher._heuristic(bits)
+
+        if py_value != kern_value:
+            mismatches.append("board {:016x} evaluation: {!r} != {!r}"
+                    .format(bits, py_value, kern_value))
+
+    return mismatches
+
+def _main(args):
+    command = args[0] if args else "check"
+
+    if command == "build":
+        return build()
+    elif command == "check":
+        mismatches = check_parity()
+        for mismatch in mismatches:
+            print(mismatch)
+        print("parity {}".format("failed" if mismatches else "ok"))
+        return 1 if mismatches else 0
+    else:
+        print("usage: python3 -m components.movekern [build|check]")
+        return 2
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
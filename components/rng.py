@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""
+Random generator module
+
+Has the `BlockRandom` class, the fast random generator for the game
+boards, and `derive_seed`, which gives every game of the simulation its
+own seed, derived from the master seed, and the game index, so the
+results don't depend on how the games are split between the processes.
+"""
+
+import bisect
+import itertools
+import random
+import struct
+
+_MASK_64 = 0xffffffffffffffff
+
+def _splitmix64(value):
+    value = (value + 0x9e3779b97f4a7c15) & _MASK_64
+    value = ((value ^ (value >> 30)) * 0xbf58476d1ce4e5b9) & _MASK_64
+    value = ((value ^ (value >> 27)) * 0x94d049bb133111eb) & _MASK_64
+    return value ^ (value >> 31)
+
+def derive_seed(master_seed, game_index, stream = 0):
+    """
+    Returns the 64-bit seed of the game
+
+    Seeds are mixed with the SplitMix64 finalizer, so the close game
+    indices, and the streams (e.g. the board, and the policy of one
+    game) get unrelated seeds.
+    """
+
+    return _splitmix64(_splitmix64(
+            _splitmix64(master_seed & _MASK_64) ^ game_index) ^ stream)
+
+class BlockRandom:
+    """
+    Block random generator class
+
+    Draws the 32-bit numbers from its own Mersenne Twister in blocks, with
+    one call, and serves the `random.Random` methods used by the boards
+    (`randrange`, `randint`, `random`, `choice`, `choices`, and
+    `getrandbits`) from the block. `randrange`, and `random`, used for
+    every new piece, take the numbers from the block directly.
+    Sequence depends only on the seed, and the state can be saved, and
+    restored, either as the whole state, or compactly, as the seed, and
+    the number of the numbers drawn.
+    """
+
+    _BLOCK_SIZE = 1024
+    _BLOCK_STRUCT = struct.Struct("<{}I".format(_BLOCK_SIZE))
+
+    def __init__(self, seed = None):
+        self._source = random.Random()
+        self.seed(seed)
+
+    def seed(self, seed = None):
+        """
+        Seed the generator
+
+        Without the seed, the 64-bit seed is taken from the system
+        randomness source, so the sequence can still be restored from it.
+        """
+
+        if seed == None:
+            seed = random.SystemRandom().getrandbits(64)
+
+        self._source.seed(seed)
+        # seed of the sequence, `None` once the state is set otherwise
+        self._seed = seed
+        self._blocks_cnt = 0
+
+        # state of the source before the current block was drawn
+        self._block_source_state = None
+        self._block = None
+        self._index = BlockRandom._BLOCK_SIZE
+
+    def _refill(self):
+        self._blocks_cnt += 1
+        self._block_source_state = self._source.getstate()
+        self._block = BlockRandom._BLOCK_STRUCT.unpack(
+                self._source.getrandbits(32 * BlockRandom._BLOCK_SIZE)
+                .to_bytes(4 * BlockRandom._BLOCK_SIZE, "little"))
+        self._index = 0
+
+    def _next_word(self):
+        index = self._index
+
+        if index == BlockRandom._BLOCK_SIZE:
+            self._refill()
+            index = 0
+
+        self._index = index + 1
+        return self._block[index]
+
+    def randint(self, a, b):
+        """
+        Returns the random integer in the range [a, b]
+
+        Range is mapped with the multiplication, so the bias is below
+        (b - a + 1) / 2 ** 32.
+        """
+
+        range_size = b - a + 1
+
+        if range_size > 1 << 32:
+            raise ValueError("range too large")
+
+        return a + ((self._next_word() * range_size) >> 32)
+
+    def randrange(self, start, stop = None):
+        """
+        Returns the random integer in the range [start, stop)
+
+        Same mapping as `randint`, without the step. The range from 0,
+        drawn for every new piece, is the fast path.
+        """
+
+        if stop != None:
+            return start + self.randrange(stop - start)
+
+        if start <= 0 or start > 1 << 32:
+            raise ValueError("empty, or too large range")
+
+        index = self._index
+        if index == BlockRandom._BLOCK_SIZE:
+            self._refill()
+            index = 0
+        self._index = index + 1
+
+        return (self._block[index] * start) >> 32
+
+    def choice(self, seq):
+        return seq[(self._next_word() * len(seq)) >> 32]
+
+    def random(self):
+        """
+        Returns the random float in the range [0, 1), with 53 bits
+        """
+
+        index = self._index
+
+        if index < BlockRandom._BLOCK_SIZE - 1:
+            self._index = index + 2
+            block = self._block
+            return ((block[index] >> 5) * 67108864.0 +
+                    (block[index + 1] >> 6)) * (1.0 / 9007199254740992.0)
+
+        # the two numbers can come from the two blocks
+        high = self._next_word() >> 5
+        low = self._next_word() >> 6
+        return (high * 67108864.0 + low) * (1.0 / 9007199254740992.0)
+
+    def getrandbits(self, k):
+        value = 0
+
+        for word_index in range((k + 31) // 32):
+            value = (value << 32) | self._next_word()
+
+        return value >> (-k % 32)
+
+    def choices(self, population, weights = None, *, cum_weights = None,
+            k = 1):
+        """
+        Returns the list of `k` elements chosen from the population
+
+        Same as `random.Random.choices`, but the element is picked with
+        the 32-bit number.
+        """
+
+        if cum_weights == None:
+            if weights == None:
+                return [self.choice(population) for i in range(k)]
+            cum_weights = list(itertools.accumulate(weights))
+
+        # one word per element is enough to pick between the weights
+        scale = cum_weights[-1] / 4294967296.0
+        last_index = len(population) - 1
+        next_word = self._next_word
+
+        return [population[bisect.bisect(cum_weights,
+                next_word() * scale, 0, last_index)]
+                for i in range(k)]
+
+    def getstate(self):
+        """
+        Returns the state, as the (source state, block index) pair
+
+        Source state is the one before the current block was drawn, so
+        the block is drawn again on `setstate`.
+        """
+
+        if self._index == BlockRandom._BLOCK_SIZE:
+            # no numbers left in the block
+            return (self._source.getstate(), BlockRandom._BLOCK_SIZE)
+
+        return (self._block_source_state, self._index)
+
+    def setstate(self, state):
+        (source_state, index) = state
+
+        self._source.setstate(source_state)
+        self._seed = None
+
+        if index < BlockRandom._BLOCK_SIZE:
+            self._refill()
+            self._index = index
+        else:
+            self._block_source_state = None
+            self._block = None
+            self._index = BlockRandom._BLOCK_SIZE
+
+    def get_seed_draws(self):
+        """
+        Returns the state as the (seed, numbers drawn) pair, or `None` if
+        the seed is not known, i.e. the state was set by `setstate`
+        """
+
+        if self._seed == None:
+            return None
+
+        draws_cnt = (self._blocks_cnt - 1) * BlockRandom._BLOCK_SIZE + \
+                self._index if self._blocks_cnt > 0 else 0
+
+        return (self._seed, draws_cnt)
+
+    def set_seed_draws(self, seed, draws_cnt):
+        """
+        Set the state saved by `get_seed_draws`
+
+        The numbers drawn are skipped a block at a time.
+        """
+
+        self.seed(seed)
+
+        (blocks_cnt, index) = divmod(draws_cnt, BlockRandom._BLOCK_SIZE)
+        if index == 0 and blocks_cnt > 0:
+            # the last block is used up
+            (blocks_cnt, index) = (blocks_cnt - 1, BlockRandom._BLOCK_SIZE)
+
+        if draws_cnt > 0:
+            for block_index in range(blocks_cnt + 1):
+                self._refill()
+            self._index = index
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+"""
+Game session module
+
+Has the `SessionManager` class, which holds many game controllers in
+the named save slots, and the slot stores it keeps them in:
+`DirectoryStore`, and `SQLiteStore`.
+"""
+
+from . import gamectrl
+from . import rng
+
+import os
+import re
+import sqlite3
+import tempfile
+
+# slot names are used as the file names, so they are kept simple
+_SLOT_NAME_RE = re.compile(r"[A-Za-z0-9_.-]+\Z")
+
+def _check_slot_name(slot):
+    if not _SLOT_NAME_RE.match(slot) or slot.startswith("."):
+        raise ValueError("invalid slot name {!r}".format(slot))
+
+class DirectoryStore:
+    """
+    Slot store in the local directory
+
+    Every slot is kept in its own file. Files are replaced atomically,
+    so the slot holds either the old, or the new game, even if saving
+    is interrupted.
+    """
+
+    _SLOT_FILE_SUFFIX = ".2048"
+
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, exist_ok = True)
+
+    def _slot_path(self, slot):
+        _check_slot_name(slot)
+        return os.path.join(
+                self._path, slot + DirectoryStore._SLOT_FILE_SUFFIX)
+
+    def save(self, slot, data):
+        (fd, temp_path) = tempfile.mkstemp(dir = self._path)
+        try:
+            with os.fdopen(fd, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, self._slot_path(slot))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def load(self, slot):
+        try:
+            with open(self._slot_path(slot), "rb") as slot_file:
+                return slot_file.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, slot):
+        try:
+            os.unlink(self._slot_path(slot))
+        except FileNotFoundError:
+            pass
+
+    def list_slots(self):
+        suffix = DirectoryStore._SLOT_FILE_SUFFIX
+        return sorted(file_name[:-len(suffix)]
+                for file_name in os.listdir(self._path)
+                if file_name.endswith(suffix))
+
+    def close(self):
+        pass
+
+class SQLiteStore:
+    """
+    Slot store in the SQLite database file
+
+    Every slot is one row, written in its own transaction.
+    """
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path)
+        # write-ahead log keeps the per-slot transactions cheap
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                "name TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self._connection.commit()
+
+    def save(self, slot, data):
+        with self._connection:
+            self._connection.execute(
+                    "INSERT OR REPLACE INTO slots VALUES (?, ?)",
+                    (slot, data))
+
+    def load(self, slot):
+        row = self._connection.execute(
+                "SELECT data FROM slots WHERE name = ?",
+                (slot,)).fetchone()
+        return row[0] if row != None else None
+
+    def delete(self, slot):
+        with self._connection:
+            self._connection.execute(
+                    "DELETE FROM slots WHERE name = ?", (slot,))
+
+    def list_slots(self):
+        return [row[0] for row in self._connection.execute(
+                "SELECT name FROM slots ORDER BY name")]
+
+    def close(self):
+        self._connection.close()
+
+class SessionManager:
+    """
+    Session manager class
+
+    Holds the game controllers in the named slots, for example one per
+    user, or per terminal. Games are loaded from the store lazily, on
+    the first access to their slot, so the store can keep many more
+    games than are in use.
+    """
+
+    def __init__(self, store, **game_kwargs):
+        """
+        Initialization method
+
+        Inputs are: slot store, and the keyword arguments for the game
+        controllers, created, or loaded, by the manager.
+        """
+
+        self._store = store
+        self._game_kwargs = game_kwargs
+        self._games = {}
+
+    def new_game(self, slot):
+        """
+        Create the new game in the slot
+
+        Game replaces the one held in the slot, but the store is
+        changed only when the game is saved. Unless the generator is
+        given in the game keyword arguments, every game gets its own,
+        seeded one, saved with the game, so the restored game puts the
+        same new pieces.
+        """
+
+        game_kwargs = dict(self._game_kwargs)
+        if "random_generator" not in game_kwargs:
+            game_kwargs["random_generator"] = rng.BlockRandom()
+
+        game_ctrl = gamectrl.GameController(**game_kwargs)
+        self._games[slot] = game_ctrl
+
+        return game_ctrl
+
+    def get_game(self, slot):
+        """
+        Returns the game in the slot
+
+        Game is loaded from the store if it is not held already.
+        Returns `None` if there is no game in the slot.
+        """
+
+        game_ctrl = self._games.get(slot)
+
+        if game_ctrl == None:
+            data = self._store.load(slot)
+
+            if data != None:
+                game_ctrl = gamectrl.GameController.from_bytes(
+                        data, **self._game_kwargs)
+                self._games[slot] = game_ctrl
+
+        return game_ctrl
+
+    def save_game(self, slot):
+        """
+        Save the game held in the slot to the store
+        """
+
+        self._store.save(slot, self._games[slot].to_bytes())
+
+    def save_all(self):
+        """
+        Save all the held games, except the terminated ones
+        """
+
+        for (slot, game_ctrl) in self._games.items():
+            if game_ctrl.is_active():
+                self._store.save(slot, game_ctrl.to_bytes())
+
+    def release_game(self, slot):
+        """
+        Stop holding the game in the slot, without saving it
+        """
+
+        self._games.pop(slot, None)
+
+    def delete_game(self, slot):
+        """
+        Remove the game from the slot, and from the store
+        """
+
+        self._games.pop(slot, None)
+        self._store.delete(slot)
+
+    def list_slots(self):
+        """
+        Returns the names of the slots in the store, or held
+        """
+
+        return sorted(set(self._store.list_slots()) | set(self._games))
+
+    def close(self):
+        """
+        Save all the held games, and close the store
+        """
+
+        self.save_all()
+        self._store.close()
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+
+"""
+Exhaustive solver module
+
+Has the `ExhaustiveSolver` class, which computes the exact value of the
+small board positions under the perfect play: the expected score, or
+the probability of reaching the target piece. Values are memoized in
+the memory-mapped file, so the long runs can be resumed, and the
+solver gives the perfect-play reference policy for validating the AI.
+
+Running the module as a script solves the starting positions of the
+given board size.
+"""
+
+from . import gamectrl
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+# memo file header: magic, version, board width, board height, largest
+# exponent, objective, spawn outcomes count, followed by the (exponent,
+# probability) pairs of the spawn outcomes
+_MEMO_MAGIC = b"2MEM"
+_MEMO_VERSION = 1
+_MEMO_HEADER = struct.Struct(">4sBBBBBB")
+_MEMO_SPAWN_OUTCOME = struct.Struct(">Bd")
+# values start at the fixed offset, aligned for the doubles
+_MEMO_VALUES_OFFSET = 256
+
+_OBJECTIVE_SCORE = 0
+_OBJECTIVE_TARGET = 1
+
+# memo of more states is rejected: 2 ** 40 doubles are the 8 TiB sparse
+# file, near the largest file size of the common file systems
+_MAX_MEMO_STATES_CNT = 1 << 40
+
+def _move_line_start(line):
+    """
+    Move and merge the line of the exponents towards its start
+
+    Same rules as `GameController._move_merge_pieces_dl`: every piece
+    merges at most once, the ones closer to the start first, and every
+    merge scores the value of the merging pieces. Returns the moved
+    line, and the merge score.
+    """
+
+    pieces = [exponent for exponent in line if exponent != 0]
+    moved = []
+    score = 0
+
+    index = 0
+    while index < len(pieces):
+        if index + 1 < len(pieces) and pieces[index] == pieces[index + 1]:
+            moved.append(pieces[index] + 1)
+            score += 1 << pieces[index]
+            index += 2
+        else:
+            moved.append(pieces[index])
+            index += 1
+
+    return (tuple(moved) + (0,) * (len(line) - len(moved)), score)
+
+class _LineMoves:
+    """
+    Line moves
+
+    Moves of the single rows, and columns, as the lines of the
+    exponents. Results are cached per line.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def move(self, line, movement_direction):
+        """
+        Returns the moved line of the exponents, and the merge score
+
+        Rows are moved left, or right, and columns up, or down.
+        """
+
+        key = (line, movement_direction)
+        moved = self._cache.get(key)
+
+        if moved == None:
+            mds = gamectrl.MovementDirections
+
+            if movement_direction in (mds.left, mds.up):
+                moved = _move_line_start(line)
+            else:
+                (moved_line, score) = _move_line_start(line[::-1])
+                moved = (moved_line[::-1], score)
+
+            self._cache[key] = moved
+
+        return moved
+
+class _MemoTable:
+    """
+    Memo table
+
+    Memory-mapped file of the doubles, indexed by the packed state. The
+    file is sparse, and the unsolved states are zero, so the values are
+    stored increased by one.
+    """
+
+    def __init__(self, path, header, states_cnt):
+        size = _MEMO_VALUES_OFFSET + 8 * states_cnt
+
+        with open(path, "a+b") as memo_file:
+            memo_file.seek(0)
+            stored_header = memo_file.read(len(header))
+
+            if stored_header == b"":
+                memo_file.write(header)
+                memo_file.truncate(size)
+            elif stored_header != header or \
+                    os.fstat(memo_file.fileno()).st_size != size:
+                raise ValueError(
+                        "memo file {!r} is for the other problem".format(
+                        path))
+
+            self._mmap = mmap.mmap(memo_file.fileno(), size)
+
+        self._values = memoryview(self._mmap)[_MEMO_VALUES_OFFSET:] \
+                .cast("d")
+
+    def get(self, index):
+        """
+        Returns the stored value, or `None` if the state is unsolved
+        """
+
+        stored = self._values[index]
+        return stored - 1.0 if stored != 0.0 else None
+
+    def set(self, index, value):
+        self._values[index] = value + 1.0
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self._values.release()
+        self._mmap.close()
+
+class ExhaustiveSolver:
+    """
+    Exhaustive solver class
+
+    Solves the positions by the expectimax over the full state space,
+    memoized in the memory-mapped file. The state is the board after the
+    new piece appeared, with the player to move. Without the target, the
+    value is the expected score still to be gained, and with it, the
+    probability of reaching the target piece.
+
+    Every tile is packed as the base-2 logarithm of the value, up to the
+    largest exponent, so the memo file has (largest exponent + 1) **
+    (width * height) values. It is sparse, so only the solved states
+    take the disk space, but its size is limited to 2 ** 40 values: the
+    2x2, and 3x3 boards fit, while the 4x4 boards only with the target
+    up to 16. Larger problems are rejected when the solver is made.
+    """
+
+    def __init__(self, memo_path, board_width = 2, board_height = 2,
+            target_value = None, max_value = None,
+            spawn_distribution = gamectrl.UNIFORM_SPAWN_DISTRIBUTION):
+        """
+        Initialization method
+
+        Inputs are: memo file path, board width, and height, target
+        piece value (`None` for the expected score), the largest piece
+        value (the target by default), and the distribution of the new
+        pieces. Memo file is created if it doesn't exist, and has to be
+        made for the same inputs otherwise.
+        """
+
+        if target_value != None:
+            self._objective = _OBJECTIVE_TARGET
+            self._target_exponent = target_value.bit_length() - 1
+            if max_value == None:
+                max_value = target_value
+        else:
+            self._objective = _OBJECTIVE_SCORE
+            self._target_exponent = None
+            if max_value == None:
+                raise ValueError("largest piece value is needed for the "
+                        "expected score")
+
+        self._spawn_outcomes = tuple(
+                (value.bit_length() - 1, probability)
+                for (value, probability) in
+                spawn_distribution.get_outcomes())
+
+        # new pieces can be larger than the low target
+        self._max_exponent = max(max_value.bit_length() - 1,
+                max(exponent for (exponent, probability) in
+                self._spawn_outcomes))
+        if self._max_exponent > 0xff:
+            raise ValueError("largest piece value is too large")
+
+        self._board_wh = (board_width, board_height)
+        self._tiles_cnt = board_width * board_height
+        self._base = self._max_exponent + 1
+
+        states_cnt = self._base ** self._tiles_cnt
+        if states_cnt > _MAX_MEMO_STATES_CNT:
+            raise ValueError("memo of {} states is too large, the limit "
+                    "is {} states".format(states_cnt, _MAX_MEMO_STATES_CNT))
+
+        header = _MEMO_HEADER.pack(_MEMO_MAGIC, _MEMO_VERSION,
+                board_width, board_height, self._max_exponent,
+                self._objective, len(self._spawn_outcomes)) + \
+                b"".join(_MEMO_SPAWN_OUTCOME.pack(exponent, probability)
+                for (exponent, probability) in self._spawn_outcomes)
+
+        self._memo = _MemoTable(memo_path, header, states_cnt)
+        self._line_moves = _LineMoves()
+
+        self._solved_cnt = 0
+
+    # solver info
+    #
+
+    def get_solved_states_cnt(self):
+        """
+        Returns the number of the states solved by this solver object
+        """
+
+        return self._solved_cnt
+
+    # solving
+    #
+
+    def solve(self, board, free_tile_value = 0):
+        """
+        Returns the value of the board, with the player to move
+        """
+
+        state = self._board_to_state(board, free_tile_value)
+        self._solve_state(state)
+
+        return self._memo.get(self._pack(state))
+
+    def get_move_values(self, board, free_tile_value = 0):
+        """
+        Returns the value of every legal move on the board
+
+        Values are given in the dictionary, by the movement direction.
+        """
+
+        state = self._board_to_state(board, free_tile_value)
+        self._solve_state(state)
+
+        return {direction: self._afterstate_value(afterstate, score)
+                for (direction, afterstate, score) in
+                self._get_afterstates(state)}
+
+    def get_best_move(self, board, free_tile_value = 0):
+        """
+        Returns the perfect-play move for the board
+
+        Returns `None` if there are no legal moves.
+        """
+
+        move_values = self.get_move_values(board, free_tile_value)
+
+        if move_values == {}:
+            return None
+
+        return max(gamectrl.MovementDirections,
+                key = lambda direction:
+                move_values.get(direction, -1.0))
+
+    def get_game_best_move(self, game_ctrl):
+        """
+        Returns the perfect-play move for the game controller board
+        """
+
+        return self.get_best_move(game_ctrl.get_board_state(),
+                game_ctrl.get_free_tile_value())
+
+    def solve_start(self):
+        """
+        Returns the value of the game start, averaged over the starting
+        pieces
+        """
+
+        value = 0.0
+
+        for (first_state, first_probability) in \
+                self._get_spawns((0,) * self._tiles_cnt):
+            for (state, probability) in self._get_spawns(first_state):
+                self._solve_state(state)
+                value += first_probability * probability * \
+                        self._memo.get(self._pack(state))
+
+        return value
+
+    def flush(self):
+        self._memo.flush()
+
+    def close(self):
+        self._memo.flush()
+        self._memo.close()
+
+    # auxiliary operations
+    #
+
+    def _board_to_state(self, board, free_tile_value):
+        state = tuple(value.bit_length() - 1
+                if value != free_tile_value else 0
+                for board_row in board for value in board_row)
+
+        if max(state) > self._max_exponent:
+            raise ValueError("piece larger than the largest piece value")
+
+        return state
+
+    def _pack(self, state):
+        index = 0
+
+        for exponent in reversed(state):
+            index = index * self._base + exponent
+
+        return index
+
+    def _get_afterstates(self, state):
+        """
+        Returns the (direction, afterstate, score) of every legal move
+        """
+
+        (bw, bh) = self._board_wh
+        mds = gamectrl.MovementDirections
+
+        rows = [state[row * bw:(row + 1) * bw] for row in range(bh)]
+        cols = [state[col::bw] for col in range(bw)]
+
+        afterstates = []
+
+        for direction in (mds.left, mds.right):
+            moved_rows = [self._line_moves.move(row, direction)
+                    for row in rows]
+            afterstate = tuple(exponent for (moved_row, score) in
+                    moved_rows for exponent in moved_row)
+            if afterstate != state:
+                afterstates.append((direction, afterstate,
+                        sum(score for (moved_row, score) in moved_rows)))
+
+        for direction in (mds.up, mds.down):
+            moved_cols = [self._line_moves.move(col, direction)
+                    for col in cols]
+            afterstate = tuple(moved_cols[col][0][row]
+                    for row in range(bh) for col in range(bw))
+            if afterstate != state:
+                afterstates.append((direction, afterstate,
+                        sum(score for (moved_col, score) in moved_cols)))
+
+        return afterstates
+
+    def _get_spawns(self, afterstate):
+        """
+        Returns the (state, probability) of every new piece
+        """
+
+        free_tiles = [pos for (pos, exponent) in enumerate(afterstate)
+                if exponent == 0]
+
+        return [(afterstate[:pos] + (exponent,) + afterstate[pos + 1:],
+                probability / len(free_tiles))
+                for pos in free_tiles
+                for (exponent, probability) in self._spawn_outcomes]
+
+    def _is_target_reached(self, state):
+        return self._objective == _OBJECTIVE_TARGET and \
+                max(state) >= self._target_exponent
+
+    def _afterstate_value(self, afterstate, score):
+        """
+        Returns the value of the afterstate, with all its new piece
+        states solved
+        """
+
+        if self._is_target_reached(afterstate):
+            return 1.0
+
+        value = 0.0
+        for (state, probability) in self._get_spawns(afterstate):
+            value += probability * self._memo.get(self._pack(state))
+
+        if self._objective == _OBJECTIVE_SCORE:
+            value += score
+
+        return value
+
+    def _solve_state(self, state):
+        """
+        Solve the state, and all the states reachable from it
+
+        Depth-first, with the explicit stack, as the games can be longer
+        than the recursion limit. Pieces only grow, so there are no
+        cycles.
+        """
+
+        memo = self._memo
+        stack = [state]
+
+        while stack != []:
+            state = stack[-1]
+            index = self._pack(state)
+
+            if memo.get(index) != None:
+                stack.pop()
+                continue
+
+            if self._is_target_reached(state):
+                # reached by the new piece, or already on the board
+                memo.set(index, 1.0)
+                self._solved_cnt += 1
+
+                stack.pop()
+                continue
+
+            afterstates = self._get_afterstates(state)
+
+            unsolved = []
+            for (direction, afterstate, score) in afterstates:
+                if max(afterstate) > self._max_exponent:
+                    raise ValueError("piece larger than the largest "
+                            "piece value reached")
+                if self._is_target_reached(afterstate):
+                    continue
+                for (spawned_state, probability) in \
+                        self._get_spawns(afterstate):
+                    if memo.get(self._pack(spawned_state)) == None:
+                        unsolved.append(spawned_state)
+
+            if unsolved != []:
+                # solved after all the reachable states are
+                stack.extend(unsolved)
+                continue
+
+            # no legal moves end the game, with nothing more to gain
+            memo.set(index, max((self._afterstate_value(afterstate, score)
+                    for (direction, afterstate, score) in afterstates),
+                    default = 0.0))
+            self._solved_cnt += 1
+
+            stack.pop()
+
+def _solve_start(board_width, board_height, target_value, memo_path):
+    if target_value == 0:
+        # expected score, with the largest piece the board can hold
+        solver = ExhaustiveSolver(memo_path, board_width, board_height,
+                max_value = 1 << (board_width * board_height + 1))
+    else:
+        solver = ExhaustiveSolver(memo_path, board_width, board_height,
+                target_value = target_value)
+
+    start_time = time.perf_counter()
+    value = solver.solve_start()
+    elapsed = time.perf_counter() - start_time
+
+    print("{}x{} start value: {:.6f}".format(
+            board_width, board_height, value))
+    print("{} states solved in {:.2f} s".format(
+            solver.get_solved_states_cnt(), elapsed))
+
+    solver.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("usage: solver.py WIDTH HEIGHT TARGET|0 [MEMO_FILE]",
+                file = sys.stderr)
+        sys.exit(2)
+
+    _solve_start(int(sys.argv[1]), int(sys.argv[2]), int(sys.argv[3]),
+            sys.argv[4] if len(sys.argv) > 4 else "solver.memo")
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+
+"""
+Game statistics module
+
+Has the `GameStatistics` class, the streaming aggregate of the played
+games, which takes constant memory regardless of the number of games,
+and can be merged with the aggregates made in the other processes, and
+the `SnapshotWriter` class, which stores the aggregate to the disk
+periodically.
+
+Running the module as a script plays the random games in the worker
+processes, and aggregates their statistics.
+"""
+
+from . import gamectrl
+from . import rng
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+class RunningMoments:
+    """
+    Running moments class
+
+    Count, mean, variance, minimum, and maximum of the added values,
+    updated with the Welford's method.
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._mean = 0.0
+        # sum of the squared differences from the mean
+        self._m2 = 0.0
+        self._min = None
+        self._max = None
+
+    def add(self, value):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+
+        if self._min == None or value < self._min:
+            self._min = value
+        if self._max == None or value > self._max:
+            self._max = value
+
+    def merge(self, other):
+        """
+        Add the values aggregated in the other moments
+        """
+
+        if other._count == 0:
+            return
+
+        count = self._count + other._count
+        delta = other._mean - self._mean
+
+        self._mean += delta * other._count / count
+        self._m2 += other._m2 + \
+                delta * delta * self._count * other._count / count
+        self._count = count
+
+        if self._min == None or other._min < self._min:
+            self._min = other._min
+        if self._max == None or other._max > self._max:
+            self._max = other._max
+
+    def get_count(self):
+        return self._count
+
+    def get_mean(self):
+        return self._mean
+
+    def get_variance(self):
+        """
+        Returns the sample variance
+        """
+
+        return self._m2 / (self._count - 1) if self._count > 1 else 0.0
+
+    def get_min(self):
+        return self._min
+
+    def get_max(self):
+        return self._max
+
+    def to_dict(self):
+        return {"count": self._count, "mean": self._mean, "m2": self._m2,
+                "min": self._min, "max": self._max}
+
+    @classmethod
+    def from_dict(cls, data):
+        moments = cls()
+        moments._count = data["count"]
+        moments._mean = data["mean"]
+        moments._m2 = data["m2"]
+        moments._min = data["min"]
+        moments._max = data["max"]
+        return moments
+
+class LogHistogram:
+    """
+    Logarithmic histogram class
+
+    Counts the non-negative integers in the fixed buckets: the values
+    below `_EXACT_LIMIT` have their own buckets, and every larger power
+    of two range is split to `_SUB_BUCKETS_CNT` buckets, so the quantiles
+    are within 1/16 of the true value.
+    """
+
+    _SUB_BUCKETS_BITS = 4
+    _SUB_BUCKETS_CNT = 1 << _SUB_BUCKETS_BITS
+    _EXACT_LIMIT = 2 * _SUB_BUCKETS_CNT
+    # values up to 2 ** 48
+    _BUCKETS_CNT = _EXACT_LIMIT + (48 - _SUB_BUCKETS_BITS) * \
+            _SUB_BUCKETS_CNT
+
+    def __init__(self):
+        self._counts = [0] * LogHistogram._BUCKETS_CNT
+        self._total = 0
+
+    @staticmethod
+    def _bucket_index(value):
+        if value < LogHistogram._EXACT_LIMIT:
+            return value
+
+        shift = value.bit_length() - LogHistogram._SUB_BUCKETS_BITS - 1
+        return LogHistogram._EXACT_LIMIT + \
+                (shift - 1) * LogHistogram._SUB_BUCKETS_CNT + \
+                (value >> shift) - LogHistogram._SUB_BUCKETS_CNT
+
+    @staticmethod
+    def _bucket_bounds(index):
+        """
+        Returns the smallest, and the largest value in the bucket
+        """
+
+        if index < LogHistogram._EXACT_LIMIT:
+            return (index, index)
+
+        (shift, sub_index) = divmod(
+                index - LogHistogram._EXACT_LIMIT,
+                LogHistogram._SUB_BUCKETS_CNT)
+        shift += 1
+        low = (LogHistogram._SUB_BUCKETS_CNT + sub_index) << shift
+
+        return (low, low + (1 << shift) - 1)
+
+    def add(self, value, count = 1):
+        index = min(LogHistogram._bucket_index(value),
+                LogHistogram._BUCKETS_CNT - 1)
+        self._counts[index] += count
+        self._total += count
+
+    def merge(self, other):
+        self._counts = [count + other_count for (count, other_count)
+                in zip(self._counts, other._counts)]
+        self._total += other._total
+
+    def get_total(self):
+        return self._total
+
+    def get_quantile(self, quantile):
+        """
+        Returns the value below which the given fraction of the values
+        are, or `None` if there are no values
+
+        Value is the midpoint of the bucket the quantile falls into.
+        """
+
+        if self._total == 0:
+            return None
+
+        rank = quantile * (self._total - 1)
+        seen = 0
+
+        for (index, count) in enumerate(self._counts):
+            seen += count
+            if seen > rank:
+                (low, high) = LogHistogram._bucket_bounds(index)
+                return (low + high) // 2
+
+        return None
+
+    def to_dict(self):
+        # only the non-empty buckets are stored
+        return {"buckets": [[index, count] for (index, count)
+                in enumerate(self._counts) if count != 0]}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for (index, count) in data["buckets"]:
+            histogram._counts[index] = count
+            histogram._total += count
+        return histogram
+
+class GameStatistics:
+    """
+    Game statistics class
+
+    Aggregates the finished games: score, and move count moments, and
+    quantiles, and the histogram of the largest pieces.
+    """
+
+    # largest pieces are counted by the base-2 logarithm
+    _MAX_TILE_BUCKETS_CNT = 64
+
+    # quantiles reported by the summary
+    _SUMMARY_QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self._score_moments = RunningMoments()
+        self._score_histogram = LogHistogram()
+        self._moves_moments = RunningMoments()
+        self._moves_histogram = LogHistogram()
+        self._max_tile_counts = [0] * \
+                GameStatistics._MAX_TILE_BUCKETS_CNT
+
+    def add_game(self, score, max_tile, moves_cnt):
+        """
+        Add the finished game
+
+        Inputs are: final score, largest piece value, and the number of
+        the moves made.
+        """
+
+        self._score_moments.add(score)
+        self._score_histogram.add(score)
+        self._moves_moments.add(moves_cnt)
+        self._moves_histogram.add(moves_cnt)
+        self._max_tile_counts[max_tile.bit_length() - 1] += 1
+
+    def add_game_ctrl(self, game_ctrl, moves_cnt):
+        """
+        Add the game held by the game controller
+        """
+
+        ftv = game_ctrl.get_free_tile_value()
+        max_tile = max((value for board_row in game_ctrl.get_board_state()
+                for value in board_row if value != ftv), default = 1)
+
+        self.add_game(game_ctrl.get_current_score(), max_tile, moves_cnt)
+
+    def merge(self, other):
+        """
+        Add the games aggregated in the other statistics
+        """
+
+        self._score_moments.merge(other._score_moments)
+        self._score_histogram.merge(other._score_histogram)
+        self._moves_moments.merge(other._moves_moments)
+        self._moves_histogram.merge(other._moves_histogram)
+        self._max_tile_counts = [count + other_count
+                for (count, other_count) in
+                zip(self._max_tile_counts, other._max_tile_counts)]
+
+    def get_games_cnt(self):
+        return self._score_moments.get_count()
+
+    def get_summary(self):
+        """
+        Returns the summary, as the dictionary
+
+        Has the games count, and for the score, and the move count, the
+        mean, standard deviation, minimum, maximum, and the quantiles.
+        Largest pieces are given as the piece value to the games count
+        mapping.
+        """
+
+        def describe(moments, histogram):
+            description = {
+                    "mean": moments.get_mean(),
+                    "std": moments.get_variance() ** 0.5,
+                    "min": moments.get_min(),
+                    "max": moments.get_max()}
+            for quantile in GameStatistics._SUMMARY_QUANTILES:
+                description["p{:g}".format(quantile * 100)] = \
+                        histogram.get_quantile(quantile)
+            return description
+
+        return {
+                "games": self.get_games_cnt(),
+                "score": describe(
+                        self._score_moments, self._score_histogram),
+                "moves": describe(
+                        self._moves_moments, self._moves_histogram),
+                "max_tile": {str(1 << exponent): count
+                        for (exponent, count) in
+                        enumerate(self._max_tile_counts) if count != 0}}
+
+    def to_dict(self):
+        """
+        Returns the aggregate as the JSON-compatible dictionary
+        """
+
+        return {
+                "score_moments": self._score_moments.to_dict(),
+                "score_histogram": self._score_histogram.to_dict(),
+                "moves_moments": self._moves_moments.to_dict(),
+                "moves_histogram": self._moves_histogram.to_dict(),
+                "max_tile_counts": self._max_tile_counts}
+
+    @classmethod
+    def from_dict(cls, data):
+        statistics = cls()
+        statistics._score_moments = RunningMoments.from_dict(
+                data["score_moments"])
+        statistics._score_histogram = LogHistogram.from_dict(
+                data["score_histogram"])
+        statistics._moves_moments = RunningMoments.from_dict(
+                data["moves_moments"])
+        statistics._moves_histogram = LogHistogram.from_dict(
+                data["moves_histogram"])
+        statistics._max_tile_counts = list(data["max_tile_counts"])
+        return statistics
+
+class SnapshotWriter:
+    """
+    Snapshot writer class
+
+    Stores the statistics, with their summary, to the JSON file, at most
+    once per the period. File is replaced atomically, so it always holds
+    the complete snapshot.
+    """
+
+    def __init__(self, path, period = 10.0):
+        """
+        Initialization method
+
+        Inputs are: snapshot file path, and the period, in seconds.
+        """
+
+        self._path = path
+        self._period = period
+        self._last_write_time = None
+
+    def update(self, statistics, force = False):
+        """
+        Write the snapshot if the period has passed since the last one
+
+        Returns true value if the snapshot was written.
+        """
+
+        now = time.monotonic()
+
+        if not force and self._last_write_time != None and \
+                now - self._last_write_time < self._period:
+            return False
+
+        snapshot = {
+                "time": time.time(),
+                "summary": statistics.get_summary(),
+                "statistics": statistics.to_dict()}
+
+        (fd, temp_path) = tempfile.mkstemp(
+                dir = os.path.dirname(os.path.abspath(self._path)))
+        try:
+            with os.fdopen(fd, "w") as temp_file:
+                json.dump(snapshot, temp_file)
+            os.replace(temp_path, self._path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self._last_write_time = now
+        return True
+
+def load_snapshot(path):
+    """
+    Returns the statistics stored in the snapshot file
+    """
+
+    with open(path) as snapshot_file:
+        snapshot = json.load(snapshot_file)
+
+    return GameStatistics.from_dict(snapshot["statistics"])
+
+# random streams of one game
+_BOARD_STREAM = 0
+_MOVES_STREAM = 1
+
+def _play_random_games(master_seed, first_game_index, games_cnt):
+    """
+    Play the games with the random moves, and returns their aggregate,
+    as the dictionary
+
+    Every game is seeded from the master seed, and its index, so the
+    aggregate doesn't depend on the chunks, and the workers.
+    """
+
+    game_random = rng.BlockRandom()
+    moves_random = rng.BlockRandom()
+
+    game_ctrl = gamectrl.GameController(random_generator = game_random)
+    headless = gamectrl.HeadlessController()
+    game_ctrl.attach_output(headless)
+    game_ctrl.attach_input(headless)
+    game_ctrl.resume_game()
+
+    directions = tuple(gamectrl.MovementDirections)
+    statistics = GameStatistics()
+
+    for game_index in range(first_game_index,
+            first_game_index + games_cnt):
+        game_random.seed(rng.derive_seed(master_seed, game_index,
+                _BOARD_STREAM))
+        moves_random.seed(rng.derive_seed(master_seed, game_index,
+                _MOVES_STREAM))
+        game_ctrl.reset_game()
+        moves_cnt = 0
+
+        while not game_ctrl.is_endgame():
+            legal_moves = game_ctrl.legal_moves()
+            # in the fixed order, so the games are reproducible
+            game_ctrl.move_pieces(moves_random.choice(
+                    [direction for direction in directions
+                    if direction in legal_moves]))
+            moves_cnt += 1
+
+        statistics.add_game_ctrl(game_ctrl, moves_cnt)
+
+    return statistics.to_dict()
+
+def _simulate(games_cnt, snapshot_path = None, master_seed = 0,
+        workers_cnt = None, chunk_games_cnt = 100):
+    """
+    Play the random games in the worker processes, merge their partial
+    aggregates, and write the snapshots
+    """
+
+    import multiprocessing
+
+    statistics = GameStatistics()
+    writer = SnapshotWriter(snapshot_path) if snapshot_path != None \
+            else None
+
+    # chunks are made as the pool takes them, not all up front
+    chunks = ((master_seed, first_game_index,
+            min(chunk_games_cnt, games_cnt - first_game_index))
+            for first_game_index in
+            range(0, games_cnt, chunk_games_cnt))
+
+    start_time = time.perf_counter()
+
+    with multiprocessing.Pool(workers_cnt) as pool:
+        # merged in the order, so the floating-point sums are the same
+        # for any number of the workers
+        for chunk_data in pool.imap(_play_random_games_chunk, chunks):
+            statistics.merge(GameStatistics.from_dict(chunk_data))
+            if writer != None:
+                writer.update(statistics)
+
+    elapsed = time.perf_counter() - start_time
+
+    if writer != None:
+        writer.update(statistics, force = True)
+
+    print(json.dumps(statistics.get_summary(), indent = 2))
+    print("{:.0f} games/s".format(games_cnt / elapsed))
+
+def _play_random_games_chunk(chunk):
+    return _play_random_games(*chunk)
+
+if __name__ == "__main__":
+    _simulate(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+            sys.argv[2] if len(sys.argv) > 2 else None,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 0)
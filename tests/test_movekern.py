@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+Move kernel tests
+
+Check the compiled move kernel against the pure-Python game logic, and
+the pure-Python board against the AI bitboard moves, so both backends
+are covered even when the kernel is not compiled.
+
+Run with:
+
+    python3 -m unittest tests.test_movekern
+"""
+
+from components import ai
+from components import gamectrl
+from components import movekern
+
+import random
+import unittest
+
+_BOARDS_CNT = 2000
+_SEED = 2048
+
+def _random_bits(rng):
+    # ranks up to 11, so the merges never go above the 4-bit rank
+    bits = 0
+    for shift in range(0, 64, 4):
+        bits |= rng.choice((0, 0, rng.randint(1, 11))) << shift
+    return bits
+
+def _set_board_bits(game_ctrl, bits):
+    game_ctrl._board.reset_board()
+    for row in range(4):
+        for col in range(4):
+            rank = (bits >> (16 * row + 4 * col)) & 0xf
+            if rank != 0:
+                game_ctrl._board.set_tile(row, col, 2 ** rank)
+
+class PythonBackendTest(unittest.TestCase):
+    """
+    Pure-Python board checked against the AI bitboard moves
+    """
+
+    def test_moves_match_bitboard(self):
+        rng = random.Random(_SEED)
+        game_ctrl = gamectrl.GameController(use_move_kernel = False)
+
+        for board_index in range(_BOARDS_CNT):
+            bits = _random_bits(rng)
+
+            for md in gamectrl.MovementDirections:
+                _set_board_bits(game_ctrl, bits)
+                moved = game_ctrl._move_board_pieces(md)[1]
+                moved_bits = ai.move_board_bits(bits, md)
+
+                self.assertEqual(ai.board_to_bits(game_ctrl), moved_bits,
+                        "board {:016x} {}".format(bits, md.name))
+                self.assertEqual(bool(moved), moved_bits != bits,
+                        "board {:016x} {}".format(bits, md.name))
+
+@unittest.skipUnless(movekern.is_loaded(), "move kernel is not compiled")
+class KernelBackendTest(unittest.TestCase):
+    """
+    Compiled kernel checked against the pure-Python game logic
+    """
+
+    def test_parity(self):
+        self.assertEqual(movekern.check_parity(_BOARDS_CNT, _SEED), [])
+
+    def test_evaluation_parity(self):
+        rng = random.Random(_SEED)
+        py_searcher = ai._Searcher(None, (), use_move_kernel = False)
+        kern_searcher = ai._Searcher(None, ())
+
+        for board_index in range(_BOARDS_CNT):
+            bits = rng.getrandbits(64)
+            self.assertEqual(py_searcher._heuristic(bits),
+                    kern_searcher._heuristic(bits),
+                    "board {:016x}".format(bits))
+
+if __name__ == "__main__":
+    unittest.main()